@@ -0,0 +1,73 @@
+"""
+Benchmark the memory-mapped product catalog at millions of SKUs.
+
+Builds a synthetic catalog file with recommendation_service/catalog.py, then
+reports file size, open time, random id lookup rate, a category scan and how
+much resident memory the process gained while doing so.
+
+    python benchmarks/bench_catalog.py --products 5000000
+"""
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "recommendation_service"))
+sys.path.insert(1, os.path.join(os.path.dirname(__file__), "..", "common"))
+
+from catalog import Catalog, build_catalog
+
+
+def rss_mb(kind: str) -> float:
+    # Linux only. RssFile counts touched catalog pages, which are shared
+    # page cache; RssAnon is memory private to this process.
+    with open("/proc/self/status") as f:
+        for line in f:
+            if line.startswith(kind + ":"):
+                return int(line.split()[1]) / 1024
+    return 0.0
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--products", type=int, default=5_000_000)
+    parser.add_argument("--categories", type=int, default=500)
+    parser.add_argument("--lookups", type=int, default=200_000)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "catalog.bin")
+        started = time.perf_counter()
+        build_catalog(
+            (
+                {"product_id": 1_000_000 + i * 3, "name": f"Product {i}", "category": f"Category {i % args.categories}"}
+                for i in range(args.products)
+            ),
+            path,
+        )
+        print(f"build {args.products:,} SKUs: {time.perf_counter() - started:.2f}s, "
+              f"{os.path.getsize(path) / 2**20:.1f} MiB on disk")
+
+        anon_before, file_before = rss_mb("RssAnon"), rss_mb("RssFile")
+        started = time.perf_counter()
+        catalog = Catalog(path)
+        print(f"open: {(time.perf_counter() - started) * 1000:.2f}ms")
+
+        ids = [1_000_000 + random.randrange(args.products) * 3 for _ in range(args.lookups)]
+        started = time.perf_counter()
+        for product_id in ids:
+            catalog.get(product_id)
+        elapsed = time.perf_counter() - started
+        print(f"{args.lookups:,} random id lookups: {elapsed:.2f}s ({elapsed / args.lookups * 1e6:.2f}us each)")
+
+        started = time.perf_counter()
+        count = sum(1 for _ in catalog.in_category("Category 7"))
+        print(f"category scan ({count:,} products): {time.perf_counter() - started:.3f}s")
+        print(f"RSS growth: {rss_mb('RssAnon') - anon_before:.1f} MiB private, "
+              f"{rss_mb('RssFile') - file_before:.1f} MiB shared file-backed")
+
+
+if __name__ == "__main__":
+    main()
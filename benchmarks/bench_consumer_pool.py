@@ -0,0 +1,78 @@
+"""
+Benchmark ORDER_PLACED throughput against the number of consumer workers.
+
+Drives recommendation_service/workers.py with stand-in bus deliveries
+submitted from the main thread, as the consumer thread does. Handlers sleep
+to model the user_service call, database write and publish, and the run
+checks that every user's events were handled in delivery order.
+
+    python benchmarks/bench_consumer_pool.py --messages 2000 --latency-ms 10
+"""
+import argparse
+import os
+import sys
+import threading
+import time
+from collections import defaultdict
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "recommendation_service"))
+sys.path.insert(1, os.path.join(os.path.dirname(__file__), "..", "common"))
+
+from workers import OrderedWorkerPool
+
+
+class AckCounter:
+    def __init__(self, messages: int):
+        self.remaining = messages
+        self.done = threading.Event()
+        self.lock = threading.Lock()
+
+    def ack(self):
+        with self.lock:
+            self.remaining -= 1
+            if not self.remaining:
+                self.done.set()
+
+    def nack(self, requeue: bool = False):
+        raise AssertionError("delivery was nacked")
+
+
+def run(workers: int, messages: int, users: int, latency: float) -> float:
+    handled = defaultdict(list)
+    lock = threading.Lock()
+
+    def handler(message):
+        time.sleep(latency)
+        with lock:
+            handled[message["userId"]].append(message["sequence"])
+
+    delivery = AckCounter(messages)
+    pool = OrderedWorkerPool(workers, handler)
+    started = time.perf_counter()
+    for tag in range(messages):
+        user_id = tag % users
+        pool.submit(user_id, delivery, {"userId": user_id, "sequence": tag})
+    delivery.done.wait()
+    elapsed = time.perf_counter() - started
+    pool.stop()
+
+    for sequences in handled.values():
+        assert sequences == sorted(sequences), "per-user ordering violated"
+    return elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--messages", type=int, default=2000)
+    parser.add_argument("--users", type=int, default=500)
+    parser.add_argument("--latency-ms", type=float, default=10.0)
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4, 8, 16])
+    args = parser.parse_args()
+
+    for workers in args.workers:
+        elapsed = run(workers, args.messages, args.users, args.latency_ms / 1000)
+        print(f"workers={workers:>3} {args.messages / elapsed:8.0f} msg/s ({elapsed:.2f}s)")
+
+
+if __name__ == "__main__":
+    main()
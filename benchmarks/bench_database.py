@@ -0,0 +1,112 @@
+"""
+Benchmark concurrent read and write throughput on SQLite before and after
+the shared engine factory in common/storage.py.
+
+"before" is the engine every service used to build: default journal mode,
+full sync on each commit, SQLAlchemy's default pool. "after" is
+create_service_engine: WAL, synchronous=NORMAL, mmap and a busy timeout on
+a QueuePool. Writers insert one row per transaction, as placing an order or
+storing a notification does; readers fetch one user's rows by indexed key.
+
+    python benchmarks/bench_database.py --readers 8 --writers 2 --seconds 10
+"""
+import argparse
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "common"))
+
+from sqlalchemy import create_engine, text
+
+from storage import create_service_engine, pool_stats
+
+USERS = 10000
+
+
+def setup(engine, rows: int):
+    with engine.begin() as connection:
+        connection.execute(text(
+            "CREATE TABLE events (id INTEGER PRIMARY KEY, userId INTEGER NOT NULL, payload TEXT NOT NULL)"
+        ))
+        connection.execute(text("CREATE INDEX ix_events_userId ON events (userId)"))
+        connection.execute(
+            text("INSERT INTO events (userId, payload) VALUES (:userId, :payload)"),
+            [{"userId": i % USERS, "payload": "x" * 64} for i in range(rows)],
+        )
+
+
+def run(engine, readers: int, writers: int, seconds: float) -> dict:
+    counts = {"reads": 0, "writes": 0, "errors": 0}
+    lock = threading.Lock()
+    deadline = time.perf_counter() + seconds
+
+    def worker(write: bool):
+        done = errors = 0
+        rng = random.Random()
+        while time.perf_counter() < deadline:
+            try:
+                if write:
+                    with engine.begin() as connection:
+                        connection.execute(
+                            text("INSERT INTO events (userId, payload) VALUES (:userId, :payload)"),
+                            {"userId": rng.randrange(USERS), "payload": "y" * 64},
+                        )
+                else:
+                    with engine.connect() as connection:
+                        connection.execute(
+                            text("SELECT id, payload FROM events WHERE userId = :userId"),
+                            {"userId": rng.randrange(USERS)},
+                        ).fetchall()
+                done += 1
+            except Exception:
+                errors += 1
+        with lock:
+            counts["writes" if write else "reads"] += done
+            counts["errors"] += errors
+
+    threads = [threading.Thread(target=worker, args=(False,)) for _ in range(readers)]
+    threads += [threading.Thread(target=worker, args=(True,)) for _ in range(writers)]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+    return {
+        "reads/s": counts["reads"] / elapsed,
+        "writes/s": counts["writes"] / elapsed,
+        "errors": counts["errors"],
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=200000)
+    parser.add_argument("--readers", type=int, default=8)
+    parser.add_argument("--writers", type=int, default=2)
+    parser.add_argument("--seconds", type=float, default=10.0)
+    args = parser.parse_args()
+
+    factories = {
+        "before": lambda url: create_engine(url, connect_args={"check_same_thread": False}),
+        "after": create_service_engine,
+    }
+    for label, factory in factories.items():
+        with tempfile.TemporaryDirectory() as tmp:
+            engine = factory(f"sqlite:///{os.path.join(tmp, 'bench.db')}")
+            setup(engine, args.rows)
+            result = run(engine, args.readers, args.writers, args.seconds)
+            print(
+                f"{label:<7} readers={args.readers} writers={args.writers} "
+                f"{result['reads/s']:9.0f} reads/s {result['writes/s']:8.0f} writes/s "
+                f"errors={result['errors']} pool={pool_stats(engine)['pool']}"
+            )
+            engine.dispose()
+
+
+if __name__ == "__main__":
+    main()
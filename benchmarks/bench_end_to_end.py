@@ -0,0 +1,487 @@
+"""
+End-to-end load and latency benchmark for the whole stack.
+
+Starts all five FastAPI apps in this process, each on its own uvicorn server
+and throwaway SQLite database, with pika.BlockingConnection replaced by an
+in-memory loopback broker. Workloads go through the GraphQL gateway exactly
+as a client would:
+
+  register     one user per virtual user, opted in to everything
+  login        one login per user
+  dashboard    me + orders + recommendations + userNotifications
+  placeOrder   bursts of concurrent orders
+  markRead     every unread notification, after the events settle
+
+Reported as JSON: p50/p95/p99 latency per operation, the event latency from
+sending placeOrder to the resulting recommendation notification being
+stored, and per-queue lag (time published messages waited for a consumer)
+and message size. Set EVENT_ENCODING=binary to publish struct-packed events.
+Everything shares one interpreter, so absolute latencies run higher than
+in a deployment; compare runs made with the same settings.
+
+With --monolith the apps are served the way monolith/monolith.py runs
+them instead: one server, the in-process message bus and in-process calls
+from the gateway to the services. Queue statistics come from the loopback
+broker, so they are empty in that mode.
+
+    python benchmarks/bench_end_to_end.py --users 50 --order-bursts 5 --output run.json
+    python benchmarks/bench_end_to_end.py --users 50 --order-bursts 5 --monolith
+"""
+import argparse
+import json
+import logging
+import os
+import shutil
+import socket
+import sys
+import tempfile
+import threading
+import time
+import uuid
+from collections import defaultdict, deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, List, Optional
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "monolith"))
+
+from monolith import SERVICES, create_app, load_services
+
+DASHBOARD_QUERY = """
+query Dashboard {
+  me { id name email preferences { promotions orderUpdates recommendations } }
+  orders { id status productIds }
+  recommendations { id productId reason score }
+  userNotifications { id type content read }
+}
+"""
+NOTIFICATIONS_QUERY = "query { userNotifications { id } }"
+REGISTER_MUTATION = """
+mutation Register($input: UserRegisterInput!) {
+  register(userInput: $input) { id }
+}
+"""
+LOGIN_MUTATION = """
+mutation Login($input: UserLoginInput!) {
+  login(loginInput: $input) { token userId }
+}
+"""
+PLACE_ORDER_MUTATION = """
+mutation PlaceOrder($input: PlaceOrderInput!) {
+  placeOrder(orderInput: $input) { id }
+}
+"""
+MARK_READ_MUTATION = """
+mutation MarkRead($id: Int!) {
+  markNotificationRead(notificationId: $id)
+}
+"""
+PRODUCT_IDS = list(range(101, 111)) + list(range(201, 211))
+
+
+def percentiles(samples: List[float]) -> dict:
+    ordered = sorted(samples)
+
+    def at(p: float) -> Optional[float]:
+        if not ordered:
+            return None
+        return round(ordered[min(len(ordered) - 1, int(p * len(ordered)))] * 1000, 2)
+
+    return {"count": len(ordered), "p50": at(0.50), "p95": at(0.95), "p99": at(0.99), "max": at(1.0)}
+
+
+class LoopbackQueue:
+    def __init__(self, name: str):
+        self.name = name
+        self.messages = deque()
+        self.published = 0
+        self.delivered = 0
+        self.acked = 0
+        self.nacked = 0
+        self.max_depth = 0
+        self.bytes = 0
+        self.waits: List[float] = []
+
+    def stats(self) -> dict:
+        return {
+            "published": self.published,
+            "delivered": self.delivered,
+            "acked": self.acked,
+            "nacked": self.nacked,
+            "depth": len(self.messages),
+            "maxDepth": self.max_depth,
+            "bodyBytesPerMessage": round(self.bytes / self.published, 1) if self.published else None,
+            "lagMs": percentiles(self.waits),
+        }
+
+
+class LoopbackBroker:
+    """
+    Just enough of RabbitMQ's default exchange for the services: durable
+    queues named by routing key, prefetch, manual acks and
+    add_callback_threadsafe. One condition variable guards everything.
+    """
+
+    def __init__(self):
+        self.cond = threading.Condition()
+        self.queues: Dict[str, LoopbackQueue] = {}
+
+    def queue(self, name: str) -> LoopbackQueue:
+        with self.cond:
+            if name not in self.queues:
+                self.queues[name] = LoopbackQueue(name)
+            return self.queues[name]
+
+    def connect(self, parameters=None) -> "LoopbackConnection":
+        return LoopbackConnection(self)
+
+    def stats(self) -> dict:
+        with self.cond:
+            return {name: queue.stats() for name, queue in sorted(self.queues.items())}
+
+
+class _Delivery:
+    def __init__(self, delivery_tag: int, routing_key: str):
+        self.delivery_tag = delivery_tag
+        self.routing_key = routing_key
+
+
+class LoopbackConnection:
+    def __init__(self, broker: LoopbackBroker):
+        self.broker = broker
+        self.callbacks = deque()
+        self.is_open = True
+
+    @property
+    def is_closed(self) -> bool:
+        return not self.is_open
+
+    def channel(self) -> "LoopbackChannel":
+        return LoopbackChannel(self)
+
+    def add_callback_threadsafe(self, callback: Callable[[], None]):
+        with self.broker.cond:
+            self.callbacks.append(callback)
+            self.broker.cond.notify_all()
+
+    def close(self):
+        with self.broker.cond:
+            self.is_open = False
+            self.broker.cond.notify_all()
+
+
+class LoopbackChannel:
+    def __init__(self, connection: LoopbackConnection):
+        self.connection = connection
+        self.broker = connection.broker
+        self.prefetch = 0
+        self.consumers: List[tuple] = []
+        self.unacked: Dict[int, LoopbackQueue] = {}
+        self._next_tag = 0
+        self._next_consumer = 0
+        self._consuming = False
+
+    def queue_declare(self, queue: str, durable: bool = False, **kwargs):
+        self.broker.queue(queue)
+
+    def basic_qos(self, prefetch_count: int = 0, **kwargs):
+        self.prefetch = prefetch_count
+
+    def basic_publish(self, exchange: str, routing_key: str, body, properties=None, **kwargs):
+        with self.broker.cond:
+            queue = self.broker.queue(routing_key)
+            queue.messages.append((body, properties, time.perf_counter()))
+            queue.published += 1
+            queue.bytes += len(body)
+            queue.max_depth = max(queue.max_depth, len(queue.messages))
+            self.broker.cond.notify_all()
+
+    def basic_consume(self, queue: str, on_message_callback, auto_ack: bool = False, **kwargs):
+        self.consumers.append((self.broker.queue(queue), on_message_callback))
+
+    def basic_ack(self, delivery_tag: int, multiple: bool = False):
+        with self.broker.cond:
+            queue = self.unacked.pop(delivery_tag, None)
+            if queue:
+                queue.acked += 1
+            self.broker.cond.notify_all()
+
+    def basic_nack(self, delivery_tag: int, multiple: bool = False, requeue: bool = True):
+        with self.broker.cond:
+            queue = self.unacked.pop(delivery_tag, None)
+            if queue:
+                queue.nacked += 1
+            self.broker.cond.notify_all()
+
+    def stop_consuming(self):
+        with self.broker.cond:
+            self._consuming = False
+            self.broker.cond.notify_all()
+
+    def _next_delivery(self):
+        if self.prefetch and len(self.unacked) >= self.prefetch:
+            return None
+        for offset in range(len(self.consumers)):
+            index = (self._next_consumer + offset) % len(self.consumers)
+            queue, callback = self.consumers[index]
+            if queue.messages:
+                body, properties, published_at = queue.messages.popleft()
+                self._next_consumer = index + 1
+                self._next_tag += 1
+                self.unacked[self._next_tag] = queue
+                queue.delivered += 1
+                queue.waits.append(time.perf_counter() - published_at)
+                return callback, _Delivery(self._next_tag, queue.name), properties, body
+        return None
+
+    def start_consuming(self):
+        self._consuming = True
+        while True:
+            with self.broker.cond:
+                while True:
+                    if not (self._consuming and self.connection.is_open):
+                        return
+                    if self.connection.callbacks:
+                        work = self.connection.callbacks.popleft()
+                        break
+                    delivery = self._next_delivery()
+                    if delivery:
+                        callback, method, properties, body = delivery
+                        work = lambda: callback(self, method, properties, body)
+                        break
+                    self.broker.cond.wait()
+            work()
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def start_server(app, port: int):
+    import uvicorn
+
+    server = uvicorn.Server(uvicorn.Config(app, host="127.0.0.1", port=port, log_level="warning", access_log=False))
+    thread = threading.Thread(target=server.run, daemon=True)
+    thread.start()
+    while not server.started:
+        if not thread.is_alive():
+            raise RuntimeError(f"server on port {port} failed to start")
+        time.sleep(0.05)
+    return server, thread
+
+
+class EventLatency:
+    """Pairs each placed order with the next recommendation notification stored for its user."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.pending: Dict[int, deque] = defaultdict(deque)
+        self.samples: List[float] = []
+        self.unmatched = 0
+
+    def order_sent(self, user_id: int, started: float):
+        with self.lock:
+            self.pending[user_id].append(started)
+
+    def notification_stored(self, user_id: int):
+        now = time.perf_counter()
+        with self.lock:
+            if self.pending[user_id]:
+                self.samples.append(now - self.pending[user_id].popleft())
+            else:
+                self.unmatched += 1
+
+    def outstanding(self) -> int:
+        with self.lock:
+            return sum(len(sent) for sent in self.pending.values())
+
+
+class Client:
+    def __init__(self, url: str):
+        import requests
+
+        self.url = url
+        self._local = threading.local()
+        self._requests = requests
+        self.lock = threading.Lock()
+        self.latencies: Dict[str, List[float]] = defaultdict(list)
+        self.errors: Dict[str, int] = defaultdict(int)
+
+    def _session(self):
+        if not hasattr(self._local, "session"):
+            self._local.session = self._requests.Session()
+        return self._local.session
+
+    def call(self, operation: str, query: str, variables: Optional[dict] = None, token: Optional[str] = None):
+        headers = {"Authorization": f"Bearer {token}"} if token else {}
+        started = time.perf_counter()
+        try:
+            response = self._session().post(self.url, json={"query": query, "variables": variables or {}}, headers=headers)
+            payload = response.json()
+            ok = response.status_code == 200 and not payload.get("errors")
+        except Exception:
+            payload, ok = None, False
+        elapsed = time.perf_counter() - started
+        with self.lock:
+            self.latencies[operation].append(elapsed)
+            if not ok:
+                self.errors[operation] += 1
+        return payload.get("data") if ok else None
+
+    def report(self) -> dict:
+        with self.lock:
+            return {
+                operation: {**percentiles(samples), "errors": self.errors.get(operation, 0)}
+                for operation, samples in sorted(self.latencies.items())
+            }
+
+
+def run_workload(client: Client, events: EventLatency, args) -> None:
+    run_id = uuid.uuid4().hex[:8]
+    pool = ThreadPoolExecutor(max_workers=args.concurrency)
+
+    def register(index: int):
+        client.call("register", REGISTER_MUTATION, {"input": {
+            "name": f"user {index}",
+            "email": f"bench-{run_id}-{index}@example.com",
+            "password": "benchmark",
+            "preferences": {"promotions": True, "orderUpdates": True, "recommendations": True},
+        }})
+
+    def login(index: int):
+        data = client.call("login", LOGIN_MUTATION, {"input": {
+            "email": f"bench-{run_id}-{index}@example.com", "password": "benchmark",
+        }})
+        return (data["login"]["userId"], data["login"]["token"]) if data else None
+
+    list(pool.map(register, range(args.users)))
+    sessions = [session for session in pool.map(login, range(args.users)) if session]
+
+    def dashboard(session):
+        for _ in range(args.dashboard_queries):
+            client.call("dashboard", DASHBOARD_QUERY, token=session[1])
+
+    list(pool.map(dashboard, sessions))
+
+    def place_order(session, product_index: int):
+        user_id, token = session
+        products = [PRODUCT_IDS[(product_index + offset) % len(PRODUCT_IDS)] for offset in range(args.products_per_order)]
+        events.order_sent(user_id, time.perf_counter())
+        client.call("placeOrder", PLACE_ORDER_MUTATION, {"input": {"userId": user_id, "productIds": products}}, token=token)
+
+    for burst in range(args.order_bursts):
+        futures = [
+            pool.submit(place_order, session, burst * args.orders_per_burst + order + index)
+            for index, session in enumerate(sessions)
+            for order in range(args.orders_per_burst)
+        ]
+        for future in futures:
+            future.result()
+        time.sleep(args.burst_interval)
+
+    deadline = time.monotonic() + args.settle_seconds
+    while events.outstanding() and time.monotonic() < deadline:
+        time.sleep(0.1)
+
+    def mark_read(session):
+        data = client.call("notifications", NOTIFICATIONS_QUERY, token=session[1])
+        for notification in (data or {}).get("userNotifications", []):
+            client.call("markRead", MARK_READ_MUTATION, {"id": notification["id"]}, token=session[1])
+
+    list(pool.map(mark_read, sessions))
+    pool.shutdown()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, default=50)
+    parser.add_argument("--concurrency", type=int, default=16, help="client threads")
+    parser.add_argument("--dashboard-queries", type=int, default=5, help="per user")
+    parser.add_argument("--order-bursts", type=int, default=5)
+    parser.add_argument("--orders-per-burst", type=int, default=1, help="per user")
+    parser.add_argument("--products-per-order", type=int, default=2)
+    parser.add_argument("--burst-interval", type=float, default=1.0, help="seconds between bursts")
+    parser.add_argument("--settle-seconds", type=float, default=30.0, help="max wait for outstanding events")
+    parser.add_argument("--bcrypt-rounds", type=int, default=12)
+    parser.add_argument("--monolith", action="store_true", help="serve every app from one in-process monolith")
+    parser.add_argument("--output", help="write the JSON report here instead of stdout")
+    args = parser.parse_args()
+
+    import pika
+
+    broker = LoopbackBroker()
+    pika.BlockingConnection = broker.connect
+    os.environ["MESSAGE_BUS"] = "memory" if args.monolith else "rabbitmq"
+
+    tmp = tempfile.mkdtemp(prefix="bench_e2e_")
+    ports = {directory: free_port() for directory, _ in SERVICES}
+    os.environ.update({
+        "USER_SERVICE_URL": f"http://127.0.0.1:{ports['user_service']}",
+        "ORDER_SERVICE_URL": f"http://127.0.0.1:{ports['order_service']}",
+        "NOTIF_SERVICE_URL": f"http://127.0.0.1:{ports['notification_service']}",
+        "RECOMMEND_SERVICE_URL": f"http://127.0.0.1:{ports['recommendation_service']}",
+        "BCRYPT_ROUNDS": str(args.bcrypt_rounds),
+        "CATALOG_PATH": os.path.join(tmp, "catalog.bin"),
+        "PREFERENCE_SNAPSHOT_PATH": os.path.join(tmp, "user_preferences.snapshot"),
+        # Keep the periodic all-users recommendation run out of the
+        # measurement; only ORDER_PLACED should produce notifications.
+        "RECOMMENDATION_INTERVAL_SECONDS": "86400",
+    })
+    env = {
+        directory: {"DATABASE_URL": f"sqlite:///{os.path.join(tmp, directory)}.db"}
+        for directory, _ in SERVICES
+    }
+    # Configured first so the services' own basicConfig(level=INFO) calls
+    # are no-ops and per-event logging stays out of the measurement.
+    logging.basicConfig(level=logging.WARNING)
+    services = load_services(env)
+
+    events = EventLatency()
+    notification_consumer = services["notification_service"]["consumer"]
+    store_notification = notification_consumer.handle_new_recommendation
+
+    def handle_new_recommendation(data, db):
+        store_notification(data, db)
+        events.notification_stored(data.get("userId"))
+
+    notification_consumer.handle_new_recommendation = handle_new_recommendation
+
+    servers = []
+    if args.monolith:
+        servers.append(start_server(create_app(services), ports["graphql_gateway"]))
+    else:
+        for directory, module in SERVICES:
+            servers.append(start_server(services[directory][module].app, ports[directory]))
+
+    client = Client(f"http://127.0.0.1:{ports['graphql_gateway']}/graphql")
+    started = time.perf_counter()
+    run_workload(client, events, args)
+    elapsed = time.perf_counter() - started
+
+    report = {
+        "config": {key: value for key, value in vars(args).items() if key != "output"},
+        "elapsedSeconds": round(elapsed, 2),
+        "operations": client.report(),
+        "eventLatencyMs": {
+            **percentiles(events.samples),
+            "outstanding": events.outstanding(),
+            "unmatched": events.unmatched,
+        },
+        "queues": broker.stats(),
+    }
+    for server, thread in reversed(servers):
+        server.should_exit = True
+        thread.join(timeout=10)
+    shutil.rmtree(tmp, ignore_errors=True)
+
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output + "\n")
+    else:
+        print(output)
+
+
+if __name__ == "__main__":
+    main()
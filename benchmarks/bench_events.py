@@ -0,0 +1,85 @@
+"""
+Microbenchmark event encoding and decoding, and measure bytes per event.
+
+Compares, for every event type in common/events.py:
+
+  legacy   bare json.dumps / json.loads, as publishers did before
+  json     events.encode / decode with schema validation, JSON encoding
+  binary   events.encode / decode with the struct-packed encoding
+
+"body" is the message body; "frame" adds the encoded AMQP content header
+properties the publishers send (content_type, delivery_mode, the publish
+time header and, with --traced, the trace context; legacy publishers sent
+no headers), which is what the broker stores and ships per message besides
+its fixed framing.
+
+    python benchmarks/bench_events.py --iterations 200000
+"""
+import argparse
+import json
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "common"))
+
+import pika
+
+import events
+
+SAMPLES = {
+    "ORDER_PLACED": {"orderId": 123456, "userId": 98765, "status": "placed", "productIds": [101, 205, 107]},
+    "ORDER_STATUS_UPDATE": {"orderId": 123456, "userId": 98765, "status": "shipped"},
+    "NEW_RECOMMENDATION": {"userId": 98765, "content": "Recommended product Wireless Mouse (Product ID: 205) "},
+    "USER_PREFERENCES_UPDATED": {
+        "userId": 98765,
+        "preferences": {"promotions": False, "orderUpdates": True, "recommendations": True},
+    },
+}
+
+
+def properties_size(content_type, traced: bool) -> int:
+    headers = None
+    if content_type is not None:
+        headers = {"x-published-at-us": 1_700_000_000_000_000}
+        if traced:
+            headers["traceparent"] = "00-" + "a" * 32 + "-" + "b" * 16 + "-01"
+    properties = pika.BasicProperties(content_type=content_type, delivery_mode=2, headers=headers)
+    return sum(len(piece) for piece in properties.encode())
+
+
+def per_second(fn, iterations: int) -> float:
+    return iterations / min(timeit.repeat(fn, number=iterations, repeat=3))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--iterations", type=int, default=200000)
+    parser.add_argument("--traced", action="store_true", help="include trace headers in the frame size")
+    args = parser.parse_args()
+
+    print(f"{'event':<26} {'format':<7} {'encode/s':>11} {'decode/s':>11} {'body B':>7} {'frame B':>8}")
+    for event, data in SAMPLES.items():
+        message = {"event": event, "data": data}
+        legacy = json.dumps(message)
+        variants = {
+            "legacy": (lambda: json.dumps(message), lambda: json.loads(legacy), legacy.encode(), None),
+        }
+        for encoding in ("json", "binary"):
+            body, content_type = events.encode(event, data, encoding)
+            variants[encoding] = (
+                lambda encoding=encoding: events.encode(event, data, encoding),
+                lambda body=body, content_type=content_type: events.decode(body, content_type),
+                body,
+                content_type,
+            )
+        for label, (encode, decode, body, content_type) in variants.items():
+            frame = len(body) + properties_size(content_type, args.traced)
+            print(
+                f"{event:<26} {label:<7} {per_second(encode, args.iterations):>11,.0f} "
+                f"{per_second(decode, args.iterations):>11,.0f} {len(body):>7} {frame:>8}"
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,93 @@
+"""
+Order-update latency in notification_service under a recommendation flood.
+
+Runs the notification consumer against a throwaway SQLite database on the
+in-process message bus. It publishes --recommendations NEW_RECOMMENDATION
+events in chunks, as the scheduled recommendation run does, and meanwhile
+--order-bursts bursts of ORDER_STATUS_UPDATE events, --order-interval
+seconds apart. Reports the consumer's own per-event-type metrics (delivery
+latency from publish to notification stored, and handling time) as JSON.
+Run once per scheduling mode to compare:
+
+    python benchmarks/bench_notification_lanes.py --scheduling shared
+    python benchmarks/bench_notification_lanes.py --scheduling lanes
+"""
+import argparse
+import json
+import logging
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "notification_service"))
+sys.path.insert(1, os.path.join(os.path.dirname(__file__), "..", "common"))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--scheduling", choices=["lanes", "shared"], default="lanes")
+    parser.add_argument("--recommendations", type=int, default=5000)
+    parser.add_argument("--chunk", type=int, default=1000, help="recommendations per publish batch")
+    parser.add_argument("--order-bursts", type=int, default=10)
+    parser.add_argument("--order-burst", type=int, default=20, help="order updates per burst")
+    parser.add_argument("--order-interval", type=float, default=0.5, help="seconds between order bursts")
+    parser.add_argument("--timeout", type=float, default=300.0, help="max wait for every event to be handled")
+    args = parser.parse_args()
+
+    tmp = tempfile.mkdtemp(prefix="bench_lanes_")
+    os.environ.update({
+        "DATABASE_URL": f"sqlite:///{os.path.join(tmp, 'notification_service.db')}",
+        "MESSAGE_BUS": "memory",
+        "NOTIFICATION_SCHEDULING": args.scheduling,
+    })
+    # Configured first so the consumer's per-event INFO logging stays out of
+    # the measurement.
+    logging.basicConfig(level=logging.WARNING)
+
+    from database import Base, engine
+    import consumer
+    from bus import event_message, get_bus
+
+    Base.metadata.create_all(bind=engine)
+    threading.Thread(target=consumer.start_consuming, daemon=True).start()
+
+    bus = get_bus()
+    started = time.perf_counter()
+    for offset in range(0, args.recommendations, args.chunk):
+        bus.publish(consumer.RECOMMEND_QUEUE, [
+            event_message("NEW_RECOMMENDATION", {"userId": user_id, "content": f"Recommended product {user_id}"})
+            for user_id in range(offset, min(offset + args.chunk, args.recommendations))
+        ])
+    order_id = 0
+    for _ in range(args.order_bursts):
+        messages = []
+        for _ in range(args.order_burst):
+            order_id += 1
+            messages.append(event_message("ORDER_STATUS_UPDATE", {"orderId": order_id, "userId": order_id, "status": "shipped"}))
+        bus.publish(consumer.ORDER_UPDATES_QUEUE, messages)
+        time.sleep(args.order_interval)
+
+    expected = args.recommendations + order_id
+    deadline = time.monotonic() + args.timeout
+    while time.monotonic() < deadline:
+        handled = sum(stats["count"] for stats in consumer.event_latency.metrics().values())
+        if handled >= expected:
+            break
+        time.sleep(0.1)
+    elapsed = time.perf_counter() - started
+
+    report = {
+        "config": vars(args),
+        "elapsedSeconds": round(elapsed, 2),
+        **consumer.scheduling_metrics(),
+    }
+    engine.dispose()
+    shutil.rmtree(tmp, ignore_errors=True)
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,161 @@
+"""
+Benchmark scheduled recommendation ticks at large user counts.
+
+Runs the chunked pipeline from recommendation_service/pipeline.py against a
+throwaway SQLite database. The recommender is first seeded with a synthetic
+purchase history over the catalog (--purchases per user on average, skewed
+towards popular products) so every user gets a full top-N, as in production;
+an empty model would store a single fallback row per user. Each size is run
+for --ticks consecutive ticks against the same database: the first inserts
+every row, later ones rescore users who already have recommendations.
+Before each later tick --churn of the users place one more order, so their
+rankings, and those of users with overlapping histories, change.
+
+Recommendations are published as in production: encoded by
+publish_new_recommendations onto the message bus, by default the in-process
+one (MESSAGE_BUS=memory), where a consumer thread decodes and acks them the
+way the Notification Service would. Tick times include encoding and
+publishing; each tick's messages are drained before the next one starts.
+
+    python benchmarks/bench_recommendation_pipeline.py --users 100000 1000000
+"""
+import argparse
+import os
+import sys
+import tempfile
+import threading
+import time
+from typing import List, Tuple
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "recommendation_service"))
+sys.path.insert(1, os.path.join(os.path.dirname(__file__), "..", "common"))
+os.environ.setdefault("MESSAGE_BUS", "memory")
+# Keep the catalog built from the bundled seed out of the working directory.
+os.environ.setdefault("CATALOG_PATH", os.path.join(tempfile.gettempdir(), "bench_catalog.bin"))
+
+import numpy as np
+from sqlalchemy import create_engine, func, select
+from sqlalchemy.orm import sessionmaker
+
+from bus import get_bus
+from catalog import catalog
+from consumer import recommender
+from database import Base
+from events import decode
+from models import Recommendation
+from pipeline import run_recommendation_pipeline
+
+
+class NotificationDrain:
+    """Decode and ack everything published to recommendations_queue, counting deliveries."""
+
+    def __init__(self):
+        self.delivered = 0
+        self._changed = threading.Condition()
+        threading.Thread(
+            target=get_bus().consume, args=(["recommendations_queue"], self._handle, 256), daemon=True
+        ).start()
+
+    def _handle(self, delivery):
+        decode(delivery.body, delivery.content_type)
+        delivery.ack()
+        with self._changed:
+            self.delivered += 1
+            self._changed.notify_all()
+
+    def wait_for(self, count: int):
+        with self._changed:
+            self._changed.wait_for(lambda: self.delivered >= count)
+
+
+def _purchases(rng: np.random.Generator, size: int) -> List[int]:
+    """Draw `size` product ids, skewed towards popular products."""
+    product_ids = np.array(sorted(product.product_id for category in catalog.current.categories()
+                                  for product in catalog.in_category(category)))
+    weights = 1.0 / np.arange(1, len(product_ids) + 1)
+    return rng.choice(product_ids, size=size, p=weights / weights.sum()).tolist()
+
+
+def seed_recommender(first_user: int, user_count: int, purchases: float, seed: int = 7):
+    """Record a synthetic purchase history for `user_count` users from `first_user` on and fold it in."""
+    rng = np.random.default_rng(seed)
+    counts = rng.poisson(purchases, size=user_count) + 1
+    bought = _purchases(rng, int(counts.sum()))
+    offset = 0
+    for user_id, count in enumerate(counts.tolist(), start=first_user):
+        recommender.record_order(user_id, bought[offset:offset + count])
+        offset += count
+    recommender.refresh()
+
+
+def churn_recommender(user_count: int, churn: float, rng: np.random.Generator):
+    """Record one more order for a random `churn` share of the users and fold it in."""
+    user_ids = rng.choice(np.arange(1, user_count + 1), size=int(user_count * churn), replace=False).tolist()
+    for user_id, product_id in zip(user_ids, _purchases(rng, len(user_ids))):
+        recommender.record_order(user_id, [product_id])
+    recommender.refresh()
+
+
+def run_ticks(user_count: int, ticks: int, chunk_size: int, concurrency: int, churn: float,
+              drain: NotificationDrain) -> Tuple[List[Tuple[float, int]], int]:
+    """Return each tick's duration and number of users notified, and the number of rows stored at the end."""
+    with tempfile.TemporaryDirectory() as tmp:
+        engine = create_engine(
+            f"sqlite:///{os.path.join(tmp, 'bench.db')}",
+            connect_args={"check_same_thread": False},
+        )
+        Base.metadata.create_all(bind=engine)
+        session_factory = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+
+        results = []
+        rng = np.random.default_rng(user_count)
+        for tick in range(ticks):
+            if tick:
+                churn_recommender(user_count, churn, rng)
+            expected = drain.delivered
+            started = time.perf_counter()
+            published = run_recommendation_pipeline(
+                range(1, user_count + 1),
+                chunk_size=chunk_size,
+                concurrency=concurrency,
+                session_factory=session_factory,
+            )
+            results.append((time.perf_counter() - started, published))
+            assert tick or published == user_count
+            drain.wait_for(expected + published)
+        with engine.connect() as connection:
+            rows = connection.execute(select(func.count()).select_from(Recommendation.__table__)).scalar()
+        engine.dispose()
+    return results, rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, nargs="+", default=[100_000, 1_000_000])
+    parser.add_argument("--chunk-size", type=int, default=5000)
+    parser.add_argument("--concurrency", type=int, default=2)
+    parser.add_argument("--interval", type=float, default=30.0, help="scheduler interval in seconds")
+    parser.add_argument("--purchases", type=float, default=2.0, help="mean purchases per seeded user")
+    parser.add_argument("--ticks", type=int, default=3, help="consecutive ticks per user count")
+    parser.add_argument("--churn", type=float, default=0.01, help="share of users ordering again before each later tick")
+    args = parser.parse_args()
+
+    drain = NotificationDrain()
+    seeded = 0
+    for user_count in sorted(args.users):
+        # Users seeded for a smaller run keep their history; only new ones are added.
+        if user_count > seeded:
+            seed_recommender(seeded + 1, user_count - seeded, args.purchases, seed=seeded)
+            seeded = user_count
+        results, rows = run_ticks(user_count, args.ticks, args.chunk_size, args.concurrency, args.churn, drain)
+        for tick, (elapsed, published) in enumerate(results, start=1):
+            print(
+                f"users={user_count:>9,} tick {tick} chunk={args.chunk_size} concurrency={args.concurrency} "
+                f"time={elapsed:6.2f}s ({user_count / elapsed:,.0f} users/s, "
+                f"{elapsed / args.interval:.0%} of {args.interval:.0f}s interval) published={published:,}"
+            )
+        print(f"users={user_count:>9,} rows stored={rows:,} ({rows / user_count:.1f} per user)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,99 @@
+"""
+Benchmark the item-to-item recommender against a per-user Python loop.
+
+Generates a synthetic purchase history with skewed product popularity,
+builds the sparse model from recommendation_service/recommender.py and
+scores every user in one vectorised call. The pure-Python baseline walks each
+user's purchases through a dict-of-dicts co-occurrence table; it runs on a
+sample of users and is extrapolated to the full population.
+
+    python benchmarks/bench_recommender.py --users 1000000 --products 2000
+"""
+import argparse
+import os
+import sys
+import time
+from collections import defaultdict
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "recommendation_service"))
+sys.path.insert(1, os.path.join(os.path.dirname(__file__), "..", "common"))
+
+from recommender import ItemToItemRecommender
+
+
+def synthetic_purchases(users: int, products: int, per_user: int, seed: int):
+    rng = np.random.default_rng(seed)
+    counts = rng.poisson(per_user, size=users) + 1
+    user_ids = np.repeat(np.arange(1, users + 1), counts)
+    # Zipf-like popularity so a few products dominate, as in real catalogs.
+    weights = 1.0 / np.arange(1, products + 1)
+    product_ids = rng.choice(products, size=len(user_ids), p=weights / weights.sum()) + 1000
+    return user_ids, product_ids
+
+
+def python_loop_top_k(user_items, cooccurrence, k):
+    recommendations = {}
+    for user_id, owned in user_items.items():
+        scores = defaultdict(float)
+        for item in owned:
+            for other, count in cooccurrence[item].items():
+                if other not in owned:
+                    scores[other] += count
+        recommendations[user_id] = sorted(scores, key=scores.get, reverse=True)[:k]
+    return recommendations
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, default=1_000_000)
+    parser.add_argument("--products", type=int, default=2000)
+    parser.add_argument("--per-user", type=int, default=4, help="mean purchases per user")
+    parser.add_argument("--k", type=int, default=5)
+    parser.add_argument("--loop-sample", type=int, default=5000, help="users scored by the Python baseline")
+    parser.add_argument("--seed", type=int, default=7)
+    args = parser.parse_args()
+
+    user_ids, product_ids = synthetic_purchases(args.users, args.products, args.per_user, args.seed)
+    print(f"{args.users:,} users, {args.products:,} products, {len(user_ids):,} purchases")
+
+    model = ItemToItemRecommender()
+    started = time.perf_counter()
+    half = len(user_ids) // 2
+    for chunk_users, chunk_products in ((user_ids[:half], product_ids[:half]), (user_ids[half:], product_ids[half:])):
+        for user_id, product_id in zip(chunk_users.tolist(), chunk_products.tolist()):
+            model.record_order(user_id, (product_id,))
+        model.refresh()
+    print(f"build (two incremental refreshes): {time.perf_counter() - started:8.2f}s")
+
+    started = time.perf_counter()
+    model.record_order(1, (1000, 1001))
+    model.refresh()
+    print(f"incremental refresh for one order: {time.perf_counter() - started:8.3f}s")
+
+    all_users = np.arange(1, args.users + 1)
+    started = time.perf_counter()
+    model.recommend(all_users, k=args.k)
+    vectorised = time.perf_counter() - started
+    print(f"vectorised top-{args.k} for all users: {vectorised:8.2f}s ({args.users / vectorised:,.0f} users/s)")
+
+    sample = min(args.loop_sample, args.users)
+    user_items = defaultdict(set)
+    for user_id, product_id in zip(user_ids.tolist(), product_ids.tolist()):
+        user_items[user_id].add(product_id)
+    cooccurrence = defaultdict(lambda: defaultdict(int))
+    for owned in user_items.values():
+        for item in owned:
+            for other in owned:
+                if other != item:
+                    cooccurrence[item][other] += 1
+    sampled = {user_id: user_items[user_id] for user_id in range(1, sample + 1)}
+    started = time.perf_counter()
+    python_loop_top_k(sampled, cooccurrence, args.k)
+    loop = (time.perf_counter() - started) / sample * args.users
+    print(f"python loop top-{args.k} (extrapolated from {sample:,}): {loop:8.2f}s ({loop / vectorised:.1f}x slower)")
+
+
+if __name__ == "__main__":
+    main()
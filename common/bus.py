@@ -0,0 +1,271 @@
+"""
+Message bus behind every publisher and consumer.
+
+MESSAGE_BUS selects the backend:
+
+  rabbitmq  durable queues on RabbitMQ's default exchange, one connection
+            per publish batch and a reconnecting consumer loop
+  memory    asyncio queues on a private event loop in this process, for the
+            single-process monolith and for tests; messages are lost when
+            the process exits
+
+Handlers receive a Delivery and must ack or nack it exactly once, from any
+thread.
+"""
+import abc
+import asyncio
+import functools
+import logging
+import os
+import threading
+import time
+from collections import defaultdict, deque
+from typing import Callable, Dict, List, NamedTuple, Optional, Sequence
+
+from events import encode
+from tracing import message_headers
+
+MESSAGE_BUS = os.getenv("MESSAGE_BUS", "rabbitmq")
+RABBITMQ_HOST = os.getenv("RABBITMQ_HOST", "rabbitmq")
+RABBITMQ_USER = os.getenv("RABBITMQ_USER", "appuser")
+RABBITMQ_PASS = os.getenv("RABBITMQ_PASS", "securepassword123")
+
+logger = logging.getLogger(__name__)
+
+
+class Message(NamedTuple):
+    body: bytes
+    content_type: str
+    headers: Optional[dict] = None
+
+
+class Delivery:
+    __slots__ = ("queue", "body", "content_type", "headers", "_settle")
+
+    def __init__(self, queue: str, body: bytes, content_type: Optional[str], headers: Optional[dict],
+                 settle: Callable[[bool, bool], None]):
+        self.queue = queue
+        self.body = body
+        self.content_type = content_type
+        self.headers = headers or {}
+        self._settle = settle
+
+    def ack(self):
+        self._settle(True, False)
+
+    def nack(self, requeue: bool = False):
+        self._settle(False, requeue)
+
+
+class MessageBus(abc.ABC):
+    @abc.abstractmethod
+    def publish(self, queue: str, messages: Sequence[Message]):
+        """Publish `messages` to `queue` in order."""
+
+    @abc.abstractmethod
+    def consume(self, queues: Sequence[str], handler: Callable[[Delivery], None], prefetch: int = 1,
+                on_disconnect: Optional[Callable[[], None]] = None):
+        """
+        Deliver messages from `queues` to `handler` until the process exits.
+        Blocks the calling thread. `on_disconnect` runs on that thread when
+        a broker connection is lost, before reconnecting: deliveries from the
+        old connection can no longer be settled and will be redelivered, so
+        handlers that queue work should drop it there.
+        """
+
+
+class RabbitMQBus(MessageBus):
+    def __init__(self, host: str = RABBITMQ_HOST, user: str = RABBITMQ_USER, password: str = RABBITMQ_PASS):
+        self.host = host
+        self.user = user
+        self.password = password
+
+    def _connect(self):
+        import pika
+
+        credentials = pika.PlainCredentials(self.user, self.password)
+        return pika.BlockingConnection(pika.ConnectionParameters(host=self.host, credentials=credentials))
+
+    def publish(self, queue: str, messages: Sequence[Message]):
+        import pika
+
+        if not messages:
+            return
+        connection = self._connect()
+        try:
+            channel = connection.channel()
+            channel.queue_declare(queue=queue, durable=True)
+            for message in messages:
+                channel.basic_publish(
+                    exchange='',
+                    routing_key=queue,
+                    body=message.body,
+                    properties=pika.BasicProperties(
+                        content_type=message.content_type,
+                        delivery_mode=2,  # make message persistent
+                        headers=message.headers,
+                    ),
+                )
+        finally:
+            connection.close()
+
+    def consume(self, queues: Sequence[str], handler: Callable[[Delivery], None], prefetch: int = 1,
+                on_disconnect: Optional[Callable[[], None]] = None):
+        import pika
+
+        while True:
+            try:
+                connection = self._connect()
+            except pika.exceptions.AMQPConnectionError as e:
+                logger.error(f"Failed to connect to RabbitMQ: {e}. Retrying in 5 seconds...")
+                time.sleep(5)
+                continue
+            try:
+                channel = connection.channel()
+                for queue in queues:
+                    channel.queue_declare(queue=queue, durable=True)
+                channel.basic_qos(prefetch_count=prefetch)
+                consumer_thread = threading.get_ident()
+
+                def settle(delivery_tag: int, ack: bool, requeue: bool):
+                    # pika connections are not thread-safe: settlements from
+                    # other threads are handed to the connection thread.
+                    if ack:
+                        action = functools.partial(channel.basic_ack, delivery_tag=delivery_tag)
+                    else:
+                        action = functools.partial(channel.basic_nack, delivery_tag=delivery_tag, requeue=requeue)
+                    if threading.get_ident() == consumer_thread:
+                        action()
+                        return
+                    try:
+                        connection.add_callback_threadsafe(action)
+                    except Exception as e:
+                        # The connection went away; the broker redelivers the message.
+                        logger.warning(f"Could not settle delivery {delivery_tag}: {e}")
+
+                def on_message(ch, method, properties, body):
+                    handler(Delivery(
+                        method.routing_key, body, properties.content_type, properties.headers,
+                        functools.partial(settle, method.delivery_tag),
+                    ))
+
+                for queue in queues:
+                    channel.basic_consume(queue=queue, on_message_callback=on_message)
+                logger.info(f"Connected to RabbitMQ. Consuming from {', '.join(queues)}...")
+                channel.start_consuming()
+            except pika.exceptions.AMQPConnectionError as e:
+                logger.error(f"Lost connection to RabbitMQ: {e}. Retrying in 5 seconds...")
+            except Exception as e:
+                logger.error(f"Unexpected error: {e}. Retrying in 5 seconds...")
+            # Closing the connection returns its unacked deliveries to the
+            # queue, so nothing received on it may be handled after this.
+            try:
+                connection.close()
+            except Exception:
+                pass
+            if on_disconnect is not None:
+                on_disconnect()
+            time.sleep(5)
+
+
+class InProcessBus(MessageBus):
+    """
+    Queues live on an asyncio event loop running in a daemon thread.
+    Publishing from any thread schedules the append on that loop; each
+    consumer waits on the loop for its next message, then runs the handler
+    on its own thread, holding one of `prefetch` credits until the delivery
+    is settled. Like RabbitMQ with several queues on one channel, a consumer
+    takes from its non-empty queues in turn, and consumers of the same queue
+    share its messages. Messages wait in their queue until consumed; one
+    nacked with requeue goes back to the head of its queue, as RabbitMQ
+    does, and is dropped otherwise.
+    """
+
+    def __init__(self):
+        self._loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self._loop.run_forever, name="message-bus", daemon=True)
+        self._thread.start()
+        self._pending: Dict[str, deque] = defaultdict(deque)
+        self._waiters: Dict[str, List[asyncio.Future]] = defaultdict(list)
+
+    def _append(self, queue: str, messages: Sequence[Message], front: bool = False):
+        # Runs on the loop thread, so no locking is needed.
+        if front:
+            self._pending[queue].extendleft(reversed(messages))
+        else:
+            self._pending[queue].extend(messages)
+        waiters, self._waiters[queue] = self._waiters[queue], []
+        for waiter in waiters:
+            if not waiter.done():
+                waiter.set_result(None)
+
+    def publish(self, queue: str, messages: Sequence[Message]):
+        if messages:
+            self._loop.call_soon_threadsafe(self._append, queue, list(messages))
+
+    async def _next(self, queues: Sequence[str], turn: int):
+        while True:
+            for offset in range(len(queues)):
+                queue = queues[(turn + offset) % len(queues)]
+                if self._pending[queue]:
+                    return queue, self._pending[queue].popleft()
+            waiter = self._loop.create_future()
+            for queue in queues:
+                self._waiters[queue].append(waiter)
+            try:
+                await waiter
+            finally:
+                for queue in queues:
+                    if waiter in self._waiters[queue]:
+                        self._waiters[queue].remove(waiter)
+
+    def consume(self, queues: Sequence[str], handler: Callable[[Delivery], None], prefetch: int = 1,
+                on_disconnect: Optional[Callable[[], None]] = None):
+        # The loop never disconnects, so on_disconnect is never called.
+        queues = list(queues)
+        credits = threading.Semaphore(max(prefetch, 1))
+
+        def settle(queue: str, message: Message, ack: bool, requeue: bool):
+            credits.release()
+            if ack:
+                return
+            if requeue:
+                self._loop.call_soon_threadsafe(self._append, queue, [message], True)
+            else:
+                logger.warning("Message rejected by its consumer and dropped")
+
+        turn = 0
+        while True:
+            credits.acquire()
+            queue, message = asyncio.run_coroutine_threadsafe(self._next(queues, turn), self._loop).result()
+            turn = queues.index(queue) + 1
+            try:
+                handler(Delivery(
+                    queue, message.body, message.content_type, message.headers,
+                    functools.partial(settle, queue, message),
+                ))
+            except Exception as e:
+                logger.error(f"Unexpected error in consumer: {e}")
+
+
+_bus: Optional[MessageBus] = None
+_bus_lock = threading.Lock()
+
+
+def get_bus() -> MessageBus:
+    global _bus
+    if _bus is None:
+        with _bus_lock:
+            if _bus is None:
+                _bus = InProcessBus() if MESSAGE_BUS == "memory" else RabbitMQBus()
+    return _bus
+
+
+def event_message(event: str, data: dict) -> Message:
+    """Encode an event for publishing, carrying the current trace context."""
+    body, content_type = encode(event, data)
+    return Message(body, content_type, message_headers())
+
+
+def publish_event(queue: str, event: str, data: dict):
+    get_bus().publish(queue, [event_message(event, data)])
@@ -0,0 +1,196 @@
+"""
+Versioned schemas and wire encodings for the events exchanged over RabbitMQ.
+
+Each event type has an explicit, numbered schema. A message travels in one
+of two encodings, named by the AMQP `content_type` property:
+
+  application/json            {"event": ..., "version": ..., "data": {...}};
+                              also what publishers sent before this module,
+                              so a missing content_type means JSON
+  application/x-event-struct  struct-packed: event code and version bytes,
+                              fixed-width fields in one block, then
+                              length-prefixed strings and id lists
+
+Publishers choose with EVENT_ENCODING; consumers decode both, so the switch
+can be rolled out consumers first. Both paths validate the payload against
+the schema and raise EventSchemaError when it doesn't fit.
+
+A schema never changes once published. Adding or changing a field means
+registering the same event with the next version number.
+"""
+import json
+import os
+import struct
+from typing import Dict, List, Optional, Sequence, Tuple
+
+JSON_CONTENT_TYPE = "application/json"
+BINARY_CONTENT_TYPE = "application/x-event-struct"
+
+EVENT_ENCODING = os.getenv("EVENT_ENCODING", "json")
+
+# Wire order of the preference flags packed into one byte.
+PREFERENCE_FLAGS = ("promotions", "orderUpdates", "recommendations")
+
+_HEADER = struct.Struct("<BB")
+_LENGTH = struct.Struct("<H")
+_FIXED_FORMATS = {"int": "q", "preferences": "B"}
+
+_REQUIRED = object()
+
+
+class EventSchemaError(ValueError):
+    """Raised for unknown events, versions or content types and for payloads that don't match their schema."""
+
+
+class EventSchema:
+    def __init__(self, event: str, code: int, version: int, fields: Sequence[tuple]):
+        self.event = event
+        self.code = code
+        self.version = version
+        # (name, kind, default) with kind one of int, str, int_list, preferences.
+        self.fields = [(field[0], field[1], field[2] if len(field) > 2 else _REQUIRED) for field in fields]
+        self.fixed = [field for field in self.fields if field[1] in _FIXED_FORMATS]
+        self.variable = [field for field in self.fields if field[1] not in _FIXED_FORMATS]
+        self._fixed_struct = struct.Struct("<BB" + "".join(_FIXED_FORMATS[kind] for _, kind, _ in self.fixed))
+
+    def validate(self, data: dict) -> dict:
+        """Return a copy of `data` holding exactly this schema's fields, defaults filled in."""
+        if not isinstance(data, dict):
+            raise EventSchemaError(f"{self.event} v{self.version} data must be an object")
+        validated = {}
+        for name, kind, default in self.fields:
+            value = data.get(name, default)
+            if value is _REQUIRED:
+                raise EventSchemaError(f"{self.event} v{self.version} is missing {name}")
+            if kind == "int":
+                ok = isinstance(value, int) and not isinstance(value, bool)
+            elif kind == "str":
+                ok = isinstance(value, str)
+            elif kind == "int_list":
+                ok = isinstance(value, list) and all(isinstance(item, int) and not isinstance(item, bool) for item in value)
+            else:
+                ok = isinstance(value, dict) and all(isinstance(flag, bool) for flag in value.values())
+                value = {flag: bool(value.get(flag, False)) for flag in PREFERENCE_FLAGS} if ok else value
+            if not ok:
+                raise EventSchemaError(f"{self.event} v{self.version} field {name} is not a valid {kind}")
+            validated[name] = value
+        return validated
+
+    def encode_binary(self, data: dict) -> bytes:
+        values = [self.code, self.version]
+        for name, kind, default in self.fixed:
+            value = data.get(name, default)
+            if kind == "preferences":
+                value = sum(1 << bit for bit, flag in enumerate(PREFERENCE_FLAGS) if value.get(flag))
+            values.append(value)
+        parts = [self._fixed_struct.pack(*values)]
+        for name, kind, default in self.variable:
+            value = data.get(name, default)
+            if kind == "str":
+                value = value.encode()
+                parts.append(_LENGTH.pack(len(value)))
+                parts.append(value)
+            else:
+                parts.append(_LENGTH.pack(len(value)))
+                parts.append(struct.pack(f"<{len(value)}q", *value))
+        return b"".join(parts)
+
+    def decode_binary(self, body: bytes) -> dict:
+        values = self._fixed_struct.unpack_from(body)
+        data = {}
+        for (name, kind, _), value in zip(self.fixed, values[2:]):
+            if kind == "preferences":
+                value = {flag: bool(value & (1 << bit)) for bit, flag in enumerate(PREFERENCE_FLAGS)}
+            data[name] = value
+        offset = self._fixed_struct.size
+        for name, kind, _ in self.variable:
+            (length,) = _LENGTH.unpack_from(body, offset)
+            offset += _LENGTH.size
+            if kind == "str":
+                data[name] = body[offset:offset + length].decode()
+                offset += length
+            else:
+                data[name] = list(struct.unpack_from(f"<{length}q", body, offset))
+                offset += 8 * length
+        if offset != len(body):
+            raise EventSchemaError(f"{self.event} v{self.version} has {len(body) - offset} trailing bytes")
+        return data
+
+
+_by_name: Dict[Tuple[str, int], EventSchema] = {}
+_by_code: Dict[Tuple[int, int], EventSchema] = {}
+_latest: Dict[str, EventSchema] = {}
+
+
+def register(event: str, code: int, version: int, fields: Sequence[tuple]) -> EventSchema:
+    schema = EventSchema(event, code, version, fields)
+    _by_name[(event, version)] = schema
+    _by_code[(code, version)] = schema
+    if event not in _latest or version > _latest[event].version:
+        _latest[event] = schema
+    return schema
+
+
+ORDER_PLACED = register("ORDER_PLACED", 1, 1, [
+    ("orderId", "int"), ("userId", "int"), ("status", "str"), ("productIds", "int_list", []),
+])
+ORDER_STATUS_UPDATE = register("ORDER_STATUS_UPDATE", 2, 1, [
+    ("orderId", "int"), ("userId", "int"), ("status", "str"),
+])
+NEW_RECOMMENDATION = register("NEW_RECOMMENDATION", 3, 1, [
+    ("userId", "int"), ("content", "str"),
+])
+USER_PREFERENCES_UPDATED = register("USER_PREFERENCES_UPDATED", 4, 1, [
+    ("userId", "int"), ("preferences", "preferences"),
+])
+
+
+def encode(event: str, data: dict, encoding: Optional[str] = None) -> Tuple[bytes, str]:
+    """
+    Encode `data` with the latest schema for `event`. Returns the body and
+    the content_type to publish it with.
+    """
+    schema = _latest.get(event)
+    if schema is None:
+        raise EventSchemaError(f"Unknown event {event}")
+    data = schema.validate(data)
+    if (encoding or EVENT_ENCODING) == "binary":
+        try:
+            return schema.encode_binary(data), BINARY_CONTENT_TYPE
+        except struct.error as e:
+            raise EventSchemaError(f"{event} v{schema.version} does not fit its binary layout: {e}")
+    body = json.dumps({"event": event, "version": schema.version, "data": data})
+    return body.encode(), JSON_CONTENT_TYPE
+
+
+def decode(body: bytes, content_type: Optional[str] = None) -> dict:
+    """Decode and validate a message into {"event", "version", "data"}."""
+    if content_type == BINARY_CONTENT_TYPE:
+        if len(body) < _HEADER.size:
+            raise EventSchemaError("Binary event is shorter than its header")
+        code, version = _HEADER.unpack_from(body)
+        schema = _by_code.get((code, version))
+        if schema is None:
+            raise EventSchemaError(f"Unknown binary event code {code} version {version}")
+        try:
+            data = schema.decode_binary(body)
+        except (struct.error, UnicodeDecodeError) as e:
+            raise EventSchemaError(f"Malformed {schema.event} v{version}: {e}")
+        return {"event": schema.event, "version": version, "data": data}
+    if content_type not in (None, "", JSON_CONTENT_TYPE):
+        raise EventSchemaError(f"Unsupported content type {content_type}")
+    try:
+        message = json.loads(body)
+    except ValueError as e:
+        raise EventSchemaError(f"Malformed JSON event: {e}")
+    if not isinstance(message, dict):
+        raise EventSchemaError("JSON event must be an object")
+    event, version = message.get("event"), message.get("version", 1)
+    schema = _by_name.get((event, version))
+    if schema is None:
+        raise EventSchemaError(f"Unknown event {event} version {version}")
+    return {"event": event, "version": version, "data": schema.validate(message.get("data") or {})}
+
+
+def schemas() -> List[EventSchema]:
+    return list(_by_name.values())
@@ -0,0 +1,222 @@
+"""
+HTTP session for calls between services.
+
+Callers use `session` in place of the module-level `requests` functions. In
+the single-process monolith each co-located service's base URL is mounted on
+the session with `mount_app`, so those calls are dispatched straight into
+the service's ASGI app on a private event loop instead of going through a
+socket; everything else still goes over the network.
+"""
+import asyncio
+import http
+import logging
+import math
+from contextlib import ExitStack
+from io import BytesIO, RawIOBase
+from typing import Optional
+from urllib.parse import unquote, urlsplit
+
+import anyio
+import requests
+from anyio.from_thread import BlockingPortal, start_blocking_portal
+from requests.adapters import BaseAdapter
+from requests.structures import CaseInsensitiveDict
+from requests.utils import get_encoding_from_headers
+
+logger = logging.getLogger(__name__)
+
+session = requests.Session()
+
+_portal: Optional[BlockingPortal] = None
+_portal_stack = ExitStack()
+
+
+class _ASGIResponseBody(RawIOBase):
+    """
+    Body of an in-process response, taken chunk by chunk from the app as the
+    caller reads it. Closing it before the end tells the app the client has
+    disconnected.
+    """
+
+    def __init__(self, portal: BlockingPortal, loop: asyncio.AbstractEventLoop, chunks, done: anyio.Event,
+                 closed: anyio.Event):
+        super().__init__()
+        self._portal = portal
+        self._loop = loop
+        self._chunks = chunks
+        self._done = done
+        self._closed = closed
+        self._chunk = b""
+        self._offset = 0
+        self._eof = False
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer) -> int:
+        while self._offset == len(self._chunk):
+            if self._eof:
+                return 0
+            try:
+                self._chunk = self._portal.call(self._chunks.receive)
+            except anyio.EndOfStream:
+                self._eof = True
+                continue
+            self._offset = 0
+        count = min(len(buffer), len(self._chunk) - self._offset)
+        buffer[:count] = memoryview(self._chunk)[self._offset:self._offset + count]
+        self._offset += count
+        return count
+
+    def _disconnect(self):
+        # Runs on the portal's loop thread.
+        self._closed.set()
+        self._done.set()
+        self._chunks.close()
+
+    def close(self):
+        # Also called by the garbage collector, on whichever thread it runs,
+        # so this must not wait for the loop.
+        if not self.closed and not self._eof:
+            try:
+                self._loop.call_soon_threadsafe(self._disconnect)
+            except RuntimeError:
+                # The loop has already been shut down.
+                pass
+        super().close()
+
+
+class ASGIAdapter(BaseAdapter):
+    """
+    requests transport adapter that runs each request through an ASGI app.
+    Calls come from synchronous code, often from inside another app's event
+    loop, so the app runs on `portal`'s loop thread and the caller blocks
+    until it has answered. With `stream=True` the caller only waits for the
+    response to start; the body is then handed over through a buffer of at
+    most `buffered_chunks` chunks as the caller reads it, so a long response
+    isn't held in memory any more than it would be over a socket.
+    """
+
+    def __init__(self, app, portal: BlockingPortal, buffered_chunks: int = 16):
+        super().__init__()
+        self.app = app
+        self.portal = portal
+        self.buffered_chunks = buffered_chunks
+        self._loop = portal.call(asyncio.get_running_loop)
+
+    def send(self, request, stream=False, timeout=None, verify=True, cert=None, proxies=None):
+        url = urlsplit(request.url)
+        headers = [(name.lower().encode("latin-1"), str(value).encode("latin-1")) for name, value in request.headers.items()]
+        if not any(name == b"host" for name, _ in headers):
+            headers.append((b"host", url.netloc.encode("latin-1")))
+        body = request.body or b""
+        if isinstance(body, str):
+            body = body.encode()
+        scope = {
+            "type": "http",
+            "asgi": {"version": "3.0"},
+            "http_version": "1.1",
+            "method": request.method,
+            "scheme": url.scheme,
+            "path": unquote(url.path) or "/",
+            "raw_path": (url.path or "/").encode(),
+            "query_string": url.query.encode(),
+            "root_path": "",
+            "headers": headers,
+            "client": ("127.0.0.1", 0),
+            "server": (url.hostname, url.port or (443 if url.scheme == "https" else 80)),
+        }
+        if stream:
+            done = anyio.Event()
+            closed = anyio.Event()
+            send_chunks, receive_chunks = anyio.create_memory_object_stream(self.buffered_chunks)
+            self.portal.start_task_soon(self._call, scope, body, send_chunks, done, closed)
+            try:
+                status, response_headers = self.portal.call(receive_chunks.receive)
+            except anyio.EndOfStream:
+                status, response_headers = 500, []
+            raw = _ASGIResponseBody(self.portal, self._loop, receive_chunks, done, closed)
+        else:
+            # One hop to the loop and back rather than one per chunk.
+            status, response_headers, content = self.portal.call(self._call_buffered, scope, body)
+            raw = BytesIO(content)
+
+        response = requests.Response()
+        response.status_code = status
+        response.headers = CaseInsensitiveDict()
+        for name, value in response_headers:
+            name = name.decode("latin-1")
+            value = value.decode("latin-1")
+            response.headers[name] = f"{response.headers[name]}, {value}" if name in response.headers else value
+        response.encoding = get_encoding_from_headers(response.headers)
+        try:
+            response.reason = http.HTTPStatus(status).phrase
+        except ValueError:
+            response.reason = ""
+        response.raw = raw
+        response.url = request.url
+        response.request = request
+        response.connection = self
+        return response
+
+    async def _call_buffered(self, scope: dict, body: bytes):
+        send_chunks, receive_chunks = anyio.create_memory_object_stream(math.inf)
+        await self._call(scope, body, send_chunks, anyio.Event(), anyio.Event())
+        async with receive_chunks:
+            items = [item async for item in receive_chunks]
+        if not items:
+            return 500, [], b""
+        (status, headers), *chunks = items
+        return status, headers, b"".join(chunks)
+
+    async def _call(self, scope: dict, body: bytes, chunks, done: anyio.Event, closed: anyio.Event):
+        # Sends the response start as (status, headers), then the body's
+        # chunks; closing `chunks` marks the end of the body.
+        started = False
+        request_sent = False
+
+        async def receive():
+            nonlocal request_sent
+            if not request_sent:
+                request_sent = True
+                return {"type": "http.request", "body": body, "more_body": False}
+            # Streaming responses listen for a disconnect; only report one
+            # once the response is complete or the caller has closed it.
+            await done.wait()
+            return {"type": "http.disconnect"}
+
+        async def send(message):
+            nonlocal started
+            if message["type"] == "http.response.start":
+                started = True
+                await chunks.send((message["status"], message.get("headers", [])))
+            elif message["type"] == "http.response.body":
+                if message.get("body"):
+                    await chunks.send(message["body"])
+                if not message.get("more_body", False):
+                    done.set()
+
+        async with chunks:
+            try:
+                await self.app(scope, receive, send)
+            except Exception:
+                # Sending fails once the caller has closed the body; anything
+                # else a server would have logged, answering 500 if it could.
+                if not closed.is_set():
+                    logger.exception(f"Unhandled error in in-process {scope['method']} {scope['path']}")
+                if not started:
+                    await chunks.send((500, [(b"content-type", b"text/plain; charset=utf-8")]))
+                    await chunks.send(b"Internal Server Error")
+            finally:
+                done.set()
+
+    def close(self):
+        pass
+
+
+def mount_app(base_url: str, app):
+    """Serve requests to `base_url` from `app` in this process."""
+    global _portal
+    if _portal is None:
+        _portal = _portal_stack.enter_context(start_blocking_portal())
+    session.mount(base_url.rstrip("/") + "/", ASGIAdapter(app, _portal))
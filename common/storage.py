@@ -0,0 +1,128 @@
+import logging
+import os
+import threading
+import weakref
+from typing import Dict, Optional
+
+from sqlalchemy import create_engine, event
+from sqlalchemy.engine import Engine, make_url
+from sqlalchemy.pool import QueuePool
+
+# SQLite: WAL lets readers proceed while a writer commits, and NORMAL only
+# fsyncs at checkpoints instead of on every commit (still durable against
+# application crashes, may lose the last transactions on power loss).
+SQLITE_JOURNAL_MODE = os.getenv("SQLITE_JOURNAL_MODE", "WAL")
+SQLITE_SYNCHRONOUS = os.getenv("SQLITE_SYNCHRONOUS", "NORMAL")
+SQLITE_MMAP_SIZE = int(os.getenv("SQLITE_MMAP_SIZE", str(256 * 1024 * 1024)))
+SQLITE_BUSY_TIMEOUT_MS = int(os.getenv("SQLITE_BUSY_TIMEOUT_MS", "5000"))
+
+# Connection pool, used for server databases and file-backed SQLite alike.
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "10"))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "20"))
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "30"))
+DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", "1800"))
+
+logger = logging.getLogger(__name__)
+
+
+def sqlite_pragmas() -> Dict[str, object]:
+    return {
+        "journal_mode": SQLITE_JOURNAL_MODE,
+        "synchronous": SQLITE_SYNCHRONOUS,
+        "mmap_size": SQLITE_MMAP_SIZE,
+        "busy_timeout": SQLITE_BUSY_TIMEOUT_MS,
+    }
+
+
+class _PoolCounters:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.connects = 0
+        self.checkouts = 0
+        self.invalidations = 0
+
+
+_counters: "weakref.WeakKeyDictionary[Engine, _PoolCounters]" = weakref.WeakKeyDictionary()
+
+
+def _track_pool(engine: Engine):
+    counters = _counters[engine] = _PoolCounters()
+
+    def bump(name):
+        def listener(*args):
+            with counters.lock:
+                setattr(counters, name, getattr(counters, name) + 1)
+        return listener
+
+    event.listen(engine, "connect", bump("connects"))
+    event.listen(engine, "checkout", bump("checkouts"))
+    event.listen(engine, "invalidate", bump("invalidations"))
+
+
+def create_service_engine(url: str, pragmas: Optional[Dict[str, object]] = None, **kwargs) -> Engine:
+    """
+    Build a service's engine. SQLite connections get `pragmas`
+    (sqlite_pragmas() unless given; pass {} for SQLite's defaults) applied as
+    they are opened; other databases get a bounded QueuePool with pre-ping
+    and recycling. Extra keyword arguments are passed to create_engine.
+    """
+    parsed = make_url(url)
+
+    if parsed.get_backend_name() == "sqlite":
+        pragmas = sqlite_pragmas() if pragmas is None else pragmas
+        connect_args = {"check_same_thread": False}
+        if "busy_timeout" in pragmas:
+            connect_args["timeout"] = int(pragmas["busy_timeout"]) / 1000
+        options = {"connect_args": connect_args}
+        if parsed.database not in (None, "", ":memory:"):
+            # Older SQLAlchemy defaults file databases to NullPool, which
+            # would reopen the file and rerun the pragmas for every session.
+            options.update(poolclass=QueuePool, pool_size=DB_POOL_SIZE,
+                           max_overflow=DB_MAX_OVERFLOW, pool_timeout=DB_POOL_TIMEOUT)
+        options.update(kwargs)
+        engine = create_engine(url, **options)
+
+        @event.listens_for(engine, "connect")
+        def apply_pragmas(dbapi_connection, connection_record):
+            cursor = dbapi_connection.cursor()
+            try:
+                for name, value in pragmas.items():
+                    cursor.execute(f"PRAGMA {name}={value}")
+            finally:
+                cursor.close()
+    else:
+        options = {
+            "pool_size": DB_POOL_SIZE,
+            "max_overflow": DB_MAX_OVERFLOW,
+            "pool_timeout": DB_POOL_TIMEOUT,
+            "pool_recycle": DB_POOL_RECYCLE,
+            "pool_pre_ping": True,
+        }
+        options.update(kwargs)
+        engine = create_engine(url, **options)
+
+    _track_pool(engine)
+    logger.info(f"Database engine for {parsed.get_backend_name()} using {type(engine.pool).__name__}")
+    return engine
+
+
+def pool_stats(engine: Engine) -> dict:
+    pool = engine.pool
+    stats = {"backend": engine.dialect.name, "pool": type(pool).__name__}
+    if isinstance(pool, QueuePool):
+        stats.update(
+            size=pool.size(),
+            checkedIn=pool.checkedin(),
+            checkedOut=pool.checkedout(),
+            overflow=pool.overflow(),
+            maxOverflow=pool._max_overflow,
+        )
+    counters = _counters.get(engine)
+    if counters is not None:
+        with counters.lock:
+            stats.update(
+                connectionsOpened=counters.connects,
+                checkouts=counters.checkouts,
+                invalidations=counters.invalidations,
+            )
+    return stats
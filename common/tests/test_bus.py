@@ -0,0 +1,80 @@
+import queue
+import threading
+
+from bus import InProcessBus, Message
+
+TIMEOUT = 5
+
+
+def start_consumer(bus, queues, handler, prefetch=1):
+    threading.Thread(target=bus.consume, args=(queues, handler, prefetch), daemon=True).start()
+
+
+def test_nacked_message_is_requeued_at_the_head():
+    bus = InProcessBus()
+    seen = queue.Queue()
+    attempts = {}
+
+    def handler(delivery):
+        attempts[delivery.body] = attempts.get(delivery.body, 0) + 1
+        seen.put(delivery.body)
+        if delivery.body == b"first" and attempts[delivery.body] == 1:
+            delivery.nack(requeue=True)
+        else:
+            delivery.ack()
+
+    bus.publish("jobs", [Message(b"first", "text/plain"), Message(b"second", "text/plain")])
+    start_consumer(bus, ["jobs"], handler)
+
+    assert [seen.get(timeout=TIMEOUT) for _ in range(3)] == [b"first", b"first", b"second"]
+
+
+def test_nacked_message_without_requeue_is_dropped():
+    bus = InProcessBus()
+    seen = queue.Queue()
+
+    def handler(delivery):
+        seen.put(delivery.body)
+        if delivery.body == b"bad":
+            delivery.nack()
+        else:
+            delivery.ack()
+
+    bus.publish("jobs", [Message(b"bad", "text/plain"), Message(b"good", "text/plain")])
+    start_consumer(bus, ["jobs"], handler)
+
+    assert [seen.get(timeout=TIMEOUT) for _ in range(2)] == [b"bad", b"good"]
+    assert seen.empty()
+
+
+def test_requeued_message_keeps_its_content_type_and_headers():
+    bus = InProcessBus()
+    seen = queue.Queue()
+    attempts = []
+
+    def handler(delivery):
+        attempts.append(delivery.body)
+        seen.put((delivery.content_type, delivery.headers))
+        delivery.nack(requeue=len(attempts) == 1)
+
+    bus.publish("jobs", [Message(b"{}", "application/json", {"traceparent": "00-ab-cd-01"})])
+    start_consumer(bus, ["jobs"], handler)
+
+    first, second = seen.get(timeout=TIMEOUT), seen.get(timeout=TIMEOUT)
+    assert first == second == ("application/json", {"traceparent": "00-ab-cd-01"})
+
+
+def test_unsettled_deliveries_hold_prefetch_credits():
+    bus = InProcessBus()
+    held = queue.Queue()
+
+    bus.publish("jobs", [Message(str(n).encode(), "text/plain") for n in range(3)])
+    start_consumer(bus, ["jobs"], held.put, prefetch=2)
+
+    first, second = held.get(timeout=TIMEOUT), held.get(timeout=TIMEOUT)
+    assert held.empty()
+    first.nack(requeue=True)
+    # The freed credit goes to the requeued message, ahead of the third one.
+    assert held.get(timeout=TIMEOUT).body == first.body
+    second.ack()
+    assert held.get(timeout=TIMEOUT).body == b"2"
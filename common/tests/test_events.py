@@ -0,0 +1,72 @@
+import json
+
+import pytest
+
+from events import (
+    BINARY_CONTENT_TYPE,
+    JSON_CONTENT_TYPE,
+    EventSchemaError,
+    decode,
+    encode,
+)
+
+EVENTS = [
+    ("ORDER_PLACED", {"orderId": 7, "userId": 42, "status": "PLACED", "productIds": [1, 2, 2 ** 40]}),
+    ("ORDER_STATUS_UPDATE", {"orderId": 7, "userId": 42, "status": "SHIPPED"}),
+    ("NEW_RECOMMENDATION", {"userId": 42, "content": "Recommended product Kéttle (Product ID: 3)"}),
+    ("USER_PREFERENCES_UPDATED", {
+        "userId": 42, "preferences": {"promotions": False, "orderUpdates": True, "recommendations": True},
+    }),
+]
+
+
+@pytest.mark.parametrize("encoding, content_type", [("json", JSON_CONTENT_TYPE), ("binary", BINARY_CONTENT_TYPE)])
+@pytest.mark.parametrize("event, data", EVENTS)
+def test_round_trip(event, data, encoding, content_type):
+    body, encoded_as = encode(event, data, encoding=encoding)
+
+    assert encoded_as == content_type
+    assert decode(body, encoded_as) == {"event": event, "version": 1, "data": data}
+
+
+def test_defaults_are_filled_in_before_encoding():
+    data = {"orderId": 1, "userId": 2, "status": "PLACED"}
+
+    for encoding in ("json", "binary"):
+        body, content_type = encode("ORDER_PLACED", data, encoding=encoding)
+        assert decode(body, content_type)["data"]["productIds"] == []
+
+
+def test_missing_content_type_is_json():
+    body = json.dumps({"event": "ORDER_STATUS_UPDATE", "data": {"orderId": 1, "userId": 2, "status": "DONE"}})
+
+    assert decode(body.encode(), None)["data"] == {"orderId": 1, "userId": 2, "status": "DONE"}
+
+
+def test_binary_is_smaller_than_json():
+    event, data = EVENTS[0]
+
+    assert len(encode(event, data, encoding="binary")[0]) < len(encode(event, data, encoding="json")[0])
+
+
+@pytest.mark.parametrize("body, content_type", [
+    (b"\x01", BINARY_CONTENT_TYPE),
+    (b"\x63\x01", BINARY_CONTENT_TYPE),
+    (encode(*EVENTS[1], encoding="binary")[0] + b"\x00", BINARY_CONTENT_TYPE),
+    (b"not json", JSON_CONTENT_TYPE),
+    (b'{"event": "ORDER_PLACED", "version": 9, "data": {}}', JSON_CONTENT_TYPE),
+    (b'{"event": "ORDER_STATUS_UPDATE", "data": {"orderId": "1", "userId": 2, "status": "DONE"}}', None),
+    (b"{}", "text/plain"),
+])
+def test_malformed_messages_are_rejected(body, content_type):
+    with pytest.raises(EventSchemaError):
+        decode(body, content_type)
+
+
+def test_payloads_not_matching_the_schema_are_not_encoded():
+    with pytest.raises(EventSchemaError):
+        encode("ORDER_STATUS_UPDATE", {"orderId": 1, "userId": 2})
+    with pytest.raises(EventSchemaError):
+        encode("ORDER_PLACED", {"orderId": 1, "userId": True, "status": "PLACED"})
+    with pytest.raises(EventSchemaError):
+        encode("NO_SUCH_EVENT", {})
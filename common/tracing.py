@@ -0,0 +1,328 @@
+"""
+Lightweight trace propagation and span recording shared by every service.
+
+A trace context travels as a W3C `traceparent` value: in HTTP request
+headers, and in AMQP message `headers`. Every message also carries its
+publish time, traced or not, so consumers can record how long it sat in
+its queue and export delivery latency. The sampling
+decision is made once, where the trace starts (normally the gateway), and
+carried in the context's flags; unsampled requests still propagate ids but
+record nothing.
+
+Sampled spans go to a background exporter that appends JSON lines to
+TRACE_FILE and/or POSTs batches to TRACE_COLLECTOR_URL. Summarise exported
+files per stage, or print one trace as a timeline, with:
+
+    python common/tracing.py traces/*.jsonl
+    python common/tracing.py traces/*.jsonl --trace <trace id>
+"""
+import argparse
+import json
+import logging
+import os
+import queue
+import random
+import threading
+import time
+import urllib.request
+from collections import defaultdict
+from contextvars import ContextVar
+from typing import Dict, Iterable, List, Mapping, Optional
+
+TRACE_SAMPLE_RATE = float(os.getenv("TRACE_SAMPLE_RATE", "0"))
+TRACE_FILE = os.getenv("TRACE_FILE", "./traces.jsonl")
+TRACE_COLLECTOR_URL = os.getenv("TRACE_COLLECTOR_URL", "")
+TRACE_EXPORT_QUEUE_SIZE = int(os.getenv("TRACE_EXPORT_QUEUE_SIZE", "10000"))
+TRACE_EXPORT_BATCH_SIZE = int(os.getenv("TRACE_EXPORT_BATCH_SIZE", "500"))
+
+TRACEPARENT_HEADER = "traceparent"
+PUBLISHED_AT_HEADER = "x-published-at-us"
+
+logger = logging.getLogger(__name__)
+
+
+class SpanContext:
+    __slots__ = ("trace_id", "span_id", "sampled")
+
+    def __init__(self, trace_id: str, span_id: str, sampled: bool):
+        self.trace_id = trace_id
+        self.span_id = span_id
+        self.sampled = sampled
+
+    def traceparent(self) -> str:
+        return f"00-{self.trace_id}-{self.span_id}-{'01' if self.sampled else '00'}"
+
+
+_current: ContextVar[Optional[SpanContext]] = ContextVar("trace_context", default=None)
+
+
+def _new_id(bits: int) -> str:
+    return f"{random.getrandbits(bits):0{bits // 4}x}"
+
+
+def current() -> Optional[SpanContext]:
+    return _current.get()
+
+
+def parse_traceparent(value: Optional[str]) -> Optional[SpanContext]:
+    if not value:
+        return None
+    if isinstance(value, bytes):
+        value = value.decode()
+    parts = value.strip().split("-")
+    if len(parts) != 4 or len(parts[1]) != 32 or len(parts[2]) != 16:
+        return None
+    try:
+        sampled = bool(int(parts[3], 16) & 1)
+    except ValueError:
+        return None
+    return SpanContext(parts[1], parts[2], sampled)
+
+
+def inject(headers: Optional[dict] = None, context: Optional[SpanContext] = None) -> dict:
+    """Add the current (or given) context to `headers`, for HTTP requests."""
+    headers = {} if headers is None else headers
+    context = context or _current.get()
+    if context is not None:
+        headers[TRACEPARENT_HEADER] = context.traceparent()
+    return headers
+
+
+def message_headers(headers: Optional[dict] = None) -> dict:
+    """Headers for an AMQP publish: the trace context, if any, plus the publish time."""
+    headers = inject(headers)
+    headers[PUBLISHED_AT_HEADER] = int(time.time() * 1_000_000)
+    return headers
+
+
+def published_at(headers: Optional[Mapping]) -> Optional[float]:
+    """Publish time of a consumed message as a Unix timestamp, if it carries one."""
+    if not headers or not headers.get(PUBLISHED_AT_HEADER):
+        return None
+    return headers[PUBLISHED_AT_HEADER] / 1_000_000
+
+
+def extract(headers: Optional[Mapping]) -> Optional[SpanContext]:
+    if not headers:
+        return None
+    return parse_traceparent(headers.get(TRACEPARENT_HEADER))
+
+
+class Span:
+    __slots__ = ("tracer", "context", "parent_id", "name", "start", "attributes", "_started", "_token")
+
+    def __init__(self, tracer: "Tracer", name: str, parent: Optional[SpanContext], attributes: dict):
+        if parent is None:
+            context = SpanContext(_new_id(128), _new_id(64), random.random() < tracer.sample_rate)
+        else:
+            context = SpanContext(parent.trace_id, _new_id(64), parent.sampled)
+        self.tracer = tracer
+        self.context = context
+        self.parent_id = parent.span_id if parent else None
+        self.name = name
+        self.attributes = attributes
+        self.start = time.time()
+        self._started = time.perf_counter()
+        self._token = None
+
+    def __enter__(self) -> "Span":
+        self._token = _current.set(self.context)
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        _current.reset(self._token)
+        if exc_type is not None:
+            self.attributes["error"] = exc_type.__name__
+        self.end()
+        return False
+
+    def end(self):
+        if self.context.sampled:
+            duration = time.perf_counter() - self._started
+            self.tracer.record(self.name, self.context, self.parent_id, self.start, duration, self.attributes)
+
+
+class Tracer:
+    """
+    Records spans for one service. Each service module keeps its own
+    Tracer so spans are attributed correctly even when several services
+    share a process (the end-to-end benchmark loads them all in one).
+    """
+
+    def __init__(self, service: str, sample_rate: float = TRACE_SAMPLE_RATE):
+        self.service = service
+        self.sample_rate = sample_rate
+
+    def span(self, name: str, parent: Optional[SpanContext] = None, **attributes) -> Span:
+        """
+        Start a span as a child of `parent`, or of the current context when
+        none is given. Without either it starts a new, possibly sampled,
+        trace. Use as a context manager so nested calls see it as current.
+        """
+        return Span(self, name, parent or _current.get(), attributes)
+
+    def record(self, name: str, context: SpanContext, parent_id: Optional[str], start: float, duration: float, attributes: dict):
+        exporter.submit({
+            "traceId": context.trace_id,
+            "spanId": context.span_id,
+            "parentId": parent_id,
+            "service": self.service,
+            "name": name,
+            "start": round(start, 6),
+            "durationMs": round(duration * 1000, 3),
+            "attributes": attributes,
+        })
+
+    def consume(self, name: str, queue_name: str, headers: Optional[Mapping]) -> Span:
+        """
+        Span for handling one AMQP message, continuing the publisher's trace.
+        When the message carries its publish time the time spent waiting in
+        the queue is recorded as a sibling `queue <name>` span first.
+        """
+        parent = extract(headers)
+        published = published_at(headers)
+        if parent is not None and parent.sampled and published is not None:
+            now = time.time()
+            self.record(
+                f"queue {queue_name}", SpanContext(parent.trace_id, _new_id(64), True),
+                parent.span_id, published, max(0.0, now - published), {"queue": queue_name},
+            )
+        return Span(self, name, parent, {"queue": queue_name})
+
+    async def http_middleware(self, request, call_next):
+        """
+        FastAPI middleware: continue the caller's trace (or start one) for
+        each request and return the trace id in `X-Trace-Id`.
+        """
+        with self.span("http", parent=extract(request.headers), method=request.method) as span:
+            response = await call_next(request)
+            route = request.scope.get("route")
+            span.name = f"{request.method} {getattr(route, 'path', request.url.path)}"
+            span.attributes["status"] = response.status_code
+            response.headers["X-Trace-Id"] = span.context.trace_id
+            return response
+
+
+class SpanExporter:
+    """
+    Batches finished spans on a background thread. The queue is bounded:
+    when exporting falls behind, spans are dropped and counted rather than
+    slowing down request handling.
+    """
+
+    def __init__(self, path: str = TRACE_FILE, collector_url: str = TRACE_COLLECTOR_URL,
+                 max_queued: int = TRACE_EXPORT_QUEUE_SIZE, batch_size: int = TRACE_EXPORT_BATCH_SIZE):
+        self.path = path
+        self.collector_url = collector_url
+        self.batch_size = batch_size
+        self._queue: queue.Queue = queue.Queue(maxsize=max_queued)
+        self._thread: Optional[threading.Thread] = None
+        self._lock = threading.Lock()
+        self.exported = 0
+        self.dropped = 0
+
+    def submit(self, span: dict):
+        if self._thread is None:
+            with self._lock:
+                if self._thread is None:
+                    self._thread = threading.Thread(target=self._run, name="span-exporter", daemon=True)
+                    self._thread.start()
+        try:
+            self._queue.put_nowait(span)
+        except queue.Full:
+            self.dropped += 1
+
+    def _run(self):
+        while True:
+            batch = [self._queue.get()]
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            self.export(batch)
+
+    def export(self, batch: List[dict]):
+        if self.path:
+            try:
+                with open(self.path, "a") as f:
+                    f.write("".join(json.dumps(span) + "\n" for span in batch))
+            except OSError as e:
+                logger.error(f"Failed to write spans to {self.path}: {e}")
+        if self.collector_url:
+            request = urllib.request.Request(
+                self.collector_url,
+                data=json.dumps(batch).encode(),
+                headers={"Content-Type": "application/json"},
+                method="POST",
+            )
+            try:
+                urllib.request.urlopen(request, timeout=5).close()
+            except Exception as e:
+                logger.error(f"Failed to send spans to {self.collector_url}: {e}")
+        self.exported += len(batch)
+
+
+exporter = SpanExporter()
+
+
+def load_spans(paths: Iterable[str]) -> List[dict]:
+    spans = []
+    for path in paths:
+        with open(path) as f:
+            spans.extend(json.loads(line) for line in f if line.strip())
+    return spans
+
+
+def stage_breakdown(spans: Iterable[dict]) -> Dict[str, dict]:
+    """Latency percentiles per `service name` stage."""
+    durations = defaultdict(list)
+    for span in spans:
+        durations[f"{span['service']} {span['name']}"].append(span["durationMs"])
+    breakdown = {}
+    for stage, values in sorted(durations.items()):
+        values.sort()
+        at = lambda p: values[min(len(values) - 1, int(p * len(values)))]
+        breakdown[stage] = {"count": len(values), "p50": at(0.50), "p95": at(0.95), "p99": at(0.99), "max": values[-1]}
+    return breakdown
+
+
+def trace_timeline(spans: Iterable[dict], trace_id: str) -> List[str]:
+    """One line per span of a trace, indented under its parent, offsets in ms from the trace start."""
+    trace = [span for span in spans if span["traceId"] == trace_id]
+    if not trace:
+        return []
+    children = defaultdict(list)
+    ids = {span["spanId"] for span in trace}
+    for span in trace:
+        children[span["parentId"] if span["parentId"] in ids else None].append(span)
+    origin = min(span["start"] for span in trace)
+    lines = []
+
+    def walk(parent_id: Optional[str], depth: int):
+        for span in sorted(children[parent_id], key=lambda s: s["start"]):
+            offset = (span["start"] - origin) * 1000
+            lines.append(f"{offset:10.1f}ms {span['durationMs']:10.1f}ms  {'  ' * depth}{span['service']} {span['name']}")
+            walk(span["spanId"], depth + 1)
+
+    walk(None, 0)
+    return lines
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("files", nargs="+", help="span files written by the services")
+    parser.add_argument("--trace", help="print this trace as a timeline instead of per-stage percentiles")
+    args = parser.parse_args()
+
+    spans = load_spans(args.files)
+    if args.trace:
+        print("\n".join(trace_timeline(spans, args.trace)) or f"No spans for trace {args.trace}")
+        return
+    print(f"{'stage':<72} {'count':>7} {'p50':>9} {'p95':>9} {'p99':>9} {'max':>9}")
+    for stage, stats in stage_breakdown(spans).items():
+        print(f"{stage:<72} {stats['count']:>7} {stats['p50']:>9.1f} {stats['p95']:>9.1f} {stats['p99']:>9.1f} {stats['max']:>9.1f}")
+
+
+if __name__ == "__main__":
+    main()
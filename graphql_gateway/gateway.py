@@ -5,7 +5,7 @@ from strawberry.fastapi import GraphQLRouter
 from strawberry.types import Info
 from typing import Optional
 
-from schema import schema
+from schema import schema, tracer
 
 SECRET_KEY = "MY_SECRET_KEY"
 ALGORITHM = "HS256"
@@ -35,6 +35,10 @@ async def jwt_middleware(request: Request, call_next):
     response = await call_next(request)
     return response
 
+# Registered last so it wraps everything else: every request gets a trace,
+# minted here unless the client sent a traceparent.
+app.middleware("http")(tracer.http_middleware)
+
 # Custom context for GraphQL to include user_id
 def get_context(request: Request) -> dict:
     return {"userId": request.state.userId}
@@ -6,6 +6,9 @@ from strawberry.types import Info
 from fastapi.encoders import jsonable_encoder
 import json
 
+from service_client import session
+from tracing import Tracer, inject
+
 SECRET_KEY = os.getenv("SECRET_KEY", "MY_SECRET_KEY")
 ALGORITHM = os.getenv("ALGORITHM", "HS256")
 
@@ -14,6 +17,13 @@ NOTIF_SERVICE_URL = os.getenv("NOTIF_SERVICE_URL", "http://notification_service:
 RECOMMEND_SERVICE_URL = os.getenv("RECOMMEND_SERVICE_URL", "http://recommendation_service:8003")
 ORDER_SERVICE_URL = os.getenv("ORDER_SERVICE_URL", "http://order_service:8004")
 
+tracer = Tracer("graphql_gateway")
+
+def service_request(method: str, url: str, stage: str, **kwargs) -> requests.Response:
+    """Call a backend service inside a client span, forwarding the trace context."""
+    with tracer.span(stage, method=method):
+        return session.request(method, url, headers=inject(), **kwargs)
+
 @strawberry.type
 class PreferencesType:
     promotions: bool
@@ -35,12 +45,14 @@ class RecommendationType:
     userId: int
     productId: int
     reason: Optional[str]
+    score: Optional[float] = None
 
 @strawberry.type
 class OrderType:
     id: int
     userId: int
     status: str
+    productIds: List[int] = strawberry.field(default_factory=list)
 
 @strawberry.type
 class UserType:
@@ -80,6 +92,7 @@ class UpdatePreferencesInput:
 @strawberry.input
 class PlaceOrderInput:
     userId: int  
+    productIds: List[int] = strawberry.field(default_factory=list)
 
 # Queries
 @strawberry.type
@@ -89,7 +102,7 @@ class Query:
         user_id = info.context.get("userId")
         if not user_id:
             raise Exception("Not authenticated")
-        response = requests.get(f"{USER_SERVICE_URL}/user/{user_id}")
+        response = service_request("GET", f"{USER_SERVICE_URL}/user/{user_id}", "user_service.get_user")
         if response.status_code == 200:
             user_data = response.json()
             preferences = json.loads(user_data["preferences"])
@@ -110,18 +123,19 @@ class Query:
         user_id = info.context.get("userId")  
         if not user_id:
             return []
-        response = requests.get(f"{NOTIF_SERVICE_URL}/notifications/unread/{user_id}")
+        response = service_request("GET", f"{NOTIF_SERVICE_URL}/notifications/unread/{user_id}", "notification_service.unread")
         if response.status_code == 200:
             notifs = response.json()
             return [NotificationType(**n) for n in notifs]
         return []
 
     @strawberry.field
-    def recommendations(self, info: Info) -> List[RecommendationType]:
+    def recommendations(self, info: Info, limit: Optional[int] = None) -> List[RecommendationType]:
         user_id = info.context.get("userId")  
         if not user_id:
             return ["Im dumb"]
-        response = requests.get(f"{RECOMMEND_SERVICE_URL}/recommendations/{user_id}")
+        params = {"limit": limit} if limit else None
+        response = service_request("GET", f"{RECOMMEND_SERVICE_URL}/recommendations/{user_id}", "recommendation_service.recommendations", params=params)
         if response.status_code == 200:
             recs = response.json()
             return [RecommendationType(**r) for r in recs]
@@ -132,7 +146,7 @@ class Query:
         user_id = info.context.get("userId")  
         if not user_id:
             return []
-        response = requests.get(f"{ORDER_SERVICE_URL}/orders/{user_id}")
+        response = service_request("GET", f"{ORDER_SERVICE_URL}/orders/{user_id}", "order_service.orders")
         if response.status_code == 200:
             orders = response.json()
             return [OrderType(**o) for o in orders]
@@ -144,7 +158,7 @@ class Mutation:
     @strawberry.mutation
     def register(self, user_input: UserRegisterInput) -> UserType:
         payload = jsonable_encoder(user_input)
-        response = requests.post(f"{USER_SERVICE_URL}/register", json=payload)
+        response = service_request("POST", f"{USER_SERVICE_URL}/register", "user_service.register", json=payload)
         if response.status_code == 200:
             user_data = response.json()
             preferences = json.loads(user_data["preferences"])
@@ -163,7 +177,7 @@ class Mutation:
 
     @strawberry.mutation
     def login(self, login_input: UserLoginInput) -> AuthPayload:
-        response = requests.post(f"{USER_SERVICE_URL}/login", json=login_input.__dict__)
+        response = service_request("POST", f"{USER_SERVICE_URL}/login", "user_service.login", json=login_input.__dict__)
         if response.status_code == 200:
             data = response.json()
             return AuthPayload(token=data["token"], userId=data["userId"])  
@@ -176,12 +190,14 @@ class Mutation:
         user_id = info.context.get("userId")  
         if not user_id:
             raise Exception("Not authenticated")
-        response = requests.put(
+        response = service_request(
+            "PUT",
             f"{USER_SERVICE_URL}/user/{user_id}/preferences",
+            "user_service.update_preferences",
             json=jsonable_encoder(prefs_input)
         )
         if response.status_code == 200:
-            user_response = requests.get(f"{USER_SERVICE_URL}/user/{user_id}")
+            user_response = service_request("GET", f"{USER_SERVICE_URL}/user/{user_id}", "user_service.get_user")
             if user_response.status_code == 200:
                 user_data = user_response.json()
                 preferences = json.loads(user_data["preferences"])
@@ -200,9 +216,11 @@ class Mutation:
 
     @strawberry.mutation
     def placeOrder(self, order_input: PlaceOrderInput) -> OrderType:
-        response = requests.post(
+        response = service_request(
+            "POST",
             f"{ORDER_SERVICE_URL}/order",
-            json={"userId": order_input.userId}  
+            "order_service.place_order",
+            json={"userId": order_input.userId, "productIds": order_input.productIds}
         )
         if response.status_code == 200:
             return OrderType(**response.json())
@@ -214,7 +232,7 @@ class Mutation:
         user_id = info.context.get("userId")  
         if not user_id:
             raise Exception("Not authenticated")
-        response = requests.post(f"{NOTIF_SERVICE_URL}/notifications/mark-read/{notification_id}")
+        response = service_request("POST", f"{NOTIF_SERVICE_URL}/notifications/mark-read/{notification_id}", "notification_service.mark_read")
         if response.status_code == 200:
             return True
         else:
@@ -0,0 +1,131 @@
+"""
+Run every service in a single process.
+
+For small deployments and CI: the five FastAPI apps are imported into one
+interpreter and mounted on one server, events go over the in-process
+message bus (MESSAGE_BUS=memory unless set otherwise) and the gateway's and
+recommendation_service's calls to a co-located service are dispatched
+straight into that service's app instead of over HTTP. Each service keeps
+its own database (DATABASE_URL, when set, is shared by all of them).
+
+The GraphQL endpoint stays at /graphql; each service's own API is mounted
+under its directory name, e.g. /user_service/user/1.
+
+    python monolith/monolith.py
+    uvicorn monolith:create_app --factory --app-dir monolith --port 8000
+"""
+import contextlib
+import importlib
+import logging
+import os
+import sys
+import time
+from collections import defaultdict
+from typing import Dict, Optional
+
+import uvicorn
+from fastapi import FastAPI
+
+_started = time.perf_counter()
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+sys.path.append(os.path.join(ROOT, "common"))
+
+from service_client import mount_app
+
+# (directory, module holding the FastAPI app), in start-up order: the
+# recommendation service bootstraps its preference replica from user_service.
+SERVICES = [
+    ("user_service", "app"),
+    ("order_service", "app"),
+    ("notification_service", "app"),
+    ("recommendation_service", "app"),
+    ("graphql_gateway", "gateway"),
+]
+
+# Base URL other services reach each service at, as (variable, default).
+SERVICE_URLS = {
+    "user_service": ("USER_SERVICE_URL", "http://user_service:8001"),
+    "notification_service": ("NOTIF_SERVICE_URL", "http://notification_service:8002"),
+    "recommendation_service": ("RECOMMEND_SERVICE_URL", "http://recommendation_service:8003"),
+    "order_service": ("ORDER_SERVICE_URL", "http://order_service:8004"),
+}
+
+logger = logging.getLogger("monolith")
+
+
+def load_services(env: Optional[Dict[str, Dict[str, str]]] = None) -> Dict[str, Dict[str, object]]:
+    """
+    Import every service into this interpreter. The services import their
+    modules by bare name and several share names (app, database, models,
+    consumer), so each one's colliding modules are taken back out of
+    sys.modules before the next is loaded; the objects stay alive through
+    the references the service's own modules hold. Modules in common/ are
+    loaded once and shared, the message bus among them.
+
+    `env` holds extra environment variables to set before each service is
+    imported, keyed by directory.
+    """
+    env = env or {}
+    names = defaultdict(int)
+    for directory, _ in SERVICES:
+        for filename in os.listdir(os.path.join(ROOT, directory)):
+            if filename.endswith(".py"):
+                names[filename[:-3]] += 1
+    shared = {name for name, count in names.items() if count > 1}
+
+    loaded = {}
+    for directory, module in SERVICES:
+        path = os.path.join(ROOT, directory)
+        os.environ.update(env.get(directory, {}))
+        sys.path.insert(0, path)
+        try:
+            importlib.import_module(module)
+        finally:
+            sys.path.remove(path)
+            # Kept on the path (after everything else) so spawned helper
+            # processes, such as the password hashing pool, can import
+            # the service's uniquely named modules.
+            sys.path.append(path)
+        loaded[directory] = {name: sys.modules.pop(name) for name in shared if name in sys.modules}
+        loaded[directory][module] = loaded[directory].get(module) or sys.modules[module]
+    return loaded
+
+
+def service_apps(services: Dict[str, Dict[str, object]]) -> Dict[str, FastAPI]:
+    return {directory: services[directory][module].app for directory, module in SERVICES}
+
+
+def create_app(services: Optional[Dict[str, Dict[str, object]]] = None) -> FastAPI:
+    """
+    Load the services (unless already loaded) and mount them on one app
+    whose lifespan runs each service's startup and shutdown in turn.
+    """
+    os.environ.setdefault("MESSAGE_BUS", "memory")
+    if services is None:
+        services = load_services()
+    apps = service_apps(services)
+    for directory, (variable, default) in SERVICE_URLS.items():
+        mount_app(os.getenv(variable, default), apps[directory])
+
+    @contextlib.asynccontextmanager
+    async def lifespan(app: FastAPI):
+        async with contextlib.AsyncExitStack() as stack:
+            for directory, _ in SERVICES:
+                service = apps[directory]
+                await stack.enter_async_context(service.router.lifespan_context(service))
+            logger.info(f"Started {len(apps)} services in {time.perf_counter() - _started:.2f}s")
+            yield
+
+    app = FastAPI(title="Monolith", lifespan=lifespan, docs_url=None, redoc_url=None, openapi_url=None)
+    for directory, service in apps.items():
+        if directory != "graphql_gateway":
+            app.mount(f"/{directory}", service)
+    # Last, so the service prefixes above take precedence.
+    app.mount("/", apps["graphql_gateway"])
+    return app
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    uvicorn.run(create_app(), host="0.0.0.0", port=8000)
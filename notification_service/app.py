@@ -4,14 +4,16 @@ from sqlalchemy.orm import Session
 from typing import List
 
 from database import Base, engine, SessionLocal
+from storage import pool_stats
 from models import Notification
 
 import threading
-from consumer import start_consuming
+from consumer import scheduling_metrics, start_consuming, tracer
 
 
 
 app = FastAPI(title="Notification Service")
+app.middleware("http")(tracer.http_middleware)
 
 def get_db():
     db = SessionLocal()
@@ -20,6 +22,14 @@ def get_db():
     finally:
         db.close()
 
+@app.get("/metrics/database")
+def get_database_metrics():
+    return pool_stats(engine)
+
+@app.get("/metrics/events")
+def get_event_metrics():
+    return scheduling_metrics()
+
 @app.get("/notifications/unread/{user_id}")
 def fetch_unread_notifications(user_id: int, db: Session = Depends(get_db)):
     notifications = db.query(Notification)\
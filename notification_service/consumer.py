@@ -1,21 +1,32 @@
-import pika
-import json
 from sqlalchemy.orm import Session
 from database import SessionLocal
 from models import Notification
+from bus import Delivery, get_bus
+from events import decode
+from lanes import EventLatencyStats, PriorityGate
+from tracing import Tracer, published_at
 import os
+import threading
 import time
 import logging
 
-RABBITMQ_HOST = os.getenv("RABBITMQ_HOST", "rabbitmq")
-RABBITMQ_USER = os.getenv("RABBITMQ_USER", "appuser")
-RABBITMQ_PASS = os.getenv("RABBITMQ_PASS", "securepassword123")
 RECOMMEND_QUEUE = os.getenv("QUEUE_NAME", "recommendations_queue")
 ORDER_UPDATES_QUEUE = os.getenv("ORDER_UPDATES_QUEUE", "order_updates_queue")
+# "lanes" gives each queue its own consumers, with recommendations yielding
+# to order updates; "shared" consumes both queues in turn on one consumer.
+NOTIFICATION_SCHEDULING = os.getenv("NOTIFICATION_SCHEDULING", "lanes")
+ORDER_UPDATES_CONSUMERS = int(os.getenv("ORDER_UPDATES_CONSUMERS", "1"))
+RECOMMEND_CONSUMERS = int(os.getenv("RECOMMEND_CONSUMERS", "1"))
+# Longest a recommendation waits for in-flight order updates to finish.
+RECOMMEND_MAX_YIELD_MS = float(os.getenv("RECOMMEND_MAX_YIELD_MS", "1000"))
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+tracer = Tracer("notification_service")
+event_latency = EventLatencyStats()
+order_updates = PriorityGate()
+
 def handle_new_recommendation(data: dict, db: Session):
     user_id = data.get("userId")
     content = data.get("content")
@@ -44,46 +55,60 @@ def handle_order_status_update(data: dict, db: Session):
     db.refresh(notification)
     logger.info(f"Created order update notification {notification.id} for user {user_id}")
 
-def callback(ch, method, properties, body):
+def callback(delivery: Delivery):
+    started = time.time()
     try:
-        message = json.loads(body)
-        event = message.get("event")
-        data = message.get("data", {})
-        db: Session = SessionLocal()
-        if event == "NEW_RECOMMENDATION":
-            handle_new_recommendation(data, db)
-        elif event == "ORDER_STATUS_UPDATE":
-            handle_order_status_update(data, db)
-        else:
-            logger.warning(f"Unhandled event: {event}")
-        db.close()
-        ch.basic_ack(delivery_tag=method.delivery_tag)
+        message = decode(delivery.body, delivery.content_type)
+        event = message["event"]
+        data = message["data"]
+        with tracer.consume(f"consume {event}", delivery.queue, delivery.headers):
+            db: Session = SessionLocal()
+            if event == "NEW_RECOMMENDATION":
+                handle_new_recommendation(data, db)
+            elif event == "ORDER_STATUS_UPDATE":
+                handle_order_status_update(data, db)
+            else:
+                logger.warning(f"Unhandled event: {event}")
+            db.close()
+        delivery.ack()
+        event_latency.record(event, published_at(delivery.headers), started)
     except Exception as e:
         logger.error(f"Error processing message: {e}")
-        ch.basic_nack(delivery_tag=method.delivery_tag, requeue=False)
-
-def start_consuming():
-    credentials = pika.PlainCredentials(RABBITMQ_USER, RABBITMQ_PASS)
-    parameters = pika.ConnectionParameters(host=RABBITMQ_HOST, credentials=credentials)
+        delivery.nack(requeue=False)
 
-    while True:
-        try:
-            connection = pika.BlockingConnection(parameters)
-            channel = connection.channel()
+def order_update_callback(delivery: Delivery):
+    with order_updates.busy():
+        callback(delivery)
 
-            channel.queue_declare(queue=RECOMMEND_QUEUE, durable=True)
-            channel.queue_declare(queue=ORDER_UPDATES_QUEUE, durable=True)
+def recommendation_callback(delivery: Delivery):
+    order_updates.wait_idle(RECOMMEND_MAX_YIELD_MS / 1000)
+    callback(delivery)
 
-            channel.basic_qos(prefetch_count=1)
+def scheduling_metrics() -> dict:
+    return {
+        "scheduling": NOTIFICATION_SCHEDULING,
+        "orderUpdatesInFlight": order_updates.in_flight,
+        "recommendationYields": order_updates.yields,
+        "events": event_latency.metrics(),
+    }
 
-            channel.basic_consume(queue=RECOMMEND_QUEUE, on_message_callback=callback)
-            channel.basic_consume(queue=ORDER_UPDATES_QUEUE, on_message_callback=callback)
-
-            logger.info(f"Connected to RabbitMQ. Consuming from {RECOMMEND_QUEUE} and {ORDER_UPDATES_QUEUE}...")
-            channel.start_consuming()
-        except pika.exceptions.AMQPConnectionError as e:
-            logger.error(f"Failed to connect to RabbitMQ: {e}. Retrying in 5 seconds...")
-            time.sleep(5)  
-        except Exception as e:
-            logger.error(f"Unexpected error: {e}. Retrying in 5 seconds...")
-            time.sleep(5)
\ No newline at end of file
+def start_consuming():
+    if NOTIFICATION_SCHEDULING == "shared":
+        get_bus().consume([RECOMMEND_QUEUE, ORDER_UPDATES_QUEUE], callback, prefetch=1)
+        return
+    lanes = [
+        (ORDER_UPDATES_QUEUE, ORDER_UPDATES_CONSUMERS, order_update_callback),
+        (RECOMMEND_QUEUE, RECOMMEND_CONSUMERS, recommendation_callback),
+    ]
+    threads = [
+        threading.Thread(
+            target=get_bus().consume, args=([queue_name], handler), kwargs={"prefetch": 1},
+            name=f"{queue_name}-consumer-{index}", daemon=True
+        )
+        for queue_name, consumers, handler in lanes
+        for index in range(max(consumers, 1))
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
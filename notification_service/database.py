@@ -1,9 +1,12 @@
-from sqlalchemy import create_engine
+import os
+
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
 
-DATABASE_URL = "sqlite:///./notification_service.db"
+from storage import create_service_engine
+
+DATABASE_URL = os.getenv("DATABASE_URL", "sqlite:///./notification_service.db")
 
-engine = create_engine(DATABASE_URL, connect_args={"check_same_thread": False})
+engine = create_service_engine(DATABASE_URL)
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 Base = declarative_base()
@@ -0,0 +1,110 @@
+import os
+import threading
+import time
+from collections import defaultdict, deque
+from contextlib import contextmanager
+from typing import Deque, Dict, Optional
+
+EVENT_LATENCY_WINDOW = int(os.getenv("EVENT_LATENCY_WINDOW", "10000"))
+# How long the high-priority lane must have been idle before low-priority
+# work resumes, so a burst isn't interleaved in the gaps between messages.
+PRIORITY_IDLE_GRACE_MS = float(os.getenv("PRIORITY_IDLE_GRACE_MS", "20"))
+
+
+class PriorityGate:
+    """
+    Lets a low-priority lane step aside for a high-priority one. The
+    high-priority lane marks each message it handles as busy; the
+    low-priority lane waits until it has been idle for `grace` seconds
+    before taking its next message, but never longer than its `max_wait`,
+    so it can't starve. Both lanes still have their own consumers, so a
+    high-priority message waits for at most the one low-priority message
+    already being handled.
+    """
+
+    def __init__(self, grace: float = PRIORITY_IDLE_GRACE_MS / 1000):
+        self.grace = grace
+        self._cond = threading.Condition()
+        self._busy = 0
+        self._idle_since = 0.0
+        self.yields = 0
+
+    @contextmanager
+    def busy(self):
+        with self._cond:
+            self._busy += 1
+        try:
+            yield
+        finally:
+            with self._cond:
+                self._busy -= 1
+                if not self._busy:
+                    self._idle_since = time.monotonic()
+                    self._cond.notify_all()
+
+    def wait_idle(self, max_wait: float) -> bool:
+        """Wait for the high-priority lane to settle; False if `max_wait` ran out first."""
+        deadline = time.monotonic() + max_wait
+        with self._cond:
+            yielded = False
+            while True:
+                now = time.monotonic()
+                if not self._busy and now - self._idle_since >= self.grace:
+                    return True
+                if now >= deadline:
+                    return False
+                if not yielded:
+                    yielded = True
+                    self.yields += 1
+                if self._busy:
+                    self._cond.wait(deadline - now)
+                else:
+                    self._cond.wait(min(deadline, self._idle_since + self.grace) - now)
+
+    @property
+    def in_flight(self) -> int:
+        return self._busy
+
+
+def _percentiles(samples) -> Optional[dict]:
+    if not samples:
+        return None
+    ordered = sorted(samples)
+    at = lambda p: round(ordered[min(len(ordered) - 1, int(p * len(ordered)))] * 1000, 2)
+    return {"p50": at(0.50), "p95": at(0.95), "p99": at(0.99), "max": at(1.0)}
+
+
+class EventLatencyStats:
+    """
+    Per event type: how many were handled, and percentiles over the most
+    recent `window` of delivery latency (publish to notification stored)
+    and handling time. Messages without a publish time only count towards
+    handling time.
+    """
+
+    def __init__(self, window: int = EVENT_LATENCY_WINDOW):
+        self.window = window
+        self._lock = threading.Lock()
+        self._counts: Dict[str, int] = defaultdict(int)
+        self._latencies: Dict[str, Deque[float]] = defaultdict(lambda: deque(maxlen=self.window))
+        self._handling: Dict[str, Deque[float]] = defaultdict(lambda: deque(maxlen=self.window))
+
+    def record(self, event: str, published: Optional[float], started: float):
+        now = time.time()
+        with self._lock:
+            self._counts[event] += 1
+            self._handling[event].append(now - started)
+            if published is not None:
+                # Publisher clocks may run slightly ahead of ours.
+                self._latencies[event].append(max(0.0, now - published))
+
+    def metrics(self) -> dict:
+        with self._lock:
+            return {
+                event: {
+                    "count": count,
+                    "latencyMs": _percentiles(self._latencies[event]),
+                    "handlingMs": _percentiles(self._handling[event]),
+                }
+                for event, count in sorted(self._counts.items())
+            }
@@ -1,27 +1,25 @@
-import pika
-import json
 from sqlalchemy.orm import Session
 from apscheduler.schedulers.background import BackgroundScheduler
 from fastapi import FastAPI, Depends
 from pydantic import BaseModel, Field
-import os
+from typing import List
 import time
 
 from database import Base, engine, SessionLocal
-from models import Order
+from storage import pool_stats
+from models import Order, OrderItem
+from bus import publish_event
+from tracing import Tracer
 
 class PlaceOrderRequest(BaseModel):
     userId: int = Field(..., alias="userId")
+    productIds: List[int] = []
 
 class OrderResponse(BaseModel):
     id: int
     userId: int
     status: str
-
-# Environment Variables
-RABBITMQ_HOST = os.getenv("RABBITMQ_HOST", "rabbitmq")
-RABBITMQ_USER = os.getenv("RABBITMQ_USER", "appuser")
-RABBITMQ_PASS = os.getenv("RABBITMQ_PASS", "securepassword123")
+    productIds: List[int] = []
 
 # Queue Names
 ORDER_PLACED_QUEUE = "order_placed_queue"
@@ -30,6 +28,8 @@ ORDER_UPDATES_QUEUE = "order_updates_queue"
 Base.metadata.create_all(bind=engine)
 
 app = FastAPI(title="Order Service")
+tracer = Tracer("order_service")
+app.middleware("http")(tracer.http_middleware)
 
 def get_db():
     db = SessionLocal()
@@ -38,27 +38,14 @@ def get_db():
     finally:
         db.close()
 
-# Utility to publish to RabbitMQ with authentication
 def publish_to_queue(queue_name: str, message: dict):
-    credentials = pika.PlainCredentials(RABBITMQ_USER, RABBITMQ_PASS)
-    parameters = pika.ConnectionParameters(
-        host=RABBITMQ_HOST,
-        credentials=credentials
-    )
-    connection = pika.BlockingConnection(parameters)
-    channel = connection.channel()
-    channel.queue_declare(queue=queue_name, durable=True)
-    channel.basic_publish(
-        exchange='',
-        routing_key=queue_name,
-        body=json.dumps(message),
-        properties=pika.BasicProperties(delivery_mode=2)  # make message persistent
-    )
-    connection.close()
+    with tracer.span(f"publish {queue_name}"):
+        publish_event(queue_name, message["event"], message["data"])
 
 @app.post("/order", response_model=OrderResponse)
 def place_order(order_request: PlaceOrderRequest, db: Session = Depends(get_db)):
     order = Order(userId=order_request.userId, status="placed")
+    order.items = [OrderItem(productId=product_id) for product_id in order_request.productIds]
     db.add(order)
     db.commit()
     db.refresh(order)
@@ -69,7 +56,8 @@ def place_order(order_request: PlaceOrderRequest, db: Session = Depends(get_db))
         "data": {
             "orderId": order.id,
             "userId": order.userId,
-            "status": order.status
+            "status": order.status,
+            "productIds": order.productIds
         }
     }
     publish_to_queue(ORDER_PLACED_QUEUE, order_placed_message)
@@ -78,13 +66,26 @@ def place_order(order_request: PlaceOrderRequest, db: Session = Depends(get_db))
     return OrderResponse(
         id=order.id,
         userId=order.userId,
-        status=order.status
+        status=order.status,
+        productIds=order.productIds
     )
 
-@app.get("/orders/{user_id}")
+@app.get("/metrics/database")
+def get_database_metrics():
+    return pool_stats(engine)
+
+@app.get("/orders/{user_id}", response_model=List[OrderResponse])
 def get_orders(user_id: int, db: Session = Depends(get_db)):
     orders = db.query(Order).filter(Order.userId == user_id).all()
-    return orders
+    return [
+        OrderResponse(
+            id=order.id,
+            userId=order.userId,
+            status=order.status,
+            productIds=order.productIds
+        )
+        for order in orders
+    ]
 
 # Periodic job to update order statuses and notify
 def scheduled_order_update():
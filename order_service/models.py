@@ -1,4 +1,5 @@
-from sqlalchemy import Column, Integer, String, Text
+from sqlalchemy import Column, Integer, String, Text, ForeignKey
+from sqlalchemy.orm import relationship
 from database import Base
 
 class Order(Base):
@@ -6,3 +7,15 @@ class Order(Base):
     id = Column(Integer, primary_key=True, index=True)
     userId = Column(Integer, nullable=False)
     status = Column(String, nullable=False)  # e.g., 'placed', 'shipped', 'delivered'
+    items = relationship("OrderItem", back_populates="order", lazy="selectin", cascade="all, delete-orphan")
+
+    @property
+    def productIds(self):
+        return [item.productId for item in self.items]
+
+class OrderItem(Base):
+    __tablename__ = 'order_items'
+    id = Column(Integer, primary_key=True, index=True)
+    orderId = Column(Integer, ForeignKey('orders.id'), nullable=False, index=True)
+    productId = Column(Integer, nullable=False)
+    order = relationship("Order", back_populates="items")
@@ -1,88 +1,101 @@
 import uvicorn
-from fastapi import FastAPI, Depends, HTTPException
+from fastapi import FastAPI, Depends, Query
 from sqlalchemy.orm import Session
-from pydantic import BaseModel, Field
-import pika
-import json
 import os
 import threading
 import time
-import requests
-import random
-from typing import List, Optional, Dict
+from typing import Iterator
 
 from database import Base, engine, SessionLocal
-from models import Recommendation
-from consumer import start_consuming, generate_random_recommendation, fetch_user_preferences, publish_new_recommendation
+from storage import pool_stats
+from models import Purchase, upgrade_schema
+from consumer import start_consuming, tracer
+from pipeline import run_recommendation_pipeline
+from preferences import stream_users, user_preferences
+from recommender import recommender
+from catalog import catalog
+from store import RECOMMENDATIONS_PER_USER, RECOMMENDATION_TTL_SECONDS, load_recommendation_list, purge_expired_recommendations
 from apscheduler.schedulers.background import BackgroundScheduler
 
 app = FastAPI(title="Recommendation Service")
+app.middleware("http")(tracer.http_middleware)
 
-RABBITMQ_HOST = os.getenv("RABBITMQ_HOST", "rabbitmq")
-RABBITMQ_USER = os.getenv("RABBITMQ_USER", "appuser")
-RABBITMQ_PASS = os.getenv("RABBITMQ_PASS", "securepassword123")
 ORDER_PLACED_QUEUE = os.getenv("ORDER_PLACED_QUEUE", "order_placed_queue")
 USER_SERVICE_URL = os.getenv("USER_SERVICE_URL", "http://user_service:8001")
+RECOMMENDATION_INTERVAL_SECONDS = int(os.getenv("RECOMMENDATION_INTERVAL_SECONDS", "30"))
+RECOMMENDER_REFRESH_SECONDS = int(os.getenv("RECOMMENDER_REFRESH_SECONDS", "10"))
+RECOMMENDATION_PURGE_INTERVAL_SECONDS = int(os.getenv("RECOMMENDATION_PURGE_INTERVAL_SECONDS", "3600"))
+CATALOG_RELOAD_INTERVAL_SECONDS = int(os.getenv("CATALOG_RELOAD_INTERVAL_SECONDS", "30"))
+PREFERENCE_SNAPSHOT_INTERVAL_SECONDS = int(os.getenv("PREFERENCE_SNAPSHOT_INTERVAL_SECONDS", "60"))
+PREFERENCE_RECONCILE_INTERVAL_SECONDS = int(os.getenv("PREFERENCE_RECONCILE_INTERVAL_SECONDS", "3600"))
 
 import logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-DUMMY_PRODUCTS = [
-    {"product_id": 201, "name": "Gaming Chair"},
-    {"product_id": 202, "name": "Mechanical Keyboard"},
-    {"product_id": 203, "name": "HD Webcam"},
-    {"product_id": 204, "name": "Ergonomic Desk"},
-    {"product_id": 205, "name": "Wireless Charger"},
-    {"product_id": 206, "name": "Smartwatch"},
-    {"product_id": 207, "name": "Fitness Tracker"},
-    {"product_id": 208, "name": "Portable Projector"},
-    {"product_id": 209, "name": "Action Camera"},
-    {"product_id": 210, "name": "Drone with Camera"},
-]
-
-def fetch_all_users() -> List[dict]:
+# Held for the duration of a scheduled run so overlapping ticks are skipped
+# instead of piling up behind a slow one.
+_recommendation_task_lock = threading.Lock()
+
+def opted_in_user_ids() -> Iterator[int]:
+    """
+    Yield the ids of users with recommendations enabled from the local
+    preference replica, or stream them from user_service, filtered there,
+    until the replica has been loaded.
+    """
+    if user_preferences.ready:
+        yield from user_preferences.opted_in_user_ids()
+        return
     try:
-        response = requests.get(f"{USER_SERVICE_URL}/users")
-        if response.status_code == 200:
-            return response.json()
-        else:
-            logger.error(f"Failed to fetch users: {response.text}")
-            return []
+        for user in stream_users(prefs="recommendations"):
+            yield user["id"]
     except Exception as e:
-        logger.error(f"Error fetching users: {e}")
-        return []
+        logger.error(f"Error streaming opted-in users: {e}")
 
-def generate_and_publish_recommendation(user_id: int):
-    recommendation = generate_random_recommendation(user_id)
+def load_purchase_history():
     db: Session = SessionLocal()
     try:
+        purchases = db.query(Purchase.userId, Purchase.productId).yield_per(10000)
+        for user_id, product_id in purchases:
+            recommender.record_order(user_id, [product_id])
+    finally:
+        db.close()
+    pairs = recommender.refresh()
+    logger.info(f"Loaded {pairs} purchases across {recommender.product_count} products into the recommender.")
 
-        new_recommendation = Recommendation(
-            userId=recommendation["userId"],
-            productId=recommendation["productId"],
-            reason=recommendation["reason"]
-        )
-        db.add(new_recommendation)
-        db.commit()
-        db.refresh(new_recommendation)
-        logger.info(f"Stored recommendation {new_recommendation.id} for user {user_id}")
+def scheduled_recommendation_task():
+    if not _recommendation_task_lock.acquire(blocking=False):
+        logger.warning("Previous scheduled recommendation run still in progress, skipping this tick.")
+        return
+    try:
+        logger.info("Running scheduled recommendation task...")
+        started = time.monotonic()
+        recommender.refresh()
+        count = run_recommendation_pipeline(opted_in_user_ids())
+        logger.info(f"Scheduled recommendation task completed: {count} recommendations in {time.monotonic() - started:.2f}s.")
+    finally:
+        _recommendation_task_lock.release()
 
-        publish_new_recommendation(recommendation)
+def scheduled_recommendation_purge():
+    db: Session = SessionLocal()
+    try:
+        purged = purge_expired_recommendations(db)
+        db.commit()
+        logger.info(f"Purged {purged} expired recommendations.")
     except Exception as e:
-        logger.error(f"Error storing/publishing recommendation: {e}")
+        logger.error(f"Error purging expired recommendations: {e}")
         db.rollback()
     finally:
         db.close()
 
-def scheduled_recommendation_task():
-    logger.info("Running scheduled recommendation task...")
-    users = fetch_all_users()
-    for user in users:
-        preferences = json.loads(user["preferences"])
-        if preferences.get("recommendations"):
-            generate_and_publish_recommendation(user["id"])
-    logger.info("Scheduled recommendation task completed.")
+def persist_user_preferences():
+    if not user_preferences.ready:
+        user_preferences.bootstrap()
+    user_preferences.save_snapshot()
+
+def reconcile_user_preferences():
+    # Catches updates whose events were lost, e.g. published during a broker outage.
+    user_preferences.bootstrap()
 
 def get_db():
     db = SessionLocal()
@@ -92,25 +105,79 @@ def get_db():
         db.close()
 
 @app.get("/recommendations/{user_id}")
-def get_user_recommendations(user_id: int, db: Session = Depends(get_db)):
-    recommendations = db.query(Recommendation)\
-                       .filter(Recommendation.userId == user_id)\
-                       .all()
-    return recommendations
+def get_user_recommendations(
+    user_id: int,
+    limit: int = Query(RECOMMENDATIONS_PER_USER, ge=1, le=RECOMMENDATIONS_PER_USER),
+    db: Session = Depends(get_db)
+):
+    return load_recommendation_list(db, user_id, limit)
+
+@app.get("/metrics/database")
+def get_database_metrics():
+    return pool_stats(engine)
 
 @app.on_event("startup")
 def startup_event():
-
+    upgrade_schema(engine, RECOMMENDATION_TTL_SECONDS)
     Base.metadata.create_all(bind=engine)
+    logger.info(f"Product catalog loaded with {len(catalog)} products.")
+    user_preferences.load_or_bootstrap()
+    load_purchase_history()
     consumer_thread = threading.Thread(target=start_consuming, daemon=True)
     consumer_thread.start()
     logger.info("Recommendation Service started and consumer initialized.")
 
     scheduler = BackgroundScheduler()
-    scheduler.add_job(scheduled_recommendation_task, 'interval', seconds=30)  
+    scheduler.add_job(
+        scheduled_recommendation_task,
+        'interval',
+        seconds=RECOMMENDATION_INTERVAL_SECONDS,
+        max_instances=1,
+        coalesce=True,
+    )
+    scheduler.add_job(
+        recommender.refresh,
+        'interval',
+        seconds=RECOMMENDER_REFRESH_SECONDS,
+        max_instances=1,
+        coalesce=True,
+    )
+    scheduler.add_job(
+        scheduled_recommendation_purge,
+        'interval',
+        seconds=RECOMMENDATION_PURGE_INTERVAL_SECONDS,
+        max_instances=1,
+        coalesce=True,
+    )
+    scheduler.add_job(
+        catalog.reload_if_changed,
+        'interval',
+        seconds=CATALOG_RELOAD_INTERVAL_SECONDS,
+        max_instances=1,
+        coalesce=True,
+    )
+    scheduler.add_job(
+        persist_user_preferences,
+        'interval',
+        seconds=PREFERENCE_SNAPSHOT_INTERVAL_SECONDS,
+        max_instances=1,
+        coalesce=True,
+    )
+    scheduler.add_job(
+        reconcile_user_preferences,
+        'interval',
+        seconds=PREFERENCE_RECONCILE_INTERVAL_SECONDS,
+        max_instances=1,
+        coalesce=True,
+    )
     scheduler.start()
     logger.info("Scheduler for scheduled recommendations started.")
 
+@app.on_event("shutdown")
+def shutdown_event():
+    user_preferences.save_snapshot()
+
 if __name__ == "__main__":
+    upgrade_schema(engine, RECOMMENDATION_TTL_SECONDS)
     Base.metadata.create_all(bind=engine)
     uvicorn.run(app, host="0.0.0.0", port=8003)
\ No newline at end of file
@@ -0,0 +1,276 @@
+import argparse
+import json
+import logging
+import mmap
+import os
+import random
+import struct
+import threading
+from typing import Iterable, Iterator, List, NamedTuple, Optional
+
+CATALOG_PATH = os.getenv("CATALOG_PATH", "./catalog.bin")
+CATALOG_SEED_PATH = os.getenv(
+    "CATALOG_SEED_PATH", os.path.join(os.path.dirname(os.path.abspath(__file__)), "products.json")
+)
+
+logger = logging.getLogger(__name__)
+
+# File layout (little endian). Every section is a flat array so a reader only
+# needs the header to find anything, and lookups touch a handful of pages:
+#
+#   header              magic, version, counts and section offsets
+#   records             product_count x (product_id q, name offset I, name length H, category H)
+#   slots               slot_count x I, open-addressed hash of product_id -> record index + 1
+#   category starts     (category_count + 1) x I, ranges into category members
+#   category members    product_count x I, record indexes grouped by category
+#   category names      category_count x (name offset I, name length H, padding H)
+#   names               UTF-8 product and category names
+_MAGIC = b"PCAT"
+_VERSION = 1
+_HEADER = struct.Struct("<4sHHII6I")
+_RECORD = struct.Struct("<qIHH")
+_U32 = struct.Struct("<I")
+_CATEGORY = struct.Struct("<IHH")
+_HASH_MULTIPLIER = 0x9E3779B97F4A7C15
+_MASK64 = (1 << 64) - 1
+
+
+class Product(NamedTuple):
+    product_id: int
+    name: str
+    category: str
+
+
+def _slot_bits(product_count: int) -> int:
+    # At most half full so linear probes stay short.
+    return max(1, (2 * product_count - 1).bit_length())
+
+
+def _home_slot(product_id: int, bits: int) -> int:
+    return ((product_id * _HASH_MULTIPLIER) & _MASK64) >> (64 - bits)
+
+
+def build_catalog(products: Iterable[dict], path: str):
+    """
+    Write products ({"product_id", "name", "category"}) to `path` in the
+    catalog format. The file is written beside the target and swapped in
+    atomically so running readers can pick it up with a reload.
+    """
+    products = sorted(products, key=lambda product: product["product_id"])
+    categories = sorted({product.get("category") or "" for product in products})
+    category_index = {category: index for index, category in enumerate(categories)}
+
+    names = bytearray()
+    records = bytearray()
+    for product in products:
+        encoded = product["name"].encode("utf-8")
+        records += _RECORD.pack(product["product_id"], len(names), len(encoded), category_index[product.get("category") or ""])
+        names += encoded
+    category_names = bytearray()
+    for category in categories:
+        encoded = category.encode("utf-8")
+        category_names += _CATEGORY.pack(len(names), len(encoded), 0)
+        names += encoded
+
+    bits = _slot_bits(len(products))
+    slot_count = 1 << bits
+    slots = [0] * slot_count
+    for index, product in enumerate(products):
+        slot = _home_slot(product["product_id"], bits)
+        while slots[slot]:
+            slot = (slot + 1) & (slot_count - 1)
+        slots[slot] = index + 1
+
+    members: List[List[int]] = [[] for _ in categories]
+    for index, product in enumerate(products):
+        members[category_index[product.get("category") or ""]].append(index)
+    starts, flat_members = [0], []
+    for indexes in members:
+        flat_members.extend(indexes)
+        starts.append(len(flat_members))
+
+    records_offset = _HEADER.size
+    slots_offset = records_offset + len(records)
+    starts_offset = slots_offset + slot_count * _U32.size
+    members_offset = starts_offset + len(starts) * _U32.size
+    category_names_offset = members_offset + len(flat_members) * _U32.size
+    names_offset = category_names_offset + len(category_names)
+
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(_HEADER.pack(
+            _MAGIC, _VERSION, len(categories), len(products), slot_count,
+            records_offset, slots_offset, starts_offset, members_offset, category_names_offset, names_offset,
+        ))
+        f.write(records)
+        f.write(struct.pack(f"<{slot_count}I", *slots))
+        f.write(struct.pack(f"<{len(starts)}I", *starts))
+        f.write(struct.pack(f"<{len(flat_members)}I", *flat_members))
+        f.write(category_names)
+        f.write(names)
+    os.replace(tmp_path, path)
+
+
+class Catalog:
+    """
+    Read-only view over a catalog file. The file is memory-mapped, so worker
+    processes opening the same file share its pages and only the parts that
+    are actually read become resident. Opening parses the header and the
+    (small) category table; everything else is read on demand.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        with open(path, "rb") as f:
+            self.stat = os.fstat(f.fileno())
+            self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        (
+            magic, version, self._category_count, self._product_count, self._slot_count,
+            self._records_offset, self._slots_offset, self._starts_offset,
+            self._members_offset, self._category_names_offset, self._names_offset,
+        ) = _HEADER.unpack_from(self._map, 0)
+        if magic != _MAGIC or version != _VERSION:
+            raise ValueError(f"{path} is not a version {_VERSION} product catalog")
+        self._slot_bits = self._slot_count.bit_length() - 1
+        self._categories = [self._category_name(index) for index in range(self._category_count)]
+        self._category_index = {category: index for index, category in enumerate(self._categories)}
+
+    def __len__(self) -> int:
+        return self._product_count
+
+    def _string(self, offset: int, length: int) -> str:
+        start = self._names_offset + offset
+        return self._map[start:start + length].decode("utf-8")
+
+    def _category_name(self, index: int) -> str:
+        offset, length, _ = _CATEGORY.unpack_from(self._map, self._category_names_offset + index * _CATEGORY.size)
+        return self._string(offset, length)
+
+    def _record(self, index: int) -> Product:
+        product_id, name_offset, name_length, category = _RECORD.unpack_from(
+            self._map, self._records_offset + index * _RECORD.size
+        )
+        return Product(product_id, self._string(name_offset, name_length), self._categories[category])
+
+    def _find(self, product_id: int) -> Optional[int]:
+        if not self._product_count:
+            return None
+        mask = self._slot_count - 1
+        slot = _home_slot(product_id, self._slot_bits)
+        while True:
+            entry = _U32.unpack_from(self._map, self._slots_offset + slot * _U32.size)[0]
+            if not entry:
+                return None
+            stored_id = struct.unpack_from("<q", self._map, self._records_offset + (entry - 1) * _RECORD.size)[0]
+            if stored_id == product_id:
+                return entry - 1
+            slot = (slot + 1) & mask
+
+    def get(self, product_id: int) -> Optional[Product]:
+        index = self._find(product_id)
+        return None if index is None else self._record(index)
+
+    def __contains__(self, product_id: int) -> bool:
+        return self._find(product_id) is not None
+
+    def name(self, product_id: int, default: str = "Unknown Product") -> str:
+        product = self.get(product_id)
+        return product.name if product else default
+
+    def categories(self) -> List[str]:
+        return list(self._categories)
+
+    def in_category(self, category: str) -> Iterator[Product]:
+        index = self._category_index.get(category)
+        if index is None:
+            return
+        start, stop = struct.unpack_from("<2I", self._map, self._starts_offset + index * _U32.size)
+        for position in range(start, stop):
+            yield self._record(_U32.unpack_from(self._map, self._members_offset + position * _U32.size)[0])
+
+    def random_product(self) -> Optional[Product]:
+        if not self._product_count:
+            return None
+        return self._record(random.randrange(self._product_count))
+
+
+class CatalogHandle:
+    """
+    Process-wide entry point to the current catalog. `reload_if_changed`
+    swaps in a new Catalog when the file on disk has been replaced; callers
+    that still hold the old one keep a valid mapping until they drop it.
+    """
+
+    def __init__(self, path: str = CATALOG_PATH, seed_path: str = CATALOG_SEED_PATH):
+        self.path = path
+        self.seed_path = seed_path
+        self._catalog: Optional[Catalog] = None
+        self._lock = threading.Lock()
+
+    @property
+    def current(self) -> Catalog:
+        catalog = self._catalog
+        if catalog is None:
+            with self._lock:
+                if self._catalog is None:
+                    self._catalog = self._open()
+                catalog = self._catalog
+        return catalog
+
+    def _open(self) -> Catalog:
+        if not os.path.exists(self.path):
+            with open(self.seed_path) as f:
+                build_catalog(json.load(f), self.path)
+            logger.info(f"Built product catalog {self.path} from {self.seed_path}")
+        return Catalog(self.path)
+
+    def reload_if_changed(self) -> bool:
+        try:
+            stat = os.stat(self.path)
+        except FileNotFoundError:
+            return False
+        current = self._catalog
+        if current is not None and (stat.st_ino, stat.st_mtime_ns, stat.st_size) == (
+            current.stat.st_ino, current.stat.st_mtime_ns, current.stat.st_size
+        ):
+            return False
+        try:
+            catalog = Catalog(self.path)
+        except (OSError, ValueError, struct.error) as e:
+            logger.error(f"Failed to reload product catalog: {e}")
+            return False
+        with self._lock:
+            self._catalog = catalog
+        logger.info(f"Reloaded product catalog with {len(catalog)} products")
+        return True
+
+    def __len__(self) -> int:
+        return len(self.current)
+
+    def __contains__(self, product_id: int) -> bool:
+        return product_id in self.current
+
+    def get(self, product_id: int) -> Optional[Product]:
+        return self.current.get(product_id)
+
+    def name(self, product_id: int, default: str = "Unknown Product") -> str:
+        return self.current.name(product_id, default)
+
+    def in_category(self, category: str) -> Iterator[Product]:
+        return self.current.in_category(category)
+
+    def random_product(self) -> Optional[Product]:
+        return self.current.random_product()
+
+
+catalog = CatalogHandle()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Build a product catalog file from a JSON product list.")
+    parser.add_argument("source", help="JSON array of {product_id, name, category} objects")
+    parser.add_argument("output", nargs="?", default=CATALOG_PATH)
+    args = parser.parse_args()
+    with open(args.source) as f:
+        build_catalog(json.load(f), args.output)
+    print(f"Wrote {len(Catalog(args.output))} products to {args.output}")
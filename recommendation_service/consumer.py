@@ -1,50 +1,98 @@
-from typing import Optional, Dict
-import pika
+from typing import Collection, Optional, Dict, List
 import json
+import numpy as np
 from sqlalchemy.orm import Session
 from database import SessionLocal
-from models import Recommendation
+from models import Purchase
+from preferences import user_preferences
+from recommender import recommender
+from catalog import catalog
+from store import RECOMMENDATIONS_PER_USER, store_recommendations
+from workers import OrderedWorkerPool
+from bus import Delivery, event_message, get_bus
+from events import decode
+from service_client import session
+from tracing import Tracer, inject
+import functools
 import os
-import time
 import logging
-import requests
-import random
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-RABBITMQ_HOST = os.getenv("RABBITMQ_HOST", "rabbitmq")
-RABBITMQ_USER = os.getenv("RABBITMQ_USER", "appuser")
-RABBITMQ_PASS = os.getenv("RABBITMQ_PASS", "securepassword123")
+tracer = Tracer("recommendation_service")
+
 ORDER_PLACED_QUEUE = os.getenv("ORDER_PLACED_QUEUE", "order_placed_queue")
+USER_PREFERENCES_QUEUE = os.getenv("USER_PREFERENCES_QUEUE", "user_preferences_queue")
 USER_SERVICE_URL = os.getenv("USER_SERVICE_URL", "http://user_service:8001")
-
-DUMMY_PRODUCTS = [
-    {"product_id": 101, "name": "Wireless Mouse"},
-    {"product_id": 102, "name": "Bluetooth Keyboard"},
-    {"product_id": 103, "name": "USB-C Hub"},
-    {"product_id": 104, "name": "Noise Cancelling Headphones"},
-    {"product_id": 105, "name": "4K Monitor"},
-    {"product_id": 106, "name": "External SSD"},
-    {"product_id": 107, "name": "Smartphone Stand"},
-    {"product_id": 108, "name": "Webcam"},
-    {"product_id": 109, "name": "Portable Charger"},
-    {"product_id": 110, "name": "LED Desk Lamp"},
-]
-
-def generate_random_recommendation(user_id: int) -> dict:
-    product = random.choice(DUMMY_PRODUCTS)
+# Events are processed by this many worker threads, sharded by userId; 1
+# handles every message inline on the consumer thread.
+CONSUMER_WORKERS = int(os.getenv("CONSUMER_WORKERS", "4"))
+CONSUMER_PREFETCH_PER_WORKER = int(os.getenv("CONSUMER_PREFETCH_PER_WORKER", "4"))
+
+def generate_random_recommendation(user_id: int) -> Optional[dict]:
+    product = catalog.random_product()
+    if product is None:
+        return None
     reason = "Based on your recent order."
     recommendation = {
         "userId": user_id,
-        "productId": product["product_id"],
-        "reason": reason
+        "productId": product.product_id,
+        "reason": reason,
+        "score": 0.0
     }
     return recommendation
 
+def generate_recommendations(user_ids: List[int], k: int = 1, exclude: Collection[int] = ()) -> List[List[dict]]:
+    """
+    Score the whole batch in one pass of the item-to-item model and return
+    up to `k` scored recommendations per user, best first. `exclude` holds
+    products that must not be recommended even though the model may not know
+    about them yet, such as the ones in an order being handled. Products no
+    longer in the catalog are skipped. Users the model can't place anything
+    for (e.g. before any order carried product ids) fall back to a single
+    random catalog pick.
+    """
+    product_ids, scores, personalized = recommender.recommend(user_ids, k=k + len(exclude))
+    # Far fewer distinct products than users x k, so each is looked up once.
+    available = {
+        product_id for product_id in np.unique(product_ids).tolist()
+        if product_id >= 0 and product_id not in exclude and product_id in catalog
+    }
+    recommendations = []
+    for user_id, candidates, candidate_scores, has_history in zip(
+        user_ids, product_ids.tolist(), scores.tolist(), personalized.tolist()
+    ):
+        reason = "Customers who bought your items also bought this." if has_history else "Popular with other customers."
+        user_recommendations = [
+            {"userId": user_id, "productId": product_id, "reason": reason, "score": score}
+            for product_id, score in zip(candidates, candidate_scores)
+            if product_id in available
+        ][:k]
+        if not user_recommendations:
+            fallback = generate_random_recommendation(user_id)
+            user_recommendations = [fallback] if fallback else []
+        recommendations.append(user_recommendations)
+    return recommendations
+
+def record_purchases(user_id: int, product_ids: List[int]):
+    if not product_ids:
+        return
+    db: Session = SessionLocal()
+    try:
+        db.execute(
+            Purchase.__table__.insert(),
+            [{"userId": user_id, "productId": product_id} for product_id in product_ids]
+        )
+        db.commit()
+    finally:
+        db.close()
+    recommender.record_order(user_id, product_ids)
+
 def fetch_user_preferences(user_id: int) -> Optional[Dict]:
     try:
-        response = requests.get(f"{USER_SERVICE_URL}/user/{user_id}")
+        with tracer.span("user_service.get_user"):
+            response = session.get(f"{USER_SERVICE_URL}/user/{user_id}", headers=inject())
         if response.status_code == 200:
             user_data = response.json()
             preferences = json.loads(user_data["preferences"])
@@ -56,29 +104,36 @@ def fetch_user_preferences(user_id: int) -> Optional[Dict]:
         logger.error(f"Error fetching user preferences: {e}")
         return None
 
-def publish_new_recommendation(recommendation: dict):
-    credentials = pika.PlainCredentials(RABBITMQ_USER, RABBITMQ_PASS)
-    parameters = pika.ConnectionParameters(host=RABBITMQ_HOST, credentials=credentials)
-    connection = pika.BlockingConnection(parameters)
-    channel = connection.channel()
-    channel.queue_declare(queue="recommendations_queue", durable=True)
-
-    product_name = next((product["name"] for product in DUMMY_PRODUCTS if product["product_id"] == recommendation["productId"]), "Unknown Product")
+def recommendations_enabled(user_id: int) -> bool:
+    enabled = user_preferences.get(user_id)
+    if enabled is None:
+        # Not in the local replica yet (e.g. before bootstrap finished), so
+        # ask user_service once and remember the answer.
+        preferences = fetch_user_preferences(user_id)
+        if preferences is None:
+            return False
+        enabled = bool(preferences.get("recommendations"))
+        user_preferences.set(user_id, enabled)
+    return enabled
+
+def publish_new_recommendations(recommendations: List[dict]):
+    if not recommendations:
+        return
+    with tracer.span("publish recommendations_queue", count=len(recommendations)):
+        _publish_new_recommendations(recommendations)
 
-    message = {
-        "event": "NEW_RECOMMENDATION",
-        "data": {
+def _publish_new_recommendations(recommendations: List[dict]):
+    messages = [
+        event_message("NEW_RECOMMENDATION", {
             "userId": recommendation["userId"],
-            "content": f"Recommended product {product_name} (Product ID: {recommendation['productId']}) "
-        }
-    }
-    channel.basic_publish(
-        exchange='',
-        routing_key="recommendations_queue",
-        body=json.dumps(message),
-        properties=pika.BasicProperties(delivery_mode=2)
-    )
-    connection.close()
+            "content": f"Recommended product {catalog.name(recommendation['productId'])} (Product ID: {recommendation['productId']}) "
+        })
+        for recommendation in recommendations
+    ]
+    get_bus().publish("recommendations_queue", messages)
+
+def publish_new_recommendation(recommendation: dict):
+    publish_new_recommendations([recommendation])
 
 def handle_order_placed(data: dict):
     user_id = data.get("userId")
@@ -86,23 +141,26 @@ def handle_order_placed(data: dict):
         logger.error("userId not found in ORDER_PLACED event")
         return
 
-    preferences = fetch_user_preferences(user_id)
-    if preferences and preferences.get("recommendations"):
-        recommendation = generate_random_recommendation(user_id)
+    product_ids = data.get("productIds") or []
+    with tracer.span("record_purchases"):
+        record_purchases(user_id, product_ids)
+
+    if recommendations_enabled(user_id):
+        with tracer.span("generate_recommendations"):
+            recommendations = generate_recommendations(
+                [user_id], k=RECOMMENDATIONS_PER_USER, exclude=set(product_ids)
+            )[0]
+        if not recommendations:
+            logger.warning(f"No recommendation available for user {user_id}")
+            return
         db: Session = SessionLocal()
         try:
+            with tracer.span("store_recommendations"):
+                store_recommendations(db, recommendations)
+                db.commit()
+            logger.info(f"Stored {len(recommendations)} recommendations for user {user_id}")
 
-            new_recommendation = Recommendation(
-                userId=recommendation["userId"],
-                productId=recommendation["productId"],
-                reason=recommendation["reason"]
-            )
-            db.add(new_recommendation)
-            db.commit()
-            db.refresh(new_recommendation)
-            logger.info(f"Stored recommendation {new_recommendation.id} for user {user_id}")
-
-            publish_new_recommendation(recommendation)
+            publish_new_recommendation(recommendations[0])
         except Exception as e:
             logger.error(f"Error storing recommendation: {e}")
             db.rollback()
@@ -111,38 +169,61 @@ def handle_order_placed(data: dict):
     else:
         logger.info(f"User {user_id} has not enabled recommendations.")
 
-def callback(ch, method, properties, body):
-    try:
-        message = json.loads(body)
-        event = message.get("event")
-        data = message.get("data", {})
+def handle_user_preferences_updated(data: dict):
+    user_id = data.get("userId")
+    if not user_id:
+        logger.error("userId not found in USER_PREFERENCES_UPDATED event")
+        return
+    preferences = data.get("preferences") or {}
+    user_preferences.set(user_id, bool(preferences.get("recommendations")))
 
-        if event == "ORDER_PLACED":
-            handle_order_placed(data)
-        else:
-            logger.warning(f"Unhandled event: {event}")
+def handle_message(message: dict):
+    event = message.get("event")
+    data = message.get("data", {})
+
+    if event == "ORDER_PLACED":
+        handle_order_placed(data)
+    elif event == "USER_PREFERENCES_UPDATED":
+        handle_user_preferences_updated(data)
+    else:
+        logger.warning(f"Unhandled event: {event}")
+
+def process_delivery(delivery: tuple):
+    """Handle a decoded (message, AMQP headers, queue name) inside the publisher's trace."""
+    message, headers, queue_name = delivery
+    with tracer.consume(f"consume {message.get('event')}", queue_name, headers):
+        handle_message(message)
 
-        ch.basic_ack(delivery_tag=method.delivery_tag)
+def callback(delivery: Delivery):
+    try:
+        process_delivery((decode(delivery.body, delivery.content_type), delivery.headers, delivery.queue))
+        delivery.ack()
     except Exception as e:
         logger.error(f"Error processing message: {e}")
-        ch.basic_nack(delivery_tag=method.delivery_tag, requeue=False)
+        delivery.nack(requeue=False)
 
-def start_consuming():
-    credentials = pika.PlainCredentials(RABBITMQ_USER, RABBITMQ_PASS)
-    parameters = pika.ConnectionParameters(host=RABBITMQ_HOST, credentials=credentials)
+def dispatch(pool: OrderedWorkerPool, delivery: Delivery):
+    try:
+        message = decode(delivery.body, delivery.content_type)
+        user_id = message["data"]["userId"]
+    except Exception as e:
+        logger.error(f"Error decoding message: {e}")
+        delivery.nack(requeue=False)
+        return
+    pool.submit(user_id, delivery, (message, delivery.headers, delivery.queue))
 
-    while True:
-        try:
-            connection = pika.BlockingConnection(parameters)
-            channel = connection.channel()
-            channel.queue_declare(queue=ORDER_PLACED_QUEUE, durable=True)
-            channel.basic_qos(prefetch_count=1)
-            channel.basic_consume(queue=ORDER_PLACED_QUEUE, on_message_callback=callback)
-            logger.info(f"Connected to RabbitMQ. Consuming from {ORDER_PLACED_QUEUE}...")
-            channel.start_consuming()
-        except pika.exceptions.AMQPConnectionError as e:
-            logger.error(f"Failed to connect to RabbitMQ: {e}. Retrying in 5 seconds...")
-            time.sleep(5)  
-        except Exception as e:
-            logger.error(f"Unexpected error: {e}. Retrying in 5 seconds...")
-            time.sleep(5)
\ No newline at end of file
+def start_consuming():
+    queues = [ORDER_PLACED_QUEUE, USER_PREFERENCES_QUEUE]
+    logger.info(f"Consuming from {ORDER_PLACED_QUEUE} and {USER_PREFERENCES_QUEUE} with {max(CONSUMER_WORKERS, 1)} worker(s)...")
+    if CONSUMER_WORKERS > 1:
+        pool = OrderedWorkerPool(CONSUMER_WORKERS, process_delivery, name="order-placed-worker")
+        get_bus().consume(
+            queues,
+            functools.partial(dispatch, pool),
+            prefetch=CONSUMER_WORKERS * CONSUMER_PREFETCH_PER_WORKER,
+            # Unacked deliveries are redelivered on the next connection, so
+            # queued work is dropped rather than finished late.
+            on_disconnect=pool.reset,
+        )
+    else:
+        get_bus().consume(queues, callback, prefetch=1)
@@ -1,9 +1,88 @@
-from sqlalchemy import Column, Integer, String, Text
+from datetime import datetime, timedelta
+from sqlalchemy import Column, Integer, String, Text, Float, DateTime, UniqueConstraint, inspect, text
 from database import Base
 
 class Recommendation(Base):
     __tablename__ = 'recommendations'
+    __table_args__ = (
+        UniqueConstraint('userId', 'productId', name='uq_recommendations_user_product'),
+    )
     id = Column(Integer, primary_key=True, index=True)
-    userId = Column(Integer, nullable=False)
+    userId = Column(Integer, nullable=False, index=True)
     productId = Column(Integer, nullable=False)
     reason = Column(String, nullable=True)
+    score = Column(Float, nullable=False, default=0.0)
+    expiresAt = Column(DateTime, nullable=False, index=True)
+
+class RecommendationList(Base):
+    """
+    Precomputed, score-ordered top-N recommendations for one user, stored as
+    a JSON blob. `ranking` and `expiresAt` describe what the blob holds so a
+    rescoring can tell whether it needs rewriting without parsing it.
+    """
+    __tablename__ = 'recommendation_lists'
+    userId = Column(Integer, primary_key=True)
+    payload = Column(Text, nullable=False)
+    ranking = Column(Text, nullable=True)
+    expiresAt = Column(DateTime, nullable=True)
+
+class Purchase(Base):
+    __tablename__ = 'purchases'
+    id = Column(Integer, primary_key=True, index=True)
+    userId = Column(Integer, nullable=False)
+    productId = Column(Integer, nullable=False)
+
+
+def upgrade_schema(engine, ttl_seconds: int):
+    """
+    Bring a `recommendations` table created before recommendations were
+    scored and deduplicated up to date: add `score` and `expiresAt` (existing
+    rows expire one TTL from now, like freshly stored ones), keep only the
+    newest row per (userId, productId) so the unique key can be created, and
+    add the indexes. Lists stored before they recorded their ranking get the
+    new columns empty, so the next scoring rewrites them. create_all never
+    alters an existing table.
+    """
+    inspector = inspect(engine)
+    tables = inspector.get_table_names()
+    if 'recommendation_lists' in tables:
+        list_columns = {column['name'] for column in inspector.get_columns('recommendation_lists')}
+        with engine.begin() as connection:
+            if 'ranking' not in list_columns:
+                connection.execute(text('ALTER TABLE recommendation_lists ADD COLUMN ranking TEXT'))
+            if 'expiresAt' not in list_columns:
+                column_type = DateTime().compile(dialect=engine.dialect)
+                connection.execute(text(f'ALTER TABLE recommendation_lists ADD COLUMN "expiresAt" {column_type}'))
+    if 'recommendations' not in tables:
+        return
+    columns = {column['name'] for column in inspector.get_columns('recommendations')}
+    indexes = inspector.get_indexes('recommendations')
+    index_names = {index['name'] for index in indexes}
+    unique_names = {constraint['name'] for constraint in inspector.get_unique_constraints('recommendations')}
+    unique_names |= {index['name'] for index in indexes if index['unique']}
+    if (
+        {'score', 'expiresAt'} <= columns
+        and 'uq_recommendations_user_product' in unique_names
+        and {'ix_recommendations_userId', 'ix_recommendations_expiresAt'} <= index_names
+    ):
+        return
+    with engine.begin() as connection:
+        if 'score' not in columns:
+            connection.execute(text('ALTER TABLE recommendations ADD COLUMN score FLOAT NOT NULL DEFAULT 0'))
+        if 'expiresAt' not in columns:
+            expires_at = datetime.utcnow() + timedelta(seconds=ttl_seconds)
+            column_type = DateTime().compile(dialect=engine.dialect)
+            connection.execute(text(
+                f'ALTER TABLE recommendations ADD COLUMN "expiresAt" {column_type} NOT NULL '
+                f"DEFAULT '{expires_at.strftime('%Y-%m-%d %H:%M:%S.%f')}'"
+            ))
+        if 'uq_recommendations_user_product' not in unique_names:
+            connection.execute(text(
+                'DELETE FROM recommendations WHERE id NOT IN '
+                '(SELECT MAX(id) FROM recommendations GROUP BY "userId", "productId")'
+            ))
+            connection.execute(text(
+                'CREATE UNIQUE INDEX uq_recommendations_user_product ON recommendations ("userId", "productId")'
+            ))
+        connection.execute(text('CREATE INDEX IF NOT EXISTS "ix_recommendations_userId" ON recommendations ("userId")'))
+        connection.execute(text('CREATE INDEX IF NOT EXISTS "ix_recommendations_expiresAt" ON recommendations ("expiresAt")'))
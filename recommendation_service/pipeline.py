@@ -0,0 +1,96 @@
+import itertools
+import logging
+import os
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Callable, Deque, Iterable, Iterator, List
+
+from sqlalchemy.orm import Session
+
+from database import SessionLocal
+from consumer import generate_recommendations, publish_new_recommendations
+from store import RECOMMENDATIONS_PER_USER, store_recommendations
+
+RECOMMENDATION_CHUNK_SIZE = int(os.getenv("RECOMMENDATION_CHUNK_SIZE", "5000"))
+RECOMMENDATION_CONCURRENCY = int(os.getenv("RECOMMENDATION_CONCURRENCY", "2"))
+
+logger = logging.getLogger(__name__)
+
+
+def chunked(iterable: Iterable, size: int) -> Iterator[List]:
+    """
+    Lazily split an iterable into lists of at most `size` items so callers
+    never hold more than one chunk of the input in memory.
+    """
+    iterator = iter(iterable)
+    while True:
+        chunk = list(itertools.islice(iterator, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def process_recommendation_chunk(
+    user_ids: List[int],
+    session_factory: Callable[[], Session] = SessionLocal,
+    publish: Callable[[List[dict]], None] = publish_new_recommendations,
+) -> int:
+    """
+    Score the chunk in one vectorised pass, upsert every user's top-N in a
+    single transaction and publish the best pick of each user whose ranking
+    changed as one batch over a single broker connection; users whose stored
+    recommendations still stand are not notified again.
+    """
+    per_user = generate_recommendations(user_ids, k=RECOMMENDATIONS_PER_USER)
+
+    db = session_factory()
+    try:
+        written = set(store_recommendations(
+            db, [recommendation for recommendations in per_user for recommendation in recommendations]
+        ))
+        db.commit()
+    except Exception:
+        db.rollback()
+        raise
+    finally:
+        db.close()
+
+    best = [recommendations[0] for recommendations in per_user
+            if recommendations and recommendations[0]["userId"] in written]
+    publish(best)
+    return len(best)
+
+
+def _chunk_result(future: Future) -> int:
+    try:
+        return future.result()
+    except Exception as e:
+        logger.error(f"Error processing recommendation chunk: {e}")
+        return 0
+
+
+def run_recommendation_pipeline(
+    user_ids: Iterable[int],
+    chunk_size: int = RECOMMENDATION_CHUNK_SIZE,
+    concurrency: int = RECOMMENDATION_CONCURRENCY,
+    session_factory: Callable[[], Session] = SessionLocal,
+    publish: Callable[[List[dict]], None] = publish_new_recommendations,
+) -> int:
+    """
+    Stream user ids through the recommendation pipeline in chunks, keeping at
+    most `concurrency` chunks in flight. A failing chunk is logged and skipped
+    so it does not abort the rest of the run. Returns the number of
+    recommendations published.
+    """
+    total = 0
+    pending: Deque[Future] = deque()
+    with ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix="recommendations") as executor:
+        for chunk in chunked(user_ids, chunk_size):
+            if len(pending) >= concurrency:
+                total += _chunk_result(pending.popleft())
+            pending.append(
+                executor.submit(process_recommendation_chunk, chunk, session_factory, publish)
+            )
+        while pending:
+            total += _chunk_result(pending.popleft())
+    return total
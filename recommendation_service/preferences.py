@@ -0,0 +1,208 @@
+import json
+import logging
+import os
+import struct
+import threading
+from typing import Iterator, List, Optional, Set
+
+from service_client import session
+
+USER_SERVICE_URL = os.getenv("USER_SERVICE_URL", "http://user_service:8001")
+PREFERENCE_SNAPSHOT_PATH = os.getenv("PREFERENCE_SNAPSHOT_PATH", "./user_preferences.snapshot")
+PREFERENCE_JOURNAL_PATH = os.getenv("PREFERENCE_JOURNAL_PATH", f"{PREFERENCE_SNAPSHOT_PATH}.journal")
+
+logger = logging.getLogger(__name__)
+
+# Snapshot layout: magic, format version, bitmap length in bytes, then the
+# "known" bitmap followed by the "recommendations enabled" bitmap.
+_SNAPSHOT_MAGIC = b"UPRF"
+_SNAPSHOT_VERSION = 1
+_SNAPSHOT_HEADER = struct.Struct("<4sHI")
+# Journal record: user id, opt-in flag.
+_JOURNAL_RECORD = struct.Struct("<IB")
+
+
+def stream_users(prefs: Optional[str] = None) -> Iterator[dict]:
+    """
+    Stream users from user_service as NDJSON, optionally only those with the
+    given comma-separated preferences enabled, without holding the full list
+    in memory. Raises on connection or HTTP errors.
+    """
+    params = {"prefs": prefs} if prefs else None
+    with session.get(
+        f"{USER_SERVICE_URL}/users",
+        params=params,
+        headers={"Accept": "application/x-ndjson"},
+        stream=True,
+    ) as response:
+        response.raise_for_status()
+        for line in response.iter_lines():
+            if line:
+                yield json.loads(line)
+
+
+class PreferenceReplica:
+    """
+    Local copy of every user's `recommendations` opt-in flag, one bit per
+    user id. A second bitmap records which users have been seen at all so a
+    missing user can be told apart from one who opted out.
+
+    Reads are plain bytearray lookups and take no lock; writers serialise on
+    a lock and mark the replica dirty so the next snapshot picks them up.
+    Until then each update is appended to a journal and synced before
+    `set` returns, so an update whose event has been acked survives a
+    crash; loading the snapshot replays the journal and each snapshot
+    truncates it. A bootstrap leaves alone users updated by `set` while it
+    streams, as the row it read may predate the update.
+    """
+
+    def __init__(self, snapshot_path: str = PREFERENCE_SNAPSHOT_PATH, journal_path: str = PREFERENCE_JOURNAL_PATH):
+        self.snapshot_path = snapshot_path
+        self.journal_path = journal_path
+        self._known = bytearray()
+        self._enabled = bytearray()
+        self._lock = threading.Lock()
+        self._dirty = False
+        # One set per bootstrap in progress, of the users `set` has updated since it started.
+        self._bootstraps: List[Set[int]] = []
+        self.ready = False
+
+    def _grow(self, user_id: int):
+        needed = (user_id >> 3) + 1
+        if needed > len(self._known):
+            # Over-allocate so sequential registrations don't resize every time.
+            extra = max(needed, len(self._known) * 2) - len(self._known)
+            self._known.extend(bytes(extra))
+            self._enabled.extend(bytes(extra))
+
+    def _apply(self, user_id: int, enabled: bool):
+        # Caller holds the lock.
+        self._grow(user_id)
+        index, mask = user_id >> 3, 1 << (user_id & 7)
+        self._known[index] |= mask
+        if enabled:
+            self._enabled[index] |= mask
+        else:
+            self._enabled[index] &= ~mask
+        self._dirty = True
+
+    def set(self, user_id: int, enabled: bool):
+        """Record one user's flag durably. Raises OSError if the journal can't be written."""
+        with self._lock:
+            with open(self.journal_path, "ab") as f:
+                f.write(_JOURNAL_RECORD.pack(user_id, enabled))
+                f.flush()
+                os.fsync(f.fileno())
+            self._apply(user_id, enabled)
+            for updated in self._bootstraps:
+                updated.add(user_id)
+
+    def get(self, user_id: int) -> Optional[bool]:
+        """Return the user's opt-in flag, or None if the user is unknown."""
+        index, mask = user_id >> 3, 1 << (user_id & 7)
+        if index >= len(self._known) or not self._known[index] & mask:
+            return None
+        return bool(self._enabled[index] & mask)
+
+    def opted_in_user_ids(self) -> Iterator[int]:
+        """Yield the ids of users with recommendations enabled, in order, from a copy of the bitmap."""
+        enabled = bytes(self._enabled)
+        for index, byte in enumerate(enabled):
+            if byte:
+                for bit in range(8):
+                    if byte & (1 << bit):
+                        yield (index << 3) | bit
+
+    def _replay_journal(self) -> int:
+        # Caller holds the lock. A record cut short by a crash is ignored.
+        try:
+            with open(self.journal_path, "rb") as f:
+                journal = f.read()
+        except FileNotFoundError:
+            return 0
+        count = len(journal) // _JOURNAL_RECORD.size
+        for user_id, enabled in _JOURNAL_RECORD.iter_unpack(journal[:count * _JOURNAL_RECORD.size]):
+            self._apply(user_id, bool(enabled))
+        return count
+
+    def load_snapshot(self) -> bool:
+        try:
+            with open(self.snapshot_path, "rb") as f:
+                magic, version, length = _SNAPSHOT_HEADER.unpack(f.read(_SNAPSHOT_HEADER.size))
+                if magic != _SNAPSHOT_MAGIC or version != _SNAPSHOT_VERSION:
+                    logger.warning(f"Ignoring preference snapshot {self.snapshot_path} with unknown format")
+                    return False
+                known = bytearray(f.read(length))
+                enabled = bytearray(f.read(length))
+        except FileNotFoundError:
+            return False
+        except (OSError, struct.error) as e:
+            logger.error(f"Failed to load preference snapshot: {e}")
+            return False
+        if len(known) != length or len(enabled) != length:
+            logger.warning(f"Ignoring truncated preference snapshot {self.snapshot_path}")
+            return False
+
+        with self._lock:
+            self._known, self._enabled = known, enabled
+            self._dirty = False
+            replayed = self._replay_journal()
+            self.ready = True
+        logger.info(f"Loaded preference snapshot covering {length * 8} user ids and {replayed} journalled updates")
+        return True
+
+    def save_snapshot(self, force: bool = False):
+        # Held throughout, so no update can be journalled between writing
+        # the bitmaps and truncating the journal; writes take milliseconds.
+        with self._lock:
+            if not (self._dirty or force):
+                return
+            tmp_path = f"{self.snapshot_path}.tmp"
+            try:
+                with open(tmp_path, "wb") as f:
+                    f.write(_SNAPSHOT_HEADER.pack(_SNAPSHOT_MAGIC, _SNAPSHOT_VERSION, len(self._known)))
+                    f.write(self._known)
+                    f.write(self._enabled)
+                    f.flush()
+                    os.fsync(f.fileno())
+                os.replace(tmp_path, self.snapshot_path)
+                open(self.journal_path, "wb").close()
+            except OSError as e:
+                logger.error(f"Failed to write preference snapshot: {e}")
+                return
+            self._dirty = False
+
+    def bootstrap(self) -> bool:
+        """
+        Populate the replica by streaming every user from user_service. Run
+        again periodically, it also reconciles the replica with updates whose
+        events were never published or never handled.
+        """
+        count = 0
+        updated: Set[int] = set()
+        with self._lock:
+            self._bootstraps.append(updated)
+        try:
+            for user in stream_users():
+                preferences = json.loads(user["preferences"] or "{}")
+                # Not journalled: the snapshot saved below covers them.
+                with self._lock:
+                    if user["id"] not in updated:
+                        self._apply(user["id"], bool(preferences.get("recommendations")))
+                count += 1
+        except Exception as e:
+            logger.error(f"Error bootstrapping preferences: {e}")
+            return False
+        finally:
+            with self._lock:
+                self._bootstraps.remove(updated)
+        self.ready = True
+        self.save_snapshot(force=True)
+        logger.info(f"Bootstrapped preference replica with {count} users")
+        return True
+
+    def load_or_bootstrap(self) -> bool:
+        return self.load_snapshot() or self.bootstrap()
+
+
+user_preferences = PreferenceReplica()
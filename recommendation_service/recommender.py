@@ -0,0 +1,179 @@
+import logging
+import os
+import threading
+from array import array
+from typing import Dict, Iterable, Tuple
+
+import numpy as np
+import scipy.sparse as sp
+
+logger = logging.getLogger(__name__)
+
+# Upper bound on the dense score block (users x products) materialised at once
+# while scoring, so memory stays flat regardless of how many users are scored.
+SCORE_BLOCK_CELLS = int(os.getenv("RECOMMENDER_SCORE_BLOCK_CELLS", str(4_000_000)))
+
+# Popularity is blended in with a weight small enough that it only breaks
+# ties and ranks products for users without any co-purchase signal.
+POPULARITY_WEIGHT = 1e-3
+
+
+class ItemToItemRecommender:
+    """
+    Item-to-item collaborative filter over a binary user x product purchase
+    matrix. User and product ids are mapped to dense row and column indexes
+    as they are first seen, so sparse or very large ids cost no empty rows.
+
+    Purchases are buffered by `record_order` and folded in by `refresh`, which
+    updates the co-occurrence matrix with only the new user/product pairs
+    instead of recomputing X^T X from scratch. Scoring reads an immutable set
+    of matrices captured under the lock, so it never blocks on a refresh.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._refresh_lock = threading.Lock()
+        self._rows: Dict[int, int] = {}
+        self._columns: Dict[int, int] = {}
+        self._product_ids = np.empty(0, dtype=np.int64)
+        self._pending_rows = array("q")
+        self._pending_columns = array("q")
+        self._interactions = sp.csr_matrix((0, 0), dtype=np.float32)
+        self._cooccurrence = sp.csr_matrix((0, 0), dtype=np.float32)
+        self._similarity = sp.csr_matrix((0, 0), dtype=np.float32)
+        self._popularity = np.empty(0, dtype=np.float32)
+
+    @property
+    def product_count(self) -> int:
+        return len(self._product_ids)
+
+    def record_order(self, user_id: int, product_ids: Iterable[int]):
+        with self._lock:
+            for product_id in product_ids:
+                row = self._rows.get(user_id)
+                if row is None:
+                    row = self._rows[user_id] = len(self._rows)
+                column = self._columns.get(product_id)
+                if column is None:
+                    column = self._columns[product_id] = len(self._columns)
+                self._pending_rows.append(row)
+                self._pending_columns.append(column)
+
+    def refresh(self) -> int:
+        """Fold buffered purchases into the model. Returns the number of new pairs."""
+        with self._refresh_lock:
+            return self._refresh()
+
+    def _refresh(self) -> int:
+        with self._lock:
+            if not self._pending_rows:
+                return 0
+            rows = np.frombuffer(self._pending_rows, dtype=np.int64).copy()
+            columns = np.frombuffer(self._pending_columns, dtype=np.int64).copy()
+            self._pending_rows = array("q")
+            self._pending_columns = array("q")
+            user_count = len(self._rows)
+            product_ids = np.fromiter(self._columns, dtype=np.int64, count=len(self._columns))
+            interactions = self._interactions
+            cooccurrence = self._cooccurrence
+
+        shape = (user_count, len(product_ids))
+        interactions = _resized(interactions, shape)
+        cooccurrence = _resized(cooccurrence, (shape[1], shape[1]))
+
+        delta = sp.csr_matrix(
+            (np.ones(len(rows), dtype=np.float32), (rows, columns)), shape=shape
+        )
+        delta.sum_duplicates()
+        delta.data[:] = 1
+        # Only pairs the user didn't already own change the co-occurrence counts.
+        delta = (delta - delta.multiply(interactions)).tocsr()
+        delta.eliminate_zeros()
+
+        # (X + D)^T (X + D) = X^T X + X^T D + D^T X + D^T D
+        cross = (interactions.T @ delta).tocsr()
+        cooccurrence = (cooccurrence + cross + cross.T + delta.T @ delta).tocsr()
+        interactions = (interactions + delta).tocsr()
+
+        counts = cooccurrence.diagonal()
+        inverse_norm = np.zeros_like(counts)
+        np.divide(1.0, np.sqrt(counts), out=inverse_norm, where=counts > 0)
+        normaliser = sp.diags(inverse_norm)
+        similarity = (normaliser @ cooccurrence @ normaliser).tolil()
+        similarity.setdiag(0)
+        similarity = similarity.tocsr()
+        similarity.eliminate_zeros()
+        popularity = (counts / counts.max() if counts.size and counts.max() > 0 else counts).astype(np.float32)
+
+        with self._lock:
+            self._product_ids = product_ids
+            self._interactions = interactions
+            self._cooccurrence = cooccurrence
+            self._similarity = similarity.astype(np.float32)
+            self._popularity = popularity
+        return delta.nnz
+
+    def recommend(self, user_ids: Iterable[int], k: int = 1) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """
+        Score every product for a batch of users in blocks of sparse matrix
+        products and return, per user, the top-k product ids the user does
+        not already own (best first), their scores, and whether the user had
+        any co-purchase signal at all. Missing slots hold product id -1.
+        """
+        with self._lock:
+            user_rows = self._rows
+            interactions = self._interactions
+            similarity = self._similarity
+            popularity = self._popularity
+            product_ids = self._product_ids
+
+        # Users recorded since the last refresh have a row index but no row yet.
+        indexes = np.fromiter((user_rows.get(user_id, -1) for user_id in user_ids), dtype=np.int64)
+        n_users, n_products = len(indexes), len(product_ids)
+        top_products = np.full((n_users, k), -1, dtype=np.int64)
+        top_scores = np.zeros((n_users, k), dtype=np.float32)
+        personalized = np.zeros(n_users, dtype=bool)
+        if n_users == 0 or n_products == 0:
+            return top_products, top_scores, personalized
+
+        known = (indexes >= 0) & (indexes < interactions.shape[0])
+        rows = sp.csr_matrix((n_users, n_products), dtype=np.float32)
+        if known.any():
+            rows = sp.diags(known.astype(np.float32)) @ interactions[np.where(known, indexes, 0)]
+            rows = rows.tocsr()
+
+        width = min(k, n_products)
+        block = max(1, SCORE_BLOCK_CELLS // n_products)
+        for start in range(0, n_users, block):
+            stop = min(start + block, n_users)
+            owned = rows[start:stop]
+            scores = np.asarray((owned @ similarity).todense(), dtype=np.float32)
+            personalized[start:stop] = scores.max(axis=1) > 0
+            scores += POPULARITY_WEIGHT * popularity
+            owned_rows, owned_columns = owned.nonzero()
+            scores[owned_rows, owned_columns] = -np.inf
+
+            if width < n_products:
+                candidates = np.argpartition(-scores, width - 1, axis=1)[:, :width]
+            else:
+                candidates = np.broadcast_to(np.arange(n_products), scores.shape)
+            candidate_scores = np.take_along_axis(scores, candidates, axis=1)
+            order = np.argsort(-candidate_scores, axis=1)
+            candidates = np.take_along_axis(candidates, order, axis=1)
+            candidate_scores = np.take_along_axis(candidate_scores, order, axis=1)
+
+            valid = np.isfinite(candidate_scores)
+            top_products[start:stop, :width] = np.where(valid, product_ids[candidates], -1)
+            top_scores[start:stop, :width] = np.where(valid, candidate_scores, 0)
+        return top_products, top_scores, personalized
+
+
+def _resized(matrix: sp.csr_matrix, shape: Tuple[int, int]) -> sp.csr_matrix:
+    if matrix.shape == shape:
+        return matrix
+    matrix = matrix.copy()
+    matrix.resize(shape)
+    return matrix
+
+
+recommender = ItemToItemRecommender()
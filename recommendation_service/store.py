@@ -0,0 +1,215 @@
+import json
+import os
+from collections import defaultdict
+from datetime import datetime, timedelta
+from typing import Dict, List
+
+from sqlalchemy import delete, select
+from sqlalchemy.orm import Session
+
+from models import Recommendation, RecommendationList
+
+RECOMMENDATIONS_PER_USER = int(os.getenv("RECOMMENDATIONS_PER_USER", "10"))
+RECOMMENDATION_TTL_SECONDS = int(os.getenv("RECOMMENDATION_TTL_SECONDS", str(7 * 24 * 3600)))
+# Users' TTLs are shortened by up to a quarter in this many steps, by userId,
+# so users stored in the same run don't all come due for a refresh together.
+EXPIRY_SPREAD_STEPS = 64
+
+
+def expiry_for(user_id: int, now: datetime) -> datetime:
+    step = user_id % EXPIRY_SPREAD_STEPS
+    return now + timedelta(seconds=RECOMMENDATION_TTL_SECONDS * (1 - step / EXPIRY_SPREAD_STEPS / 4))
+
+
+def _insert(db: Session, table):
+    """
+    Return a dialect-specific INSERT that supports ON CONFLICT upserts, or
+    None on dialects without one; callers then delete the rows they replace
+    and insert them again.
+    """
+    dialect = db.get_bind().dialect.name
+    if dialect == "postgresql":
+        from sqlalchemy.dialects.postgresql import insert
+    elif dialect == "sqlite":
+        from sqlalchemy.dialects.sqlite import insert
+    else:
+        return None
+    return insert(table)
+
+
+def store_recommendations(db: Session, recommendations: List[dict]) -> List[int]:
+    """
+    Replace the stored recommendations of every user in `recommendations`
+    with the best RECOMMENDATIONS_PER_USER of theirs in it, so it must hold
+    each user's complete new set, and rebuild their precomputed lists. Rows
+    already stored for a product that is still recommended keep their id.
+
+    A user whose ranking (products and reasons, in order) is unchanged is
+    left alone until less than half the full TTL is left on their rows, so
+    scheduled runs over a stable model mostly read; stored scores are those
+    of the last write. As rows expire early by a userId-dependent step (see
+    `expiry_for`), users written together come due over a quarter TTL
+    rather than in one run. Returns the ids of the users written. The
+    caller owns the transaction.
+    """
+    if not recommendations:
+        return []
+    now = datetime.utcnow()
+    per_user = defaultdict(list)
+    for recommendation in recommendations:
+        per_user[recommendation["userId"]].append(recommendation)
+    for user_id, user_recommendations in per_user.items():
+        user_recommendations.sort(key=lambda recommendation: recommendation.get("score", 0.0), reverse=True)
+        del user_recommendations[RECOMMENDATIONS_PER_USER:]
+
+    rankings = {user_id: _ranking(user_recommendations) for user_id, user_recommendations in per_user.items()}
+    stored = db.execute(
+        select(RecommendationList.userId, RecommendationList.ranking)
+        .where(RecommendationList.userId.in_(list(per_user)))
+        .where(RecommendationList.expiresAt > now + timedelta(seconds=RECOMMENDATION_TTL_SECONDS / 2))
+    )
+    for user_id, ranking in stored:
+        if rankings[user_id] == ranking:
+            del per_user[user_id]
+    if not per_user:
+        return []
+
+    # Users in the same step share an expiry, so stale rows are deleted per step.
+    user_ids = sorted(per_user)
+    steps = defaultdict(list)
+    for user_id in user_ids:
+        steps[expiry_for(user_id, now)].append(user_id)
+    expires_at = {user_id: expires for expires, step_user_ids in steps.items() for user_id in step_user_ids}
+    rows = [
+        {
+            "userId": user_id,
+            "productId": recommendation["productId"],
+            "reason": recommendation["reason"],
+            "score": recommendation.get("score", 0.0),
+            "expiresAt": expires_at[user_id],
+        }
+        for user_id, user_recommendations in per_user.items()
+        for recommendation in user_recommendations
+    ]
+    upsert = _insert(db, Recommendation.__table__)
+    if upsert is None:
+        # Rows get new ids, and two transactions rescoring the same user at
+        # once may fail on the unique key; the loser's user is rescored on
+        # the next tick.
+        db.execute(
+            delete(Recommendation)
+            .where(Recommendation.userId.in_(user_ids))
+            .execution_options(synchronize_session=False)
+        )
+        db.execute(Recommendation.__table__.insert(), rows)
+    else:
+        upsert = upsert.on_conflict_do_update(
+            index_elements=["userId", "productId"],
+            set_={
+                "reason": upsert.excluded.reason,
+                "score": upsert.excluded.score,
+                "expiresAt": upsert.excluded.expiresAt,
+            },
+        )
+        db.execute(upsert, rows)
+
+        # Every row written above carries this call's expiry for its user,
+        # so any other row of these users is left over from an earlier
+        # scoring: a product that fell out of their top N, one they have
+        # since bought, or an expired one.
+        for expires, step_user_ids in steps.items():
+            db.execute(
+                delete(Recommendation)
+                .where(Recommendation.userId.in_(step_user_ids))
+                .where(Recommendation.expiresAt != expires)
+                .execution_options(synchronize_session=False)
+            )
+    _rebuild_lists(db, per_user, rankings, expires_at)
+    return user_ids
+
+
+def _ranking(recommendations: List[dict]) -> str:
+    return "\n".join(f"{recommendation['productId']} {recommendation['reason']}" for recommendation in recommendations)
+
+
+def _rebuild_lists(db: Session, recommendations: Dict[int, List[dict]], rankings: Dict[int, str],
+                   expires_at: Dict[int, datetime]):
+    # The users' rows now hold exactly `recommendations`; only their ids
+    # have to be read back.
+    ids = {
+        (user_id, product_id): recommendation_id
+        for user_id, product_id, recommendation_id in db.execute(
+            select(Recommendation.userId, Recommendation.productId, Recommendation.id)
+            .where(Recommendation.userId.in_(list(recommendations)))
+        )
+    }
+    # Entries are compact [id, productId, score, expiresAt, reason] arrays;
+    # load_recommendation_list expands them into response dicts.
+    timestamps = {expires: expires.timestamp() for expires in set(expires_at.values())}
+    payloads = [
+        {
+            "userId": user_id,
+            "payload": json.dumps([
+                [
+                    ids[user_id, recommendation["productId"]],
+                    recommendation["productId"],
+                    recommendation.get("score", 0.0),
+                    timestamps[expires_at[user_id]],
+                    recommendation["reason"],
+                ]
+                for recommendation in user_recommendations
+            ], separators=(",", ":")),
+            "ranking": rankings[user_id],
+            "expiresAt": expires_at[user_id],
+        }
+        for user_id, user_recommendations in recommendations.items()
+    ]
+    upsert = _insert(db, RecommendationList.__table__)
+    if upsert is None:
+        db.execute(
+            delete(RecommendationList)
+            .where(RecommendationList.userId.in_(list(recommendations)))
+            .execution_options(synchronize_session=False)
+        )
+        db.execute(RecommendationList.__table__.insert(), payloads)
+    else:
+        upsert = upsert.on_conflict_do_update(
+            index_elements=["userId"],
+            set_={
+                "payload": upsert.excluded.payload,
+                "ranking": upsert.excluded.ranking,
+                "expiresAt": upsert.excluded.expiresAt,
+            },
+        )
+        db.execute(upsert, payloads)
+
+
+def load_recommendation_list(db: Session, user_id: int, limit: int = RECOMMENDATIONS_PER_USER) -> List[dict]:
+    """Serve a user's recommendations with a single primary-key read."""
+    blob = db.query(RecommendationList.payload).filter(RecommendationList.userId == user_id).scalar()
+    if not blob:
+        return []
+    now = datetime.utcnow().timestamp()
+    items = []
+    for recommendation_id, product_id, score, expires_at, reason in json.loads(blob):
+        if expires_at > now:
+            items.append({
+                "id": recommendation_id,
+                "userId": user_id,
+                "productId": product_id,
+                "reason": reason,
+                "score": score,
+            })
+            if len(items) == limit:
+                break
+    return items
+
+
+def purge_expired_recommendations(db: Session) -> int:
+    """Drop expired rows for users that haven't been rescored since they expired."""
+    result = db.execute(
+        delete(Recommendation)
+        .where(Recommendation.expiresAt < datetime.utcnow())
+        .execution_options(synchronize_session=False)
+    )
+    return result.rowcount
@@ -0,0 +1,36 @@
+import os
+import sys
+import tempfile
+
+import pytest
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(HERE, ".."))
+sys.path.insert(1, os.path.join(HERE, "..", "..", "common"))
+
+# Module-level paths are read on import; keep them out of the working directory.
+_scratch = tempfile.mkdtemp(prefix="recommendation-tests-")
+os.environ.setdefault("DATABASE_URL", f"sqlite:///{os.path.join(_scratch, 'recommendation_service.db')}")
+os.environ.setdefault("PREFERENCE_SNAPSHOT_PATH", os.path.join(_scratch, "user_preferences.snapshot"))
+os.environ.setdefault("CATALOG_PATH", os.path.join(_scratch, "catalog.bin"))
+
+
+@pytest.fixture
+def engine(tmp_path):
+    from storage import create_service_engine
+
+    engine = create_service_engine(f"sqlite:///{tmp_path / 'recommendations.db'}")
+    yield engine
+    engine.dispose()
+
+
+@pytest.fixture
+def db(engine):
+    from sqlalchemy.orm import sessionmaker
+
+    from database import Base
+
+    Base.metadata.create_all(bind=engine)
+    session = sessionmaker(autocommit=False, autoflush=False, bind=engine)()
+    yield session
+    session.close()
@@ -0,0 +1,103 @@
+import pytest
+
+import preferences
+from preferences import PreferenceReplica
+
+
+@pytest.fixture
+def paths(tmp_path):
+    return str(tmp_path / "prefs.snapshot"), str(tmp_path / "prefs.snapshot.journal")
+
+
+def reopened(paths):
+    replica = PreferenceReplica(*paths)
+    assert replica.load_snapshot()
+    return replica
+
+
+def test_unknown_users_are_told_apart_from_opted_out_ones(paths):
+    replica = PreferenceReplica(*paths)
+    replica.set(3, True)
+    replica.set(4, False)
+
+    assert (replica.get(3), replica.get(4), replica.get(5), replica.get(10 ** 6)) == (True, False, None, None)
+    assert list(replica.opted_in_user_ids()) == [3]
+
+
+def test_journal_is_replayed_over_the_snapshot(paths):
+    replica = PreferenceReplica(*paths)
+    replica.set(1, True)
+    replica.set(2, True)
+    replica.save_snapshot()
+    replica.set(2, False)
+    replica.set(70000, True)
+
+    loaded = reopened(paths)
+    assert loaded.ready
+    assert (loaded.get(1), loaded.get(2), loaded.get(70000)) == (True, False, True)
+    assert list(loaded.opted_in_user_ids()) == [1, 70000]
+
+
+def test_journal_without_a_snapshot_is_not_loaded(paths):
+    replica = PreferenceReplica(*paths)
+    replica.set(1, True)
+
+    assert not PreferenceReplica(*paths).load_snapshot()
+
+
+def test_snapshot_truncates_the_journal(paths):
+    replica = PreferenceReplica(*paths)
+    replica.set(1, True)
+    replica.save_snapshot()
+
+    with open(paths[1], "rb") as f:
+        assert f.read() == b""
+    assert reopened(paths).get(1) is True
+
+
+def test_record_cut_short_by_a_crash_is_ignored(paths):
+    replica = PreferenceReplica(*paths)
+    replica.save_snapshot(force=True)
+    replica.set(1, True)
+    replica.set(2, True)
+    with open(paths[1], "r+b") as f:
+        f.truncate(preferences._JOURNAL_RECORD.size * 2 - 1)
+
+    loaded = reopened(paths)
+    assert (loaded.get(1), loaded.get(2)) == (True, None)
+
+
+def test_unknown_snapshot_format_is_ignored(paths):
+    with open(paths[0], "wb") as f:
+        f.write(preferences._SNAPSHOT_HEADER.pack(b"UPRF", 99, 0))
+
+    assert not PreferenceReplica(*paths).load_snapshot()
+
+
+def test_bootstrap_skips_users_updated_while_it_streams(paths, monkeypatch):
+    replica = PreferenceReplica(*paths)
+
+    def stream_users(prefs=None):
+        yield {"id": 1, "preferences": '{"recommendations": true}'}
+        # The event is newer than the row the stream is about to return.
+        replica.set(2, True)
+        yield {"id": 2, "preferences": '{"recommendations": false}'}
+        yield {"id": 3, "preferences": None}
+
+    monkeypatch.setattr(preferences, "stream_users", stream_users)
+
+    assert replica.bootstrap()
+    assert (replica.get(1), replica.get(2), replica.get(3)) == (True, True, False)
+    assert reopened(paths).get(2) is True
+
+
+def test_failed_bootstrap_leaves_the_replica_not_ready(paths, monkeypatch):
+    def stream_users(prefs=None):
+        yield {"id": 1, "preferences": '{"recommendations": true}'}
+        raise ConnectionError("user_service went away")
+
+    monkeypatch.setattr(preferences, "stream_users", stream_users)
+    replica = PreferenceReplica(*paths)
+
+    assert not replica.bootstrap()
+    assert not replica.ready
@@ -0,0 +1,142 @@
+from datetime import datetime, timedelta
+
+import pytest
+from sqlalchemy import inspect, select, text
+from sqlalchemy.exc import IntegrityError
+
+import store
+from models import Recommendation, RecommendationList, upgrade_schema
+from store import load_recommendation_list, store_recommendations
+
+
+def scored(user_id, product_ids, top=10.0):
+    return [
+        {"userId": user_id, "productId": product_id, "reason": "Bought together", "score": top - rank}
+        for rank, product_id in enumerate(product_ids)
+    ]
+
+
+def stored_rows(db):
+    return sorted(db.execute(select(Recommendation.userId, Recommendation.productId, Recommendation.id)).all())
+
+
+def test_kept_products_keep_their_id_and_dropped_ones_are_deleted(db):
+    store_recommendations(db, scored(1, [10, 11, 12]) + scored(2, [20]))
+    db.commit()
+    ids = {(user_id, product_id): row_id for user_id, product_id, row_id in stored_rows(db)}
+
+    assert store_recommendations(db, scored(1, [11, 13])) == [1]
+    db.commit()
+
+    rows = stored_rows(db)
+    assert [(user_id, product_id) for user_id, product_id, _ in rows] == [(1, 11), (1, 13), (2, 20)]
+    assert rows[0][2] == ids[1, 11]
+    assert [entry["productId"] for entry in load_recommendation_list(db, 1)] == [11, 13]
+    assert [entry["productId"] for entry in load_recommendation_list(db, 2)] == [20]
+
+
+def test_only_the_top_n_per_user_are_kept(db, monkeypatch):
+    monkeypatch.setattr(store, "RECOMMENDATIONS_PER_USER", 2)
+
+    store_recommendations(db, list(reversed(scored(1, [10, 11, 12]))))
+    db.commit()
+
+    assert [entry["productId"] for entry in load_recommendation_list(db, 1)] == [10, 11]
+
+
+def test_unchanged_rankings_are_not_rewritten(db):
+    assert store_recommendations(db, scored(1, [10, 11]) + scored(2, [20])) == [1, 2]
+    db.commit()
+
+    # New scores alone don't change the ranking; a new order does.
+    assert store_recommendations(db, scored(1, [10, 11], top=20.0) + scored(2, [20])) == []
+    assert store_recommendations(db, scored(1, [11, 10]) + scored(2, [20])) == [1]
+
+
+def test_rankings_past_half_their_ttl_are_refreshed(db):
+    store_recommendations(db, scored(1, [10]) + scored(2, [10]))
+    db.commit()
+    due = datetime.utcnow() + timedelta(seconds=store.RECOMMENDATION_TTL_SECONDS * 0.4)
+    db.execute(RecommendationList.__table__.update().where(RecommendationList.userId == 1).values(expiresAt=due))
+
+    assert store_recommendations(db, scored(1, [10]) + scored(2, [10])) == [1]
+
+
+def test_expiry_is_staggered_by_user(db):
+    store_recommendations(db, scored(1, [10]) + scored(2, [10]) + scored(1 + store.EXPIRY_SPREAD_STEPS, [10]))
+    db.commit()
+
+    expiry = dict(db.execute(select(RecommendationList.userId, RecommendationList.expiresAt)).all())
+    assert expiry[1] != expiry[2]
+    assert expiry[1] == expiry[1 + store.EXPIRY_SPREAD_STEPS]
+    assert all(
+        timedelta(seconds=store.RECOMMENDATION_TTL_SECONDS * 0.75) <= expires - datetime.utcnow()
+        <= timedelta(seconds=store.RECOMMENDATION_TTL_SECONDS)
+        for expires in expiry.values()
+    )
+
+
+def test_dialects_without_upsert_replace_rows(db, monkeypatch):
+    monkeypatch.setattr(store, "_insert", lambda db, table: None)
+
+    store_recommendations(db, scored(1, [10, 11]))
+    store_recommendations(db, scored(1, [11, 12]))
+    db.commit()
+
+    assert [entry["productId"] for entry in load_recommendation_list(db, 1)] == [11, 12]
+
+
+def create_legacy_tables(engine):
+    with engine.begin() as connection:
+        connection.execute(text(
+            'CREATE TABLE recommendations (id INTEGER PRIMARY KEY, "userId" INTEGER NOT NULL, '
+            '"productId" INTEGER NOT NULL, reason VARCHAR)'
+        ))
+        connection.execute(text('CREATE TABLE recommendation_lists ("userId" INTEGER PRIMARY KEY, payload TEXT NOT NULL)'))
+        connection.execute(text(
+            'INSERT INTO recommendations (id, "userId", "productId", reason) VALUES '
+            "(1, 1, 10, 'old'), (2, 1, 11, 'kept'), (3, 1, 10, 'newest'), (4, 2, 10, 'other user')"
+        ))
+        connection.execute(text("""INSERT INTO recommendation_lists VALUES (1, '[]')"""))
+
+
+def test_migration_dedupes_and_adds_the_unique_key(engine):
+    create_legacy_tables(engine)
+
+    upgrade_schema(engine, ttl_seconds=3600)
+    upgrade_schema(engine, ttl_seconds=3600)
+
+    with engine.connect() as connection:
+        rows = connection.execute(text(
+            'SELECT id, "userId", "productId", reason, score, "expiresAt" FROM recommendations ORDER BY id'
+        )).all()
+        assert [row[:4] for row in rows] == [(2, 1, 11, "kept"), (3, 1, 10, "newest"), (4, 2, 10, "other user")]
+        assert all(row[4] == 0 and row[5] is not None for row in rows)
+        list_row = connection.execute(text('SELECT ranking, "expiresAt" FROM recommendation_lists')).one()
+        assert tuple(list_row) == (None, None)
+
+    inspector = inspect(engine)
+    indexes = {index["name"]: index for index in inspector.get_indexes("recommendations")}
+    assert indexes["uq_recommendations_user_product"]["unique"]
+    assert {"ix_recommendations_userId", "ix_recommendations_expiresAt"} <= set(indexes)
+    with pytest.raises(IntegrityError):
+        with engine.begin() as connection:
+            connection.execute(text(
+                'INSERT INTO recommendations ("userId", "productId", score, "expiresAt") '
+                "VALUES (1, 11, 0, '2030-01-01 00:00:00.000000')"
+            ))
+
+
+def test_migrated_rows_are_upserted_in_place(engine, db):
+    db.close()
+    with engine.begin() as connection:
+        connection.execute(text("DROP TABLE recommendations"))
+        connection.execute(text("DROP TABLE recommendation_lists"))
+    create_legacy_tables(engine)
+    upgrade_schema(engine, ttl_seconds=3600)
+
+    # Lists written before rankings were recorded are always rewritten.
+    assert store_recommendations(db, scored(1, [10, 12])) == [1]
+    db.commit()
+
+    assert [row[1:] for row in stored_rows(db) if row[0] == 1] == [(10, 3), (12, 5)]
@@ -0,0 +1,116 @@
+import random
+import threading
+import time
+from collections import defaultdict
+
+from workers import OrderedWorkerPool
+
+
+class FakeDelivery:
+    def __init__(self):
+        self.settled = threading.Event()
+        self.acked = None
+
+    def ack(self):
+        self.acked = True
+        self.settled.set()
+
+    def nack(self, requeue=False):
+        self.acked = False
+        self.settled.set()
+
+
+def test_messages_for_one_key_are_handled_in_submission_order():
+    handled = defaultdict(list)
+    lock = threading.Lock()
+
+    def handler(message):
+        key, sequence = message
+        time.sleep(random.random() / 1000)
+        with lock:
+            handled[key].append(sequence)
+
+    pool = OrderedWorkerPool(4, handler)
+    deliveries = []
+    for sequence in range(50):
+        for key in range(10):
+            delivery = FakeDelivery()
+            deliveries.append(delivery)
+            pool.submit(key, delivery, (key, sequence))
+    for delivery in deliveries:
+        assert delivery.settled.wait(5)
+    pool.stop()
+
+    assert all(delivery.acked for delivery in deliveries)
+    assert {key: sequences for key, sequences in handled.items()} == {key: list(range(50)) for key in range(10)}
+
+
+def test_different_keys_are_handled_in_parallel():
+    release = threading.Event()
+    started = []
+
+    def handler(key):
+        started.append(key)
+        if key == "slow":
+            release.wait(5)
+
+    pool = OrderedWorkerPool(2, handler)
+    slow, fast = FakeDelivery(), FakeDelivery()
+    # Keys that hash to different workers.
+    pool.submit(0, slow, "slow")
+    pool.submit(1, fast, "fast")
+
+    assert fast.settled.wait(5)
+    assert not slow.settled.is_set()
+    release.set()
+    assert slow.settled.wait(5)
+    pool.stop()
+
+
+def test_failed_messages_are_nacked_without_requeue_and_do_not_stop_the_worker():
+    def handler(message):
+        if message == "bad":
+            raise ValueError(message)
+
+    pool = OrderedWorkerPool(1, handler)
+    bad, good = FakeDelivery(), FakeDelivery()
+    pool.submit(1, bad, "bad")
+    pool.submit(1, good, "good")
+
+    assert bad.settled.wait(5) and good.settled.wait(5)
+    assert (bad.acked, good.acked) == (False, True)
+    pool.stop()
+
+
+def test_reset_drops_pending_messages_and_waits_for_in_flight_ones():
+    release = threading.Event()
+    handled = []
+
+    def handler(message):
+        if message == "in flight":
+            release.wait(5)
+        handled.append(message)
+
+    pool = OrderedWorkerPool(1, handler)
+    in_flight, pending = FakeDelivery(), FakeDelivery()
+    pool.submit(1, in_flight, "in flight")
+    while not pool._queues[0].empty():
+        time.sleep(0.001)
+    pool.submit(1, pending, "pending")
+
+    resetting = threading.Thread(target=pool.reset)
+    resetting.start()
+    time.sleep(0.05)
+    assert resetting.is_alive()
+    release.set()
+    resetting.join(5)
+
+    assert not resetting.is_alive()
+    assert handled == ["in flight"]
+    assert not pending.settled.is_set()
+
+    # The workers keep running after a reset.
+    after = FakeDelivery()
+    pool.submit(1, after, "after")
+    assert after.settled.wait(5)
+    pool.stop()
@@ -0,0 +1,85 @@
+import logging
+import queue
+import threading
+from typing import Any, Callable, List
+
+logger = logging.getLogger(__name__)
+
+_STOP = object()
+
+
+class OrderedWorkerPool:
+    """
+    Fixed set of worker threads for processing message bus deliveries. Each
+    worker owns a FIFO queue and a message is routed by its key (the
+    userId), so events for one user are handled in the order they were
+    delivered while different users proceed in parallel.
+
+    Workers settle each delivery themselves once its handler returns; the
+    bus hands the ack/nack to the connection thread where it has to.
+    Queues are unbounded because the consumer's prefetch count already caps
+    how many deliveries can be outstanding.
+    """
+
+    def __init__(self, workers: int, handler: Callable[[Any], None], name: str = "consumer-worker"):
+        self._handler = handler
+        self._queues: List[queue.Queue] = [queue.Queue() for _ in range(workers)]
+        self._threads = [
+            threading.Thread(target=self._run, args=(q,), name=f"{name}-{index}", daemon=True)
+            for index, q in enumerate(self._queues)
+        ]
+        for thread in self._threads:
+            thread.start()
+
+    def submit(self, key: Any, delivery, message: Any):
+        self._queues[hash(key) % len(self._queues)].put((delivery, message))
+
+    def _run(self, work: queue.Queue):
+        while True:
+            item = work.get()
+            if item is _STOP:
+                return
+            if isinstance(item, threading.Event):
+                item.set()
+                continue
+            delivery, message = item
+            try:
+                self._handler(message)
+            except Exception as e:
+                logger.error(f"Error processing message: {e}")
+                delivery.nack(requeue=False)
+            else:
+                delivery.ack()
+
+    def _drop_pending(self):
+        for work in self._queues:
+            try:
+                while True:
+                    work.get_nowait()
+            except queue.Empty:
+                pass
+
+    def reset(self):
+        """
+        Drop deliveries that haven't started and wait for in-flight ones to
+        finish, keeping the workers running. Called when the connection the
+        deliveries came from is lost: RabbitMQ redelivers them on the next
+        one, and handling the stale copies as well would process each twice.
+        """
+        self._drop_pending()
+        reached = [threading.Event() for _ in self._queues]
+        for work, marker in zip(self._queues, reached):
+            work.put(marker)
+        for marker in reached:
+            marker.wait()
+
+    def stop(self):
+        """
+        Drop deliveries that haven't started (RabbitMQ redelivers them once
+        the channel closes), let in-flight ones finish and join the workers.
+        """
+        self._drop_pending()
+        for work in self._queues:
+            work.put(_STOP)
+        for thread in self._threads:
+            thread.join()
@@ -1,16 +1,27 @@
 import jwt
 import time
-from fastapi import FastAPI, Depends, HTTPException
+from fastapi import BackgroundTasks, FastAPI, Depends, HTTPException, Query, Request
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import Response, StreamingResponse
 from pydantic import BaseModel
 from sqlalchemy.orm import Session
 import json
-from typing import Dict, List
+import logging
+import os
+import threading
+from typing import Dict, Iterator, List, Optional
 
+from cache import user_cache
 from database import Base, engine, SessionLocal
-from models import User
-from passlib.hash import bcrypt
+from storage import pool_stats
+from models import PREFERENCE_KEYS, User, upgrade_schema
+from passwords import PasswordPoolSaturated, password_hasher
+from bus import publish_event
+from tracing import Tracer
 
 app = FastAPI(title="User Service")
+tracer = Tracer("user_service")
+app.middleware("http")(tracer.http_middleware)
 
 class UserCreate(BaseModel):
     name: str
@@ -31,9 +42,67 @@ class UserType(BaseModel):
     email: str
     preferences: str  
 
+USER_EXPORT_BATCH_SIZE = int(os.getenv("USER_EXPORT_BATCH_SIZE", "1000"))
+
 SECRET_KEY = "MY_SECRET_KEY"  
 ALGORITHM = "HS256"
 
+USER_PREFERENCES_QUEUE = os.getenv("USER_PREFERENCES_QUEUE", "user_preferences_queue")
+PREFERENCE_PUBLISH_RETRY_SECONDS = float(os.getenv("PREFERENCE_PUBLISH_RETRY_SECONDS", "10"))
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Users whose preference update could not be published yet.
+unpublished_preferences = set()
+unpublished_lock = threading.Lock()
+stop_republishing = threading.Event()
+
+def publish_preferences_updated(user_id: int, preferences: dict):
+    """
+    Let services that replicate preferences locally (recommendation_service)
+    know about the change. Requests schedule it as a background task, so it
+    runs after the response has been sent, and a broker outage must not fail
+    anything: the user is remembered and `republish_preferences` retries
+    with their current preferences. Retries don't survive a restart; the
+    replica's periodic reconciliation covers those.
+    """
+    try:
+        with tracer.span(f"publish {USER_PREFERENCES_QUEUE}"):
+            publish_event(USER_PREFERENCES_QUEUE, "USER_PREFERENCES_UPDATED", {
+                "userId": user_id,
+                "preferences": preferences
+            })
+    except Exception as e:
+        logger.error(f"Failed to publish preferences update for user {user_id}, will retry: {e}")
+        with unpublished_lock:
+            unpublished_preferences.add(user_id)
+        return False
+    return True
+
+def republish_preferences():
+    while not stop_republishing.wait(PREFERENCE_PUBLISH_RETRY_SECONDS):
+        with unpublished_lock:
+            user_ids = list(unpublished_preferences)
+            unpublished_preferences.clear()
+        if not user_ids:
+            continue
+        db = SessionLocal()
+        try:
+            for user_id in user_ids:
+                user = db.query(User).filter(User.id == user_id).first()
+                if user and not publish_preferences_updated(user.id, user.get_preferences()):
+                    # Still failing; the rest will go the same way.
+                    with unpublished_lock:
+                        unpublished_preferences.update(user_ids)
+                    break
+        except Exception as e:
+            logger.error(f"Error republishing preference updates: {e}")
+            with unpublished_lock:
+                unpublished_preferences.update(user_ids)
+        finally:
+            db.close()
+
 def get_db():
     db = SessionLocal()
     try:
@@ -41,39 +110,138 @@ def get_db():
     finally:
         db.close()
 
+def password_pool_busy() -> HTTPException:
+    return HTTPException(
+        status_code=503,
+        detail="Too many concurrent password operations, try again shortly",
+        headers={"Retry-After": "1"}
+    )
+
 @app.on_event("startup")
 async def startup():
+    upgrade_schema(engine)
     Base.metadata.create_all(bind=engine)
+    password_hasher.start()
+    threading.Thread(target=republish_preferences, name="preference-republisher", daemon=True).start()
+
+@app.on_event("shutdown")
+def shutdown():
+    stop_republishing.set()
+    password_hasher.shutdown()
+
+@app.get("/metrics/password-hashing")
+def get_password_hashing_metrics():
+    return password_hasher.metrics()
+
+@app.get("/metrics/user-cache")
+def get_user_cache_metrics():
+    return user_cache.metrics()
+
+@app.get("/metrics/database")
+def get_database_metrics():
+    return pool_stats(engine)
+
+def parse_preference_filter(prefs: Optional[str]) -> List[str]:
+    if not prefs:
+        return []
+    keys = [key.strip() for key in prefs.split(",") if key.strip()]
+    unknown = [key for key in keys if key not in PREFERENCE_KEYS]
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"Unknown preferences: {', '.join(unknown)}")
+    return keys
+
+def user_rows(db: Session, pref_keys: List[str], after_id: int, limit: Optional[int]):
+    columns = [User.id, User.name, User.email] + [getattr(User, key) for key in PREFERENCE_KEYS]
+    query = db.query(*columns).filter(User.id > after_id)
+    for key in pref_keys:
+        query = query.filter(getattr(User, key).is_(True))
+    query = query.order_by(User.id)
+    if limit is not None:
+        query = query.limit(limit)
+    return query.all()
+
+def user_row_to_type(row) -> UserType:
+    return UserType(
+        id=row.id,
+        name=row.name,
+        email=row.email,
+        preferences=json.dumps({key: bool(getattr(row, key)) for key in PREFERENCE_KEYS})
+    )
+
+def stream_users_ndjson(pref_keys: List[str], after_id: int, limit: Optional[int]) -> Iterator[bytes]:
+    # Owns its session: the request's get_db session is closed before a
+    # streaming body is sent. Keyset batches keep memory constant.
+    db = SessionLocal()
+    try:
+        remaining = limit
+        while remaining is None or remaining > 0:
+            batch_size = USER_EXPORT_BATCH_SIZE if remaining is None else min(USER_EXPORT_BATCH_SIZE, remaining)
+            rows = user_rows(db, pref_keys, after_id, batch_size)
+            if not rows:
+                return
+            yield "".join(user_row_to_type(row).model_dump_json() + "\n" for row in rows).encode()
+            after_id = rows[-1].id
+            if remaining is not None:
+                remaining -= len(rows)
+    finally:
+        db.close()
 
 @app.get("/users", response_model=List[UserType])  
-def get_all_users(db: Session = Depends(get_db)):
-    users = db.query(User).all()
-    return [
-        UserType(
-            id=user.id,
-            name=user.name,
-            email=user.email,
-            preferences=user.preferences
+def get_all_users(
+    request: Request,
+    prefs: Optional[str] = Query(None, description="Comma-separated preferences that must be enabled, e.g. recommendations"),
+    after_id: int = Query(0, ge=0, description="Keyset cursor: only users with a larger id are returned"),
+    limit: Optional[int] = Query(None, ge=1),
+    db: Session = Depends(get_db)
+):
+    """
+    List users in id order. Send `Accept: application/x-ndjson` to stream
+    one user per line in constant memory; otherwise a JSON array is returned
+    and clients page with `after_id` set to the last id they received.
+    """
+    pref_keys = parse_preference_filter(prefs)
+    if "application/x-ndjson" in request.headers.get("accept", ""):
+        return StreamingResponse(
+            stream_users_ndjson(pref_keys, after_id, limit),
+            media_type="application/x-ndjson"
         )
-        for user in users
-    ]
+    rows = user_rows(db, pref_keys, after_id, limit)
+    return [user_row_to_type(row) for row in rows]
 
-@app.post("/register", response_model=UserType)
-def register_user(user_data: UserCreate, db: Session = Depends(get_db)):
-    existing = db.query(User).filter(User.email == user_data.email).first()
-    if existing:
-        raise HTTPException(status_code=400, detail="Email already registered")
+def find_user_by_email(db: Session, email: str):
+    return db.query(User).filter(User.email == email).first()
 
-    hashed_password = bcrypt.hash(user_data.password)
+def create_user(db: Session, user_data: UserCreate, hashed_password: str) -> User:
     user = User(
         name=user_data.name,
         email=user_data.email,
-        hashed_password=hashed_password,
-        preferences=json.dumps(user_data.preferences)
+        hashed_password=hashed_password
     )
+    user.set_preferences(user_data.preferences)
     db.add(user)
     db.commit()
     db.refresh(user)
+    return user
+
+def update_password_hash(db: Session, user: User, hashed_password: str):
+    user.hashed_password = hashed_password
+    db.commit()
+
+# register and login are async so that waiting on the hashing pool holds no
+# threadpool thread; their short database calls still go to the threadpool.
+@app.post("/register", response_model=UserType)
+async def register_user(user_data: UserCreate, background_tasks: BackgroundTasks, db: Session = Depends(get_db)):
+    existing = await run_in_threadpool(find_user_by_email, db, user_data.email)
+    if existing:
+        raise HTTPException(status_code=400, detail="Email already registered")
+
+    try:
+        hashed_password = await password_hasher.hash(user_data.password)
+    except PasswordPoolSaturated:
+        raise password_pool_busy()
+    user = await run_in_threadpool(create_user, db, user_data, hashed_password)
+    user_cache.invalidate(user.id)
+    background_tasks.add_task(publish_preferences_updated, user.id, user.get_preferences())
     return UserType(
         id=user.id,
         name=user.name,
@@ -82,10 +250,19 @@ def register_user(user_data: UserCreate, db: Session = Depends(get_db)):
     )
 
 @app.post("/login")
-def login_user(credentials: UserLogin, db: Session = Depends(get_db)):
-    user = db.query(User).filter(User.email == credentials.email).first()
-    if not user or not bcrypt.verify(credentials.password, user.hashed_password):
+async def login_user(credentials: UserLogin, db: Session = Depends(get_db)):
+    user = await run_in_threadpool(find_user_by_email, db, credentials.email)
+    if not user:
+        raise HTTPException(status_code=401, detail="Invalid credentials")
+    try:
+        valid, new_hash = await password_hasher.verify_and_update(credentials.password, user.hashed_password)
+    except PasswordPoolSaturated:
+        raise password_pool_busy()
+    if not valid:
         raise HTTPException(status_code=401, detail="Invalid credentials")
+    if new_hash:
+        # Stored hash used a different BCRYPT_ROUNDS; upgrade it transparently.
+        await run_in_threadpool(update_password_hash, db, user, new_hash)
 
     payload = {
         "userId": user.id,  
@@ -94,28 +271,49 @@ def login_user(credentials: UserLogin, db: Session = Depends(get_db)):
     token = jwt.encode(payload, SECRET_KEY, algorithm=ALGORITHM)
     return {"token": token, "userId": user.id}  
 
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    if not if_none_match:
+        return False
+    candidates = [tag.strip() for tag in if_none_match.split(",")]
+    return "*" in candidates or etag in candidates or f"W/{etag}" in candidates
+
 @app.get("/user/{user_id}", response_model=UserType)
-def get_user_details(user_id: int, db: Session = Depends(get_db)):
-    user = db.query(User).filter(User.id == user_id).first()
-    if not user:
-        raise HTTPException(status_code=404, detail="User not found")
-    return UserType(
-        id=user.id,
-        name=user.name,
-        email=user.email,
-        preferences=user.preferences
-    )
+def get_user_details(user_id: int, request: Request, db: Session = Depends(get_db)):
+    """
+    Served from the in-process response cache when possible. Every response
+    carries an ETag; a matching `If-None-Match` gets an empty 304.
+    """
+    cached = user_cache.get(user_id)
+    if cached:
+        body, etag = cached
+    else:
+        version = user_cache.version()
+        user = db.query(User).filter(User.id == user_id).first()
+        if not user:
+            raise HTTPException(status_code=404, detail="User not found")
+        body = UserType(
+            id=user.id,
+            name=user.name,
+            email=user.email,
+            preferences=user.preferences
+        ).model_dump_json().encode()
+        etag = user_cache.put(user_id, body, version)
+    if etag_matches(request.headers.get("if-none-match"), etag):
+        return Response(status_code=304, headers={"ETag": etag})
+    return Response(content=body, media_type="application/json", headers={"ETag": etag})
 
 @app.put("/user/{user_id}/preferences", response_model=UserType)
 def update_user_preferences(
-    user_id: int, prefs: UserPreferencesUpdate, db: Session = Depends(get_db)
+    user_id: int, prefs: UserPreferencesUpdate, background_tasks: BackgroundTasks, db: Session = Depends(get_db)
 ):
     user = db.query(User).filter(User.id == user_id).first()
     if not user:
         raise HTTPException(status_code=404, detail="User not found")
-    user.preferences = json.dumps(prefs.preferences)
+    user.set_preferences(prefs.preferences)
     db.commit()
     db.refresh(user)
+    user_cache.invalidate(user_id)
+    background_tasks.add_task(publish_preferences_updated, user.id, user.get_preferences())
     return UserType(
         id=user.id,
         name=user.name,
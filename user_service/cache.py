@@ -0,0 +1,129 @@
+import hashlib
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Callable, Optional, Tuple
+
+USER_CACHE_MAX_ENTRIES = int(os.getenv("USER_CACHE_MAX_ENTRIES", "10000"))
+USER_CACHE_TTL_SECONDS = float(os.getenv("USER_CACHE_TTL_SECONDS", "60"))
+
+# Rough per-entry cost of the OrderedDict slot, key, tuple and bytes headers,
+# added to the payload sizes so the reported memory use isn't just the bodies.
+_ENTRY_OVERHEAD_BYTES = 200
+
+
+def make_etag(body: bytes) -> str:
+    return '"' + hashlib.blake2b(body, digest_size=12).hexdigest() + '"'
+
+
+class UserResponseCache:
+    """
+    Bounded LRU of serialized `GET /user/{id}` bodies and their ETags, so
+    repeat reads skip the ORM query and Pydantic serialization. Entries
+    expire after `ttl` seconds, which also bounds how stale another worker
+    process's copy can be; in this process writers call `invalidate`.
+
+    A reader takes `version()` before loading the user and passes it to
+    `put`, which drops the body if the user was invalidated in between: it
+    may have been read before the write committed. Invalidations are
+    stamped from a counter; stamps are kept for the `max_entries` most
+    recently invalidated users, and a put older than the last stamp dropped
+    is treated as stale too.
+
+    A `max_entries` of 0 disables caching.
+    """
+
+    def __init__(self, max_entries: int = USER_CACHE_MAX_ENTRIES, ttl: float = USER_CACHE_TTL_SECONDS,
+                 clock: Callable[[], float] = time.monotonic):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._clock = clock
+        self._entries: "OrderedDict[int, Tuple[bytes, str, float]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._bytes = 0
+        self._hits = 0
+        self._misses = 0
+        self._evictions = 0
+        self._invalidations = 0
+        self._version = 0
+        self._invalidated: "OrderedDict[int, int]" = OrderedDict()
+        self._forgotten = 0
+        self._stale_puts = 0
+
+    @staticmethod
+    def _size(body: bytes, etag: str) -> int:
+        return len(body) + len(etag) + _ENTRY_OVERHEAD_BYTES
+
+    def _remove(self, user_id: int):
+        body, etag, _ = self._entries.pop(user_id)
+        self._bytes -= self._size(body, etag)
+
+    def get(self, user_id: int) -> Optional[Tuple[bytes, str]]:
+        with self._lock:
+            entry = self._entries.get(user_id)
+            if entry is not None and entry[2] > self._clock():
+                self._entries.move_to_end(user_id)
+                self._hits += 1
+                return entry[0], entry[1]
+            if entry is not None:
+                self._remove(user_id)
+            self._misses += 1
+            return None
+
+    def version(self) -> int:
+        with self._lock:
+            return self._version
+
+    def put(self, user_id: int, body: bytes, version: int) -> str:
+        etag = make_etag(body)
+        if self.max_entries <= 0:
+            return etag
+        with self._lock:
+            if self._invalidated.get(user_id, self._forgotten) > version:
+                self._stale_puts += 1
+                return etag
+            if user_id in self._entries:
+                self._remove(user_id)
+            self._entries[user_id] = (body, etag, self._clock() + self.ttl)
+            self._bytes += self._size(body, etag)
+            while len(self._entries) > self.max_entries:
+                oldest = next(iter(self._entries))
+                self._remove(oldest)
+                self._evictions += 1
+        return etag
+
+    def invalidate(self, user_id: int):
+        with self._lock:
+            self._version += 1
+            self._invalidated[user_id] = self._version
+            self._invalidated.move_to_end(user_id)
+            while len(self._invalidated) > max(self.max_entries, 1):
+                _, self._forgotten = self._invalidated.popitem(last=False)
+            if user_id in self._entries:
+                self._remove(user_id)
+                self._invalidations += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def metrics(self) -> dict:
+        with self._lock:
+            lookups = self._hits + self._misses
+            return {
+                "maxEntries": self.max_entries,
+                "ttlSeconds": self.ttl,
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "hits": self._hits,
+                "misses": self._misses,
+                "hitRate": round(self._hits / lookups, 4) if lookups else None,
+                "evictions": self._evictions,
+                "invalidations": self._invalidations,
+                "stalePutsSkipped": self._stale_puts,
+            }
+
+
+user_cache = UserResponseCache()
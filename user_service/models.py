@@ -1,20 +1,61 @@
-from sqlalchemy import Column, Integer, String, Text
+from sqlalchemy import Column, Integer, String, Boolean, Index, false, inspect, text
 from database import Base
 import json
 
 
+# Preference keys exposed by the API, each stored in its own boolean column
+# so consumers can filter on them in SQL instead of parsing JSON per user.
+PREFERENCE_KEYS = ("promotions", "orderUpdates", "recommendations")
+
+
 class User(Base):
     __tablename__ = 'users'
+    __table_args__ = (
+        # Serves "all opted-in users, in id order" exports with keyset paging.
+        Index('ix_users_recommendations_id', 'recommendations', 'id'),
+    )
     id = Column(Integer, primary_key=True, index=True)
     name = Column(String, nullable=False)
     email = Column(String, unique=True, index=True, nullable=False)
     hashed_password = Column(String, nullable=False)
-    preferences = Column(Text, nullable=True)  # Store as JSON string
+    promotions = Column(Boolean, nullable=False, default=False, server_default=false())
+    orderUpdates = Column(Boolean, nullable=False, default=False, server_default=false())
+    recommendations = Column(Boolean, nullable=False, default=False, server_default=false())
 
     def get_preferences(self):
-        if self.preferences:
-            return json.loads(self.preferences)
-        return {}
+        return {key: bool(getattr(self, key)) for key in PREFERENCE_KEYS}
 
     def set_preferences(self, prefs: dict):
-        self.preferences = json.dumps(prefs)
+        for key in PREFERENCE_KEYS:
+            setattr(self, key, bool(prefs.get(key, False)))
+
+    @property
+    def preferences(self):
+        return json.dumps(self.get_preferences())
+
+
+def upgrade_schema(engine):
+    """
+    Move databases created before preferences had their own columns off the
+    legacy JSON `preferences` column. The old column is left in place (it is
+    nullable) so the upgrade never drops data.
+    """
+    inspector = inspect(engine)
+    if 'users' not in inspector.get_table_names():
+        return
+    columns = {column['name'] for column in inspector.get_columns('users')}
+    if set(PREFERENCE_KEYS) <= columns:
+        return
+    with engine.begin() as connection:
+        for key in PREFERENCE_KEYS:
+            if key not in columns:
+                connection.execute(text(f'ALTER TABLE users ADD COLUMN "{key}" BOOLEAN NOT NULL DEFAULT false'))
+        if 'preferences' in columns:
+            rows = connection.execute(text('SELECT id, preferences FROM users WHERE preferences IS NOT NULL')).fetchall()
+            for user_id, raw in rows:
+                prefs = json.loads(raw or '{}')
+                connection.execute(
+                    text('UPDATE users SET "promotions" = :promotions, "orderUpdates" = :orderUpdates, "recommendations" = :recommendations WHERE id = :id'),
+                    {"id": user_id, **{key: bool(prefs.get(key, False)) for key in PREFERENCE_KEYS}},
+                )
+        connection.execute(text('CREATE INDEX IF NOT EXISTS ix_users_recommendations_id ON users ("recommendations", id)'))
@@ -0,0 +1,114 @@
+import asyncio
+import multiprocessing
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache
+from typing import Optional, Tuple
+
+from passlib.context import CryptContext
+
+BCRYPT_ROUNDS = int(os.getenv("BCRYPT_ROUNDS", "12"))
+PASSWORD_HASH_WORKERS = int(os.getenv("PASSWORD_HASH_WORKERS", str(max(1, (os.cpu_count() or 2) // 2))))
+PASSWORD_HASH_MAX_PENDING = int(os.getenv("PASSWORD_HASH_MAX_PENDING", str(PASSWORD_HASH_WORKERS * 4)))
+
+_LATENCY_WINDOW = 1024
+
+
+class PasswordPoolSaturated(Exception):
+    """Raised instead of queueing when PASSWORD_HASH_MAX_PENDING operations are already in flight."""
+
+
+@lru_cache(maxsize=None)
+def _context(rounds: int) -> CryptContext:
+    return CryptContext(schemes=["bcrypt"], bcrypt__rounds=rounds)
+
+
+def _hash(password: str, rounds: int) -> str:
+    return _context(rounds).hash(password)
+
+
+def _verify_and_update(password: str, hashed: str, rounds: int) -> Tuple[bool, Optional[str]]:
+    # Returns a replacement hash when the stored one uses a different cost
+    # factor than BCRYPT_ROUNDS, so callers can rehash transparently.
+    return _context(rounds).verify_and_update(password, hashed)
+
+
+class PasswordHasher:
+    """
+    Runs bcrypt in a dedicated, size-limited process pool so hashing never
+    occupies the event loop or the threadpool that serves the read endpoints.
+    At most `max_pending` operations may be queued or running; beyond that
+    callers get PasswordPoolSaturated immediately instead of waiting.
+    """
+
+    def __init__(self, workers: int = PASSWORD_HASH_WORKERS, max_pending: int = PASSWORD_HASH_MAX_PENDING, rounds: int = BCRYPT_ROUNDS):
+        self.workers = workers
+        self.max_pending = max_pending
+        self.rounds = rounds
+        self._executor: Optional[ProcessPoolExecutor] = None
+        self._lock = threading.Lock()
+        self._pending = 0
+        self._completed = 0
+        self._rejected = 0
+        self._latencies = deque(maxlen=_LATENCY_WINDOW)
+
+    def start(self):
+        if self._executor is None:
+            # spawn, not fork: the server process already runs threads.
+            self._executor = ProcessPoolExecutor(
+                max_workers=self.workers, mp_context=multiprocessing.get_context("spawn")
+            )
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=True, cancel_futures=True)
+            self._executor = None
+
+    async def _run(self, fn, *args):
+        with self._lock:
+            if self._pending >= self.max_pending:
+                self._rejected += 1
+                raise PasswordPoolSaturated()
+            self._pending += 1
+        started = time.perf_counter()
+        try:
+            self.start()
+            return await asyncio.wrap_future(self._executor.submit(fn, *args))
+        finally:
+            elapsed = time.perf_counter() - started
+            with self._lock:
+                self._pending -= 1
+                self._completed += 1
+                self._latencies.append(elapsed)
+
+    async def hash(self, password: str) -> str:
+        return await self._run(_hash, password, self.rounds)
+
+    async def verify_and_update(self, password: str, hashed: str) -> Tuple[bool, Optional[str]]:
+        return await self._run(_verify_and_update, password, hashed, self.rounds)
+
+    def metrics(self) -> dict:
+        with self._lock:
+            latencies = sorted(self._latencies)
+            stats = {
+                "workers": self.workers,
+                "rounds": self.rounds,
+                "maxPending": self.max_pending,
+                "pending": self._pending,
+                "completed": self._completed,
+                "rejected": self._rejected,
+            }
+
+        def percentile(p: float) -> Optional[float]:
+            if not latencies:
+                return None
+            return round(latencies[min(len(latencies) - 1, int(p * len(latencies)))] * 1000, 2)
+
+        stats["latencyMs"] = {"p50": percentile(0.50), "p95": percentile(0.95), "p99": percentile(0.99), "samples": len(latencies)}
+        return stats
+
+
+password_hasher = PasswordHasher()
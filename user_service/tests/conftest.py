@@ -0,0 +1,11 @@
+import os
+import sys
+import tempfile
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(HERE, ".."))
+sys.path.insert(1, os.path.join(HERE, "..", "..", "common"))
+
+# Read on import: keep the database out of the working directory and events off RabbitMQ.
+os.environ.setdefault("DATABASE_URL", f"sqlite:///{os.path.join(tempfile.mkdtemp(prefix='user-tests-'), 'user_service.db')}")
+os.environ.setdefault("MESSAGE_BUS", "memory")
@@ -0,0 +1,123 @@
+import pytest
+from fastapi.testclient import TestClient
+
+import app as user_app
+from cache import UserResponseCache, make_etag
+from database import Base, SessionLocal, engine
+from models import User
+
+
+class Clock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_entries_expire_after_the_ttl():
+    clock = Clock()
+    cache = UserResponseCache(max_entries=10, ttl=5, clock=clock)
+    etag = cache.put(1, b"{}", cache.version())
+
+    assert cache.get(1) == (b"{}", etag)
+    clock.now = 5
+    assert cache.get(1) is None
+
+
+def test_least_recently_used_entry_is_evicted():
+    cache = UserResponseCache(max_entries=2, ttl=60)
+    for user_id in (1, 2):
+        cache.put(user_id, b"%d" % user_id, cache.version())
+    cache.get(1)
+    cache.put(3, b"3", cache.version())
+
+    assert (cache.get(1), cache.get(2)) == ((b"1", make_etag(b"1")), None)
+    assert cache.metrics()["evictions"] == 1
+
+
+def test_invalidate_drops_the_entry():
+    cache = UserResponseCache(max_entries=10, ttl=60)
+    cache.put(1, b"old", cache.version())
+    cache.invalidate(1)
+
+    assert cache.get(1) is None
+    assert cache.metrics()["invalidations"] == 1
+
+
+def test_body_read_before_an_invalidation_is_not_cached():
+    cache = UserResponseCache(max_entries=10, ttl=60)
+    version = cache.version()
+    cache.invalidate(1)
+
+    # Still returns the ETag of what the reader is about to send.
+    assert cache.put(1, b"stale", version) == make_etag(b"stale")
+    assert cache.get(1) is None
+    assert cache.metrics()["stalePutsSkipped"] == 1
+    # Other users and later reads are unaffected.
+    cache.put(2, b"two", version)
+    cache.put(1, b"fresh", cache.version())
+    assert cache.get(1)[0] == b"fresh" and cache.get(2)[0] == b"two"
+
+
+def test_stale_put_is_caught_after_its_invalidation_is_forgotten():
+    cache = UserResponseCache(max_entries=1, ttl=60)
+    version = cache.version()
+    cache.invalidate(1)
+    cache.invalidate(2)
+
+    cache.put(1, b"stale", version)
+    assert cache.get(1) is None
+
+
+def test_zero_entries_disables_caching():
+    cache = UserResponseCache(max_entries=0, ttl=60)
+
+    assert cache.put(1, b"{}", cache.version()) == make_etag(b"{}")
+    assert cache.get(1) is None
+
+
+@pytest.fixture
+def client():
+    Base.metadata.drop_all(bind=engine)
+    Base.metadata.create_all(bind=engine)
+    user_app.user_cache.clear()
+    db = SessionLocal()
+    user = User(name="Ada", email="ada@example.com", hashed_password="x")
+    user.set_preferences({"recommendations": True})
+    db.add(user)
+    db.commit()
+    db.close()
+    # Without a context manager, startup (hashing pool, consumers) doesn't run.
+    return TestClient(user_app.app)
+
+
+def test_user_response_carries_an_etag_and_honours_if_none_match(client):
+    first = client.get("/user/1")
+    etag = first.headers["ETag"]
+    assert first.status_code == 200
+    assert first.json()["preferences"] == '{"promotions": false, "orderUpdates": false, "recommendations": true}'
+
+    cached = client.get("/user/1", headers={"If-None-Match": etag})
+    assert cached.status_code == 304
+    assert cached.content == b""
+    assert cached.headers["ETag"] == etag
+    assert client.get("/user/1", headers={"If-None-Match": f'"other", W/{etag}'}).status_code == 304
+    assert client.get("/user/1", headers={"If-None-Match": '"other"'}).status_code == 200
+
+
+def test_preference_update_invalidates_the_cached_response(client):
+    etag = client.get("/user/1").headers["ETag"]
+
+    updated = client.put("/user/1/preferences", json={"preferences": {"promotions": True}})
+    assert updated.status_code == 200
+
+    response = client.get("/user/1", headers={"If-None-Match": etag})
+    assert response.status_code == 200
+    assert response.headers["ETag"] != etag
+    assert response.json()["preferences"] == '{"promotions": true, "orderUpdates": false, "recommendations": false}'
+
+
+def test_missing_user_is_not_cached(client):
+    assert client.get("/user/2").status_code == 404
+    assert user_app.user_cache.get(2) is None